@@ -1,5 +1,5 @@
 from django.apps import AppConfig
-import threading
+import os
 import sys
 
 class DashboardConfig(AppConfig):
@@ -7,14 +7,20 @@ class DashboardConfig(AppConfig):
     name = 'dashboard'
 
     def ready(self):
-        # Only start scheduler if running the development or production server
+        # Only start the scheduler and prefetcher if running the development or production server
         # Avoid starting during migrations, shell, etc.
         skip_commands = [
             'makemigrations', 'migrate', 'collectstatic', 'shell', 'test', 'createsuperuser', 'loaddata', 'dumpdata'
         ]
         if any(cmd in sys.argv for cmd in skip_commands):
             return
-        if 'runserver' in sys.argv or 'gunicorn' in sys.argv:
-            from .views import reddit_scheduler
-            scheduler_thread = threading.Thread(target=reddit_scheduler, daemon=True)
-            scheduler_thread.start()
+        servers = ['gunicorn', 'uvicorn', 'daphne']
+        if 'runserver' in sys.argv or os.path.basename(sys.argv[0]) in servers:
+            from .archive import archive_writer
+            from .media import thumbnailer
+            from .prefetch import prefetcher
+            from .scheduler import schedule_engine
+            schedule_engine.start()
+            prefetcher.start()
+            thumbnailer.start()
+            archive_writer.start()
@@ -0,0 +1,310 @@
+"""
+Local archive of the Discord messages and Reddit posts the dashboard fetches.
+
+The fetch paths hand every page they get from Discord or Reddit to
+``archive_writer``, which only buffers it: a background thread (started with
+the scheduler, see apps.py) upserts the buffered rows in batches, one
+transaction every ``interval`` seconds, so requests never wait on archive
+writes. If the buffer grows past ``max_pending`` the oldest rows are
+dropped; the archive is a copy of upstream data, and anything missing is
+fetched again when someone asks for it.
+
+History pages are read from the archive by following ``prev_id`` links
+(see models.py) from the cursor. Where the chain breaks, i.e. the archive
+has a gap, the rest of the page is fetched from Discord or Reddit and
+archived along with its links, so the next reader finds the gap filled.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from .metrics import ARCHIVE_PENDING, ARCHIVE_ROWS
+from .models import ArchivedDiscordMessage, ArchivedRedditPost
+from .reddit_posts import RedditPost, posts_from_listing
+
+logger = logging.getLogger(__name__)
+
+KINDS = {ArchivedDiscordMessage: 'discord', ArchivedRedditPost: 'reddit'}
+
+POST_FIELDS = (
+    'title', 'author', 'score', 'url', 'selftext', 'selftext_truncated', 'media_type', 'media_url',
+    'permalink', 'num_comments', 'created_utc',
+)
+
+# Columns refreshed when an archived item is fetched again.
+UPDATE_FIELDS = {
+    ArchivedDiscordMessage: ['author', 'avatar', 'content'],
+    ArchivedRedditPost: ['title', 'score', 'selftext', 'selftext_truncated', 'full_selftext', 'media_type',
+                         'media_url', 'num_comments'],
+}
+
+
+# ----- Rows from fetched pages -----
+def discord_rows(channel_id, messages, after=None, limit=None):
+    """
+    Archive rows for one page of ``messages`` (oldest first), fetched with
+    ``limit`` and, if given, the ``after`` cursor.
+    """
+    if after is not None:
+        prev = int(after)
+    elif limit is not None and len(messages) < limit:
+        prev = 0  # a short page reaches back to the start of the channel
+    else:
+        prev = None
+    rows = []
+    for msg in messages:
+        author = msg['author']
+        rows.append(ArchivedDiscordMessage(
+            id=int(msg['id']), channel_id=channel_id, prev_id=prev,
+            author_id=author['id'], author=author['username'], avatar=author.get('avatar') or '',
+            content=msg.get('content') or '', timestamp=parse_datetime(msg['timestamp']),
+        ))
+        prev = int(msg['id'])
+    return rows
+
+
+def reddit_rows(subreddit, posts, listing, chronological=False, limit=None):
+    """
+    Archive rows for a page of RedditPost records, built from the raw
+    ``listing`` data, which has the full self text the records only keep a
+    preview of. Only pages of the ``new`` listing are ``chronological``, so
+    only they link each post to the next.
+    """
+    full_selftexts = {
+        child['data']['id']: child['data'].get('selftext') or ''
+        for child in listing['children'] if child.get('kind') == 't3'
+    }
+    rows = []
+    for i, post in enumerate(posts):
+        prev = None
+        if chronological:
+            if i + 1 < len(posts):
+                prev = posts[i + 1].id
+            elif limit is not None and len(posts) < limit:
+                prev = ''
+        rows.append(ArchivedRedditPost(
+            id=post.id, number=int(post.id, 36), subreddit=subreddit, prev_id=prev,
+            full_selftext=full_selftexts.get(post.id, post.selftext),
+            **{field: getattr(post, field) for field in POST_FIELDS}
+        ))
+    return rows
+
+
+def message_from_row(row):
+    """The Discord API's shape of an archived message, as the views serialize it."""
+    return {
+        'id': str(row.id),
+        'content': row.content,
+        'author': {'id': row.author_id, 'username': row.author, 'avatar': row.avatar or None},
+        'timestamp': row.timestamp.isoformat(),
+    }
+
+
+def post_from_row(row):
+    return RedditPost(id=row.id, name=f't3_{row.id}', **{field: getattr(row, field) for field in POST_FIELDS})
+
+
+# ----- Write-behind -----
+class ArchiveWriter:
+    def __init__(self, batch_size=500, interval=1, max_pending=50000):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()  # (model, pk) -> row, oldest first
+        self._links = {}  # (model, pk) -> prev_id, for rows that may already be written
+        self._wake = threading.Event()
+        self._thread = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._thread = threading.Thread(target=self.run, name='archive-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _after_fork(self):
+        # The parent writes what it had buffered.
+        was_running = self._thread is not None
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._links = {}
+        self._wake = threading.Event()
+        self._thread = None
+        if was_running:
+            self.start()
+
+    def run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def add(self, rows):
+        """Buffer ``rows`` to be written; never blocks on the database."""
+        with self._lock:
+            for row in rows:
+                key = (type(row), row.pk)
+                old = self._pending.pop(key, None)
+                if row.prev_id is None and old is not None:
+                    row.prev_id = old.prev_id  # keep a link learnt from another page
+                self._pending[key] = row
+            while len(self._pending) > self.max_pending:
+                (model, _), _ = self._pending.popitem(last=False)
+                ARCHIVE_ROWS.inc(kind=KINDS[model], result='dropped')
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def link(self, model, pk, prev_id):
+        """Record that ``prev_id`` is the item just older than ``pk``."""
+        with self._lock:
+            row = self._pending.get((model, pk))
+            if row is not None:
+                row.prev_id = prev_id
+            else:
+                self._links[model, pk] = prev_id
+
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Write everything buffered so far."""
+        with self._lock:
+            rows, self._pending = list(self._pending.values()), OrderedDict()
+            links, self._links = self._links, {}
+        if not rows and not links:
+            return
+        by_model = {}
+        for row in rows:
+            by_model.setdefault(type(row), []).append(row)
+        try:
+            with transaction.atomic():
+                for model, model_rows in by_model.items():
+                    for i in range(0, len(model_rows), self.batch_size):
+                        self._write(model, model_rows[i:i + self.batch_size])
+                for (model, pk), prev_id in links.items():
+                    model.objects.filter(pk=pk).update(prev_id=prev_id)
+        except Exception as e:
+            logger.warning("Error writing %d rows to the archive: %s", len(rows), e)
+            for model, model_rows in by_model.items():
+                ARCHIVE_ROWS.inc(len(model_rows), kind=KINDS[model], result='dropped')
+        else:
+            for model, model_rows in by_model.items():
+                ARCHIVE_ROWS.inc(len(model_rows), kind=KINDS[model], result='written')
+        finally:
+            close_old_connections()
+
+    def _write(self, model, rows):
+        unique_fields = ['id'] if connection.features.supports_update_conflicts_with_target else None
+        model.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=unique_fields, update_fields=UPDATE_FIELDS[model],
+        )
+        # Links are set here rather than in the upsert so that a page which
+        # doesn't show an item's predecessor never clears a known link.
+        model.objects.bulk_update([row for row in rows if row.prev_id is not None], ['prev_id'])
+
+
+# ----- History -----
+def _follow(prev, candidates, limit):
+    """
+    Take rows from ``candidates`` (newest first) while each one is the
+    previous one's ``prev_id``. Returns the rows and the last ``prev_id``:
+    falsy but not None at the start of the channel or subreddit.
+    """
+    rows = []
+    for row in candidates:
+        if len(rows) == limit or not prev or row.pk != prev:
+            break
+        rows.append(row)
+        prev = row.prev_id
+    return rows, prev
+
+
+def _at_start(prev):
+    return prev is not None and not prev
+
+
+def discord_history(channel_id, before, limit, fetch_page):
+    """
+    Up to ``limit`` of the channel's messages older than the snowflake
+    ``before``, oldest first, and whether there are older ones. Returns None
+    if the archive has a gap and Discord can't fill it.
+
+    ``fetch_page(before, limit)`` returns a page from Discord, oldest first,
+    or None; it is only called where the archive has a gap.
+    """
+    before = int(before)
+    archived = ArchivedDiscordMessage.objects.filter(channel_id=channel_id)
+    prev = archived.filter(pk=before).values_list('prev_id', flat=True).first()
+    candidates = archived.filter(pk__lt=before).order_by('-pk')[:limit] if prev else []
+    rows, prev = _follow(prev, candidates, limit)
+    messages = [message_from_row(row) for row in reversed(rows)]
+    if len(rows) == limit or _at_start(prev):
+        return messages, not _at_start(prev)
+
+    cursor = rows[-1].pk if rows else before
+    page = fetch_page(cursor, limit)
+    if page is None:
+        return (messages, True) if messages else None
+    archive_writer.add(discord_rows(channel_id, page, limit=limit))
+    archive_writer.link(ArchivedDiscordMessage, cursor, int(page[-1]['id']) if page else 0)
+    older = page[max(len(page) - (limit - len(rows)), 0):]
+    return older + messages, len(page) == limit or len(older) < len(page)
+
+
+def reddit_history(subreddit, before, limit, fetch_page):
+    """
+    Up to ``limit`` of the subreddit's posts older than post ``before`` (an
+    id without "t3_", or None for the newest), newest first, and whether
+    there are older ones. Returns None if the archive has a gap and Reddit
+    can't fill it.
+
+    ``fetch_page(after, limit)`` returns the raw ``data`` of the ``new``
+    listing after post ``after``, or None; it is only called where the
+    archive has a gap.
+    """
+    archived = ArchivedRedditPost.objects.filter(subreddit=subreddit)
+    rows, prev = [], None
+    if before:
+        start = archived.filter(pk=before).values_list('prev_id', 'created_utc').first()
+        if start is not None and start[0]:
+            candidates = archived.filter(created_utc__lte=start[1]).exclude(pk=before).order_by('-created_utc')
+            rows, prev = _follow(start[0], candidates[:limit], limit)
+        elif start is not None:
+            prev = start[0]
+    posts = [post_from_row(row) for row in rows]
+    if len(rows) == limit or _at_start(prev):
+        return posts, not _at_start(prev)
+
+    cursor = rows[-1].pk if rows else before
+    listing = fetch_page(cursor, limit)
+    if listing is None:
+        return (posts, True) if posts else None
+    page = posts_from_listing(listing)
+    archive_writer.add(reddit_rows(subreddit, page, listing, chronological=True, limit=limit))
+    if cursor:
+        archive_writer.link(ArchivedRedditPost, cursor, page[0].id if page else '')
+    needed = limit - len(rows)
+    return posts + page[:needed], len(page) == limit or needed < len(page)
+
+
+archive_writer = ArchiveWriter(
+    batch_size=getattr(settings, 'ARCHIVE_BATCH_SIZE', 500),
+    interval=getattr(settings, 'ARCHIVE_FLUSH_INTERVAL', 1),
+    max_pending=getattr(settings, 'ARCHIVE_MAX_PENDING', 50000),
+)
+
+ARCHIVE_PENDING.set_function(lambda: {(): archive_writer.pending()})
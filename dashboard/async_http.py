@@ -0,0 +1,41 @@
+"""
+Pooled aiohttp session for the async (ASGI) views.
+
+One session, and so one connection pool, is kept per event loop and shared
+by the async Discord and Reddit clients.
+"""
+import asyncio
+import weakref
+
+from django.conf import settings
+
+try:
+    import aiohttp
+except ImportError:  # only needed when serving the async views
+    aiohttp = None
+
+_sessions = weakref.WeakKeyDictionary()  # event loop -> aiohttp.ClientSession
+
+
+def get_session():
+    if aiohttp is None:
+        raise RuntimeError("The async views require aiohttp.")
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=getattr(settings, 'ASYNC_HTTP_POOL_SIZE', 1000),
+            ttl_dns_cache=300,
+        )
+        session = _sessions[loop] = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=getattr(settings, 'ASYNC_HTTP_TIMEOUT', 10)),
+        )
+    return session
+
+
+async def close_sessions():
+    """Close the current loop's session (e.g. on ASGI lifespan shutdown)."""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
@@ -0,0 +1,183 @@
+"""
+Async versions of the views that wait on Discord or Reddit.
+
+Under ASGI (see social_dashboard/asgi.py) urls.py routes the upstream-bound
+endpoints here, so a slow upstream response parks a coroutine instead of a
+worker thread. Upstream calls go through the shared aiohttp session in
+async_http.py, and the responses and caches are the same as the sync views'.
+"""
+import asyncio
+
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+
+from . import archive
+from .archive import archive_writer
+from .async_http import aiohttp
+from .discord_api import RateLimited, async_discord_client
+from .models import Source, UserProfile
+from .prefetch import prefetcher
+from .profiles import aget_profile
+from .reddit_api import RedditAPIError, async_reddit_client
+from .sources import aget_sources
+from .views import (
+    DISCORD_MESSAGE_WINDOW, FEED_TIMEOUT, REDDIT_PAGE_SIZE, _channel_refresher, _discord_messages_response,
+    _feed_response, _feed_sources, _hot_page_from_listing, _hot_page_refresher, _requested_source,
+    _selftext_from_listing, discord_message_cache, reddit_listing_cache, reddit_selftext_cache,
+)
+
+UPSTREAM_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, RateLimited) if aiohttp else (RateLimited,)
+
+async def _get_profile(request):
+    return await aget_profile(await request.auser())
+
+async def _prefetched(cache, key, refresh, arefresh):
+    """
+    prefetcher.get() for the async views: a miss is fetched with the
+    coroutine ``arefresh``, while background refreshes use the sync
+    ``refresh`` on the prefetcher's threads.
+    """
+    value = prefetcher.cached(cache, key, refresh)
+    if value is None:
+        value = await cache.aget_or_refresh(key, arefresh)
+    return value
+
+# ----- Discord API fetch messages -----
+async def _get_channel_messages(bot_token, channel_id, after=None):
+    try:
+        response = await async_discord_client.get_messages(
+            bot_token, channel_id, limit=DISCORD_MESSAGE_WINDOW, after=after
+        )
+    except UPSTREAM_ERRORS:
+        return None
+    if response.status_code != 200:
+        return None
+    messages = sorted(response.data, key=lambda msg: int(msg["id"]))
+    archive_writer.add(archive.discord_rows(channel_id, messages, after=after, limit=DISCORD_MESSAGE_WINDOW))
+    return messages
+
+async def _refresh_channel_window(bot_token, channel_id, window):
+    # Same as views._refresh_channel_window.
+    if not window:
+        return await _get_channel_messages(bot_token, channel_id)
+    new = await _get_channel_messages(bot_token, channel_id, after=window[-1]["id"])
+    if new is None:
+        return None
+    if len(new) >= DISCORD_MESSAGE_WINDOW:
+        return await _get_channel_messages(bot_token, channel_id)
+    return (window + new)[-DISCORD_MESSAGE_WINDOW:]
+
+@login_required
+async def fetch_discord_messages(request):
+    after = request.GET.get('after')
+    if after and not after.isdigit():
+        return JsonResponse({"success": False, "error": "Invalid cursor."})
+    try:
+        profile = await _get_profile(request)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({"success": False, "error": "Profile not found."})
+    channel_id = _requested_source(request, profile, Source.DISCORD, await aget_sources(profile.user_id))
+    if channel_id is None:
+        return JsonResponse({"success": False, "error": "Not subscribed to this channel."})
+    token = profile.discord_bot_token
+    window = await _prefetched(
+        discord_message_cache, (channel_id, token), _channel_refresher(token, channel_id),
+        lambda stale: _refresh_channel_window(token, channel_id, stale),
+    )
+    return _discord_messages_response(request, window, after)
+
+# ----- Reddit fetch posts -----
+async def _get_hot_page(profile, subreddit_name, after):
+    params = {'limit': REDDIT_PAGE_SIZE}
+    if after:
+        params['after'] = after
+    listing = await async_reddit_client.get_listing(
+        profile.reddit_client_id, profile.reddit_client_secret, profile.reddit_user_agent,
+        f'/r/{subreddit_name}/hot', params,
+    )
+    page = _hot_page_from_listing(listing)
+    archive_writer.add(archive.reddit_rows(subreddit_name, page['posts'], listing))
+    return page
+
+@login_required
+async def fetch_reddit_posts(request):
+    try:
+        profile = await _get_profile(request)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Reddit profile not found'})
+
+    subreddit = _requested_source(request, profile, Source.REDDIT, await aget_sources(profile.user_id))
+    if subreddit is None:
+        return JsonResponse({'success': False, 'error': 'Not subscribed to this subreddit'})
+    after = request.GET.get('after') or None
+    try:
+        if after is None:
+            page = await _prefetched(
+                reddit_listing_cache, (subreddit, None), _hot_page_refresher(profile, subreddit),
+                lambda stale: _get_hot_page(profile, subreddit, None),
+            )
+        else:
+            page = await reddit_listing_cache.aget_or_refresh(
+                (subreddit, after), lambda stale: _get_hot_page(profile, subreddit, after),
+            )
+    except RedditAPIError:
+        return JsonResponse({'success': False, 'error': 'Failed to fetch Reddit posts'})
+
+    return JsonResponse({'success': True, 'posts': [post.as_dict() for post in page['posts']], 'after': page['after']})
+
+@login_required
+async def fetch_reddit_selftext(request, post_id):
+    if not post_id.isalnum():
+        return JsonResponse({'success': False, 'error': 'Invalid post ID'})
+    try:
+        profile = await _get_profile(request)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Reddit profile not found'})
+
+    async def fetch(stale):
+        listing = await async_reddit_client.get_listing(
+            profile.reddit_client_id, profile.reddit_client_secret, profile.reddit_user_agent,
+            f'/by_id/t3_{post_id}', {},
+        )
+        return _selftext_from_listing(listing)
+
+    try:
+        selftext = await reddit_selftext_cache.aget_or_refresh(post_id, fetch)
+    except RedditAPIError:
+        return JsonResponse({'success': False, 'error': 'Failed to fetch Reddit post'})
+    if selftext is None:
+        return JsonResponse({'success': False, 'error': 'Post not found'})
+    return JsonResponse({'success': True, 'selftext': selftext})
+
+# ----- Aggregated feed -----
+async def _fetch_feed_source(profile, kind, name):
+    if kind == 'discord':
+        token = profile.discord_bot_token
+        return await _prefetched(
+            discord_message_cache, (name, token), _channel_refresher(token, name),
+            lambda stale: _refresh_channel_window(token, name, stale),
+        )
+    try:
+        return await _prefetched(
+            reddit_listing_cache, (name, None), _hot_page_refresher(profile, name),
+            lambda stale: _get_hot_page(profile, name, None),
+        )
+    except RedditAPIError:
+        return None
+
+@login_required
+async def fetch_feed(request):
+    try:
+        profile = await _get_profile(request)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Profile not found.'})
+
+    sources = _feed_sources(profile, await aget_sources(profile.user_id))
+    fetched = await asyncio.gather(
+        *(asyncio.wait_for(_fetch_feed_source(profile, kind, name), FEED_TIMEOUT) for kind, name in sources),
+        return_exceptions=True,
+    )
+    return _feed_response([
+        (kind, name, None if isinstance(result, BaseException) else result)
+        for (kind, name), result in zip(sources, fetched)
+    ])
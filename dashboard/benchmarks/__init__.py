@@ -0,0 +1,40 @@
+"""
+Performance benchmarks, run with ``manage.py benchmark <name>``.
+
+Benchmarks that need data run against a throwaway database created the same
+way as the test database, so they never touch the real one.
+"""
+import statistics
+from contextlib import contextmanager
+
+from django.db import connection
+
+# name -> module; each module provides add_arguments(parser) and run(options, stdout)
+BENCHMARKS = {
+    'due_queries': 'dashboard.benchmarks.due_queries',
+    'load': 'dashboard.benchmarks.load',
+    'upstream_views': 'dashboard.benchmarks.upstream_views',
+}
+
+
+@contextmanager
+def scratch_database():
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def median(samples):
+    return statistics.median(samples) if samples else 0.0
@@ -0,0 +1,107 @@
+"""
+Latency of the scheduler's due-work queries as the schedule tables grow.
+
+Tables are filled with history (mostly sent, some given up on) plus a fixed
+number of pending rows, a tenth of them leased by another process. The
+engine's own queries are timed: loading the pending rows, claiming a batch of
+due rows, and finding the rows leased elsewhere that may hold a batch back.
+With the partial (status, scheduled_time) indexes in place latency should
+stay flat however much history accumulates.
+"""
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+
+from dashboard.models import UserProfile
+from dashboard.scheduler import DiscordMessageJob, RedditPostJob, ScheduleEngine, _pending
+
+from . import median, scratch_database
+
+# Share of history rows that failed rather than being sent.
+FAILED_SHARE = 0.01
+
+
+def add_arguments(parser):
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000],
+                        help="Table sizes to measure at, e.g. 10000 100000 1000000.")
+    parser.add_argument('--pending', type=int, default=1000, help="Unsent rows per table.")
+    parser.add_argument('--claim', type=int, default=100, help="Due rows claimed per batch.")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--explain', action='store_true', help="Print each query's plan.")
+
+
+def run(options, stdout):
+    with scratch_database():
+        user = User.objects.create_user('benchmark')
+        UserProfile.objects.create(user=user)
+        jobs = [
+            (RedditPostJob(), lambda **kw: RedditPostJob.model(user=user, title='t', **kw)),
+            (DiscordMessageJob(), lambda **kw: DiscordMessageJob.model(user=user, message='m', **kw)),
+        ]
+        engine = ScheduleEngine([job for job, _ in jobs], max_workers=1)
+        now = timezone.now()
+        elsewhere = uuid.uuid4().hex
+        for job, build in jobs:
+            job.model.objects.bulk_create(
+                [build(scheduled_time=now + timedelta(minutes=random.randint(-60, 60)), **{job.done_field: False})
+                 for _ in range(options['pending'])],
+                batch_size=5000,
+            )
+            leased = job.model.objects.order_by('?').values_list('pk', flat=True)[:options['pending'] // 10]
+            job.model.objects.filter(pk__in=list(leased)).update(
+                claim_token=elsewhere, claimed_until=now + timedelta(days=1)
+            )
+
+        stdout.write(f"{'rows':>10}  {'table':<24} {'load (ms)':>10} {'claim (ms)':>11} {'hold back (ms)':>15}")
+        for size in sorted(options['sizes']):
+            for job, build in jobs:
+                _fill_history(job, build, size, now)
+                due = list(
+                    _pending(job).filter(scheduled_time__lte=now, claimed_until__isnull=True)
+                    .order_by('scheduled_time').values_list('pk', flat=True)[:options['claim']]
+                )
+
+                def release():
+                    job.model.objects.filter(pk__in=due).update(claim_token='', claimed_until=None)
+
+                load_ms = _time(lambda: engine._load(job), options['repeat'])
+                claim_ms = _time(lambda: engine.claim(job, due), options['repeat'], setup=release)
+                hold_back_ms = _time(lambda: list(engine._blocked(job, '')), options['repeat'])
+                release()
+                stdout.write(f"{size:>10}  {job.model.__name__:<24} {load_ms:>10.2f} {claim_ms:>11.2f} "
+                             f"{hold_back_ms:>15.2f}")
+                if options['explain']:
+                    stdout.write(_pending(job).order_by('scheduled_time')[:engine.batch_size].explain())
+                    stdout.write(engine._blocked(job, '').explain())
+
+
+def _fill_history(job, build, size, now):
+    missing = size - job.model.objects.count()
+    while missing > 0:
+        chunk = min(missing, 20_000)
+        job.model.objects.bulk_create(
+            [build(scheduled_time=now - timedelta(minutes=random.randint(60, 525_600)),
+                   **({'failed': True} if random.random() < FAILED_SHARE else {job.done_field: True}))
+             for _ in range(chunk)],
+            batch_size=5000,
+        )
+        missing -= chunk
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+
+def _time(fn, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return median(samples)
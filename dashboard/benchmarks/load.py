@@ -0,0 +1,318 @@
+"""
+Simulated dashboards and scheduler load against a stub of the upstream APIs.
+
+``--dashboards`` dashboards log in, load the feed, then poll their Discord
+channel and subreddit every ``--poll-interval`` seconds, sending a message
+every ``--send-every`` polls, for ``--duration`` seconds. They go through
+the whole Django stack (middleware, URLs, sessions, auth) with the test
+client: as threads against the sync views, or with DASHBOARD_ASGI=1 as
+tasks against the async views. Dashboards share ``--sources`` channels and
+subreddits, so the caches and the prefetcher see realistic overlap.
+
+Then ``--scheduled`` Reddit posts and Discord messages, all due at once, are
+drained by a ScheduleEngine.
+
+The stub answers after ``--latency`` ms and can inject 503s (``--error-rate``)
+and 429s (``--rate-limit-every``). ``--save`` writes the results as JSON, and
+``--compare`` checks them against a saved run: the command fails if any
+throughput drops, or p99 latency grows, by more than ``--tolerance``.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from dashboard import async_http, views
+from dashboard.models import DiscordMessageSchedule, RedditPostSchedule, UserProfile
+from dashboard.prefetch import prefetcher
+from dashboard.scheduler import DiscordMessageJob, RedditPostJob, ScheduleEngine
+
+from . import median, percentile, scratch_database
+from .stubs import UpstreamStub
+from .upstream_views import _point_clients_at
+
+
+def add_arguments(parser):
+    parser.add_argument('--dashboards', type=int, default=50, help="Concurrent simulated dashboards.")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds each dashboard keeps polling.")
+    parser.add_argument('--poll-interval', type=float, default=1, help="Seconds between a dashboard's polls.")
+    parser.add_argument('--send-every', type=int, default=10, help="Send a message every N polls (0: never).")
+    parser.add_argument('--sources', type=int, default=10, help="Distinct channels/subreddits shared by dashboards.")
+    parser.add_argument('--scheduled', type=int, default=500, help="Scheduled items to drain (0: skip).")
+    parser.add_argument('--latency', type=float, default=100, help="Stub response time in ms.")
+    parser.add_argument('--error-rate', type=float, default=0, help="Fraction of stub responses that are 503s.")
+    parser.add_argument('--rate-limit-every', type=int, default=0, help="Every Nth stub response is a 429.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='PATH', help="Write the results to PATH as JSON.")
+    parser.add_argument('--compare', metavar='PATH', help="Fail on a regression against saved results.")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+
+
+def run(options, stdout):
+    random.seed(options['seed'])
+    stub = UpstreamStub(
+        latency=options['latency'] / 1000, error_rate=options['error_rate'],
+        rate_limit_every=options['rate_limit_every'], seed=options['seed'],
+    )
+    # The test client's requests are for host 'testserver'.
+    allowed_hosts = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'])
+    with scratch_database(), stub, allowed_hosts:
+        restore = _point_clients_at(stub.base_url)
+        try:
+            users = _create_users(options['dashboards'], options['sources'])
+            views.discord_message_cache.clear()
+            views.reddit_listing_cache.clear()
+            prefetcher.start()  # as under runserver/gunicorn/uvicorn
+
+            mode = 'async' if settings.DASHBOARD_ASGI else 'sync'
+            results = {'mode': mode}
+            samples = (_run_async if mode == 'async' else _run_sync)(users, options)
+            results['endpoints'] = {name: _summary(calls) for name, calls in sorted(samples.items())}
+            dashboard_calls = dict(stub.calls)
+
+            if options['scheduled']:
+                before = stub.requests
+                results['scheduler'] = _drain_schedules(users, options['scheduled'])
+                results['scheduler']['upstream_calls'] = stub.requests - before
+        finally:
+            restore()
+
+    _report(stdout, mode, options, results, dashboard_calls)
+    if options['save']:
+        with open(options['save'], 'w') as f:
+            json.dump(results, f, indent=2)
+    if options['compare']:
+        with open(options['compare']) as f:
+            regressions = _regressions(json.load(f), results, options['tolerance'])
+        if regressions:
+            raise CommandError("Performance regressions:\n" + '\n'.join(regressions))
+        stdout.write(f"No regressions against {options['compare']}.")
+
+
+def _create_users(count, sources):
+    users = []
+    for i in range(count):
+        user = User.objects.create_user(f'load{i}', password='load')
+        # save() subscribes the user to their channel and subreddit.
+        UserProfile.objects.create(
+            user=user,
+            discord_bot_token='token',
+            discord_channel_id=str(1000 + i % sources),
+            reddit_client_id=f'client{i % sources}',
+            reddit_client_secret='secret',
+            reddit_user_agent='load benchmark',
+            reddit_subreddit=f'sub{i % sources}',
+        )
+        users.append(user)
+    return users
+
+
+class _Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)  # view name -> [(ms, ok)]
+        self.elapsed = None
+
+    def add(self, name, start, response):
+        """Record a response; return its JSON body, or None for a 304 or error."""
+        ms = (time.perf_counter() - start) * 1000
+        data = response.json() if response.status_code == 200 else None
+        ok = response.status_code == 304 or (data is not None and data.get('success', False))
+        with self._lock:
+            self.samples[name].append((ms, ok))
+        return data
+
+
+def _next_cursor(cursor, data):
+    # The page polls Discord with the last message it has, as ?after=.
+    return (data or {}).get('cursor') or cursor
+
+
+def _run_sync(users, options):
+    recorder = _Recorder()
+    clients = []
+    for user in users:
+        client = Client()
+        client.force_login(user)  # before the threads start, so logins don't contend
+        clients.append(client)
+    deadline = time.perf_counter() + options['duration']
+
+    def dashboard(client, n):
+        start = time.perf_counter()
+        recorder.add('fetch_feed', start, client.get(reverse('fetch_feed')))
+        polls = 0
+        cursor = None
+        # Stagger the dashboards across the poll interval.
+        time.sleep(random.random() * options['poll_interval'])
+        while time.perf_counter() < deadline:
+            polls += 1
+            start = time.perf_counter()
+            response = client.get(reverse('fetch_discord_messages'), {'after': cursor} if cursor else None)
+            cursor = _next_cursor(cursor, recorder.add('fetch_discord_messages', start, response))
+            start = time.perf_counter()
+            recorder.add('fetch_reddit_posts', start, client.get(reverse('fetch_reddit_posts')))
+            if options['send_every'] and polls % options['send_every'] == 0:
+                start = time.perf_counter()
+                response = client.post(reverse('send_discord_message'), {'content': f'load {n}.{polls}'})
+                recorder.add('send_discord_message', start, response)
+            time.sleep(options['poll_interval'])
+
+    threads = [threading.Thread(target=dashboard, args=(client, n)) for n, client in enumerate(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.elapsed = time.perf_counter() - started
+    return _with_elapsed(recorder)
+
+
+def _run_async(users, options):
+    recorder = _Recorder()
+
+    async def dashboard(user, n, deadline):
+        client = AsyncClient()
+        await client.aforce_login(user)
+        start = time.perf_counter()
+        recorder.add('fetch_feed', start, await client.get(reverse('fetch_feed')))
+        polls = 0
+        cursor = None
+        await asyncio.sleep(random.random() * options['poll_interval'])
+        while time.perf_counter() < deadline:
+            polls += 1
+            start = time.perf_counter()
+            response = await client.get(reverse('fetch_discord_messages'), {'after': cursor} if cursor else None)
+            cursor = _next_cursor(cursor, recorder.add('fetch_discord_messages', start, response))
+            start = time.perf_counter()
+            recorder.add('fetch_reddit_posts', start, await client.get(reverse('fetch_reddit_posts')))
+            if options['send_every'] and polls % options['send_every'] == 0:
+                start = time.perf_counter()
+                response = await client.post(reverse('send_discord_message'), {'content': f'load {n}.{polls}'})
+                recorder.add('send_discord_message', start, response)
+            await asyncio.sleep(options['poll_interval'])
+
+    async def main():
+        deadline = time.perf_counter() + options['duration']
+        started = time.perf_counter()
+        await asyncio.gather(*(dashboard(user, n, deadline) for n, user in enumerate(users)))
+        recorder.elapsed = time.perf_counter() - started
+        await async_http.close_sessions()
+
+    asyncio.run(main())
+    return _with_elapsed(recorder)
+
+
+def _with_elapsed(recorder):
+    return {name: (recorder.elapsed, calls) for name, calls in recorder.samples.items()}
+
+
+def _summary(result):
+    elapsed, calls = result
+    latencies = [ms for ms, _ in calls]
+    return {
+        'requests': len(calls),
+        'rps': len(calls) / elapsed,
+        'p50': median(latencies),
+        'p99': percentile(latencies, 99),
+        'errors': sum(1 for _, ok in calls if not ok),
+    }
+
+
+def _drain_schedules(users, count, timeout=120):
+    now = timezone.now()
+    RedditPostSchedule.objects.bulk_create([
+        RedditPostSchedule(user=users[i % len(users)], title=f'Load {i}', content='Body', scheduled_time=now)
+        for i in range(count // 2)
+    ])
+    DiscordMessageSchedule.objects.bulk_create([
+        DiscordMessageSchedule(
+            user=users[i % len(users)], channel_id=users[i % len(users)].userprofile.discord_channel_id,
+            message=f'Load {i}', scheduled_time=now,
+        )
+        for i in range(count - count // 2)
+    ])
+
+    lags = []
+    lock = threading.Lock()
+    jobs = [RedditPostJob(), DiscordMessageJob()]
+    for job in jobs:
+        job.retry_delay = 0.2  # don't spend the run waiting out real backoffs
+
+        def send(item, send=job.send):
+            send(item)
+            with lock:
+                lags.append((timezone.now() - item.scheduled_time).total_seconds() * 1000)
+        job.send = send
+    engine = ScheduleEngine(jobs, retry_delay=0.2, max_retry_delay=1)
+
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        wait = engine.run_pending()
+        if not _pending():
+            break
+        time.sleep(min(wait, 0.05))
+    elapsed = time.perf_counter() - started
+    failed = (RedditPostSchedule.objects.filter(failed=True).count()
+              + DiscordMessageSchedule.objects.filter(failed=True).count())
+    return {
+        'requests': len(lags),
+        'rps': len(lags) / elapsed,
+        'p50': median(lags),
+        'p99': percentile(lags, 99),
+        'errors': failed + _pending(),
+    }
+
+
+def _pending():
+    return (RedditPostSchedule.objects.filter(posted=False, failed=False).count()
+            + DiscordMessageSchedule.objects.filter(sent=False, failed=False).count())
+
+
+def _report(stdout, mode, options, results, dashboard_calls):
+    stdout.write(
+        f"{options['dashboards']} {mode} dashboards polling every {options['poll_interval']}s "
+        f"for {options['duration']}s; stub latency {options['latency']:.0f} ms"
+    )
+    stdout.write(f"{'':<24} {'requests':>9} {'req/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}")
+    rows = list(results['endpoints'].items())
+    if 'scheduler' in results:
+        rows.append(('scheduler (lag)', results['scheduler']))
+    for name, row in rows:
+        stdout.write(
+            f"{name:<24} {row['requests']:>9} {row['rps']:>9.1f} {row['p50']:>9.1f} "
+            f"{row['p99']:>9.1f} {row['errors']:>7}"
+        )
+    dashboard_requests = sum(row['requests'] for row in results['endpoints'].values())
+    upstream = sum(n for route, n in dashboard_calls.items() if route not in ('429', '503'))
+    stdout.write(f"Upstream calls for dashboards: {upstream} "
+                 f"({upstream / max(dashboard_requests, 1):.2f} per request)")
+    for route, n in sorted(dashboard_calls.items()):
+        stdout.write(f"  {route:<46} {n:>7}")
+    if 'scheduler' in results:
+        stdout.write(f"Upstream calls for the scheduler: {results['scheduler']['upstream_calls']}")
+
+
+def _regressions(baseline, results, tolerance):
+    if baseline.get('mode') != results['mode']:
+        raise CommandError(f"The baseline is from a {baseline.get('mode')} run, this is a {results['mode']} run.")
+    found = []
+    pairs = [(f'endpoint {name}', row, results['endpoints'].get(name)) for name, row in baseline['endpoints'].items()]
+    if 'scheduler' in baseline:
+        pairs.append(('scheduler', baseline['scheduler'], results.get('scheduler')))
+    for name, before, after in pairs:
+        if after is None:
+            continue
+        if after['rps'] < before['rps'] * (1 - tolerance):
+            found.append(f"{name}: {after['rps']:.1f} req/s, was {before['rps']:.1f}")
+        if after['p99'] > before['p99'] * (1 + tolerance):
+            found.append(f"{name}: p99 {after['p99']:.1f} ms, was {before['p99']:.1f}")
+    return found
@@ -0,0 +1,168 @@
+"""
+Local stand-in for the Discord and Reddit APIs, for load benchmarks.
+
+The stub answers the handful of endpoints the dashboard calls after a fixed
+``latency``, from an aiohttp server on a background thread, so thousands of
+requests can be held open at once. Point the clients at ``base_url``:
+Discord routes live under ``/api/v10`` and Reddit's at the root.
+
+To exercise the error paths, a fraction ``error_rate`` of requests get a
+503, and every ``rate_limit_every``-th request gets a 429 asking the client
+to retry after ``retry_after`` seconds. Requests are counted per route in
+``calls``.
+"""
+import asyncio
+import random
+import threading
+from collections import Counter
+
+from aiohttp import web
+
+STUB_MESSAGE_COUNT = 10
+STUB_POST_COUNT = 10
+STUB_SELFTEXT = 'A long self post. ' * 200
+
+
+class UpstreamStub:
+    def __init__(self, latency=0.2, host='127.0.0.1', port=0, error_rate=0.0, rate_limit_every=0,
+                 retry_after=0.05, seed=None):
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.error_rate = error_rate
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self.calls = Counter()  # route -> requests, including errors and 429s
+        self._random = random.Random(seed)
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def start(self):
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(started,), name='upstream-stub', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.base_url
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _serve(self, started):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.add_routes([
+            web.get('/api/v10/channels/{channel_id}/messages', self.discord_messages),
+            web.post('/api/v10/channels/{channel_id}/messages', self.discord_create_message),
+            web.post('/api/v1/access_token', self.reddit_token),
+            web.get('/r/{subreddit}/hot', self.reddit_hot),
+            web.get('/by_id/{fullname}', self.reddit_by_id),
+            web.post('/api/submit/', self.reddit_submit),
+        ])
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port, backlog=4096)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        started.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _respond(self, request, payload, status=200):
+        self.requests += 1
+        route = f'{request.method} {request.match_info.route.resource.canonical}'
+        self.calls[route] += 1
+        await asyncio.sleep(self.latency)
+        if self.rate_limit_every and self.requests % self.rate_limit_every == 0:
+            self.calls['429'] += 1
+            return web.json_response(
+                {'message': 'You are being rate limited.', 'retry_after': self.retry_after, 'global': False},
+                status=429, headers={'Retry-After': str(self.retry_after)},
+            )
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.calls['503'] += 1
+            return web.json_response({'message': 'Service unavailable'}, status=503)
+        return web.json_response(payload, status=status)
+
+    async def discord_messages(self, request):
+        if request.query.get('after'):
+            return await self._respond(request, [])  # nothing new since the cursor
+        channel_id = int(request.match_info['channel_id'])
+        return await self._respond(request, [
+            _discord_message(channel_id * 100 + i) for i in range(STUB_MESSAGE_COUNT, 0, -1)
+        ])
+
+    async def discord_create_message(self, request):
+        body = await request.json()
+        message = _discord_message(1)
+        message['content'] = body['content']
+        return await self._respond(request, message)
+
+    async def reddit_token(self, request):
+        return await self._respond(request, {
+            'access_token': 'stub-token', 'token_type': 'bearer', 'expires_in': 3600, 'scope': '*',
+        })
+
+    async def reddit_hot(self, request):
+        subreddit = request.match_info['subreddit']
+        posts = [_reddit_post(subreddit, i) for i in range(STUB_POST_COUNT)]
+        return await self._respond(request, {
+            'kind': 'Listing',
+            'data': {'after': posts[-1]['data']['name'], 'before': None, 'children': posts},
+        })
+
+    async def reddit_by_id(self, request):
+        post = _reddit_post('stub', 1)  # a long self post
+        post['data']['id'] = request.match_info['fullname'][3:]
+        return await self._respond(request, {'kind': 'Listing', 'data': {'after': None, 'before': None, 'children': [post]}})
+
+    async def reddit_submit(self, request):
+        data = await request.post()
+        post_id = f'new{self.requests}'
+        return await self._respond(request, {'json': {'errors': [], 'data': {
+            'id': post_id, 'name': f't3_{post_id}',
+            'url': f'https://www.reddit.com/r/{data.get("sr", "stub")}/comments/{post_id}/',
+        }}})
+
+
+def _discord_message(snowflake):
+    return {
+        'id': str(snowflake),
+        'content': f'message {snowflake}',
+        'author': {'id': '1', 'username': 'stub', 'avatar': None},
+        'timestamp': '2025-01-01T00:00:00+00:00',
+    }
+
+
+def _reddit_post(subreddit, i):
+    post_id = f'{subreddit[:3]}{i}'
+    return {'kind': 't3', 'data': {
+        'id': post_id,
+        'name': f't3_{post_id}',
+        'title': f'Post {i}',
+        'author': 'stub',
+        'score': i,
+        'url': f'https://example.com/{post_id}',
+        'selftext': STUB_SELFTEXT if i % 2 else '',
+        'media': None,
+        'preview': {'images': [{'source': {'url': f'https://example.com/{post_id}.jpg'}}]},
+        'permalink': f'/r/{subreddit}/comments/{post_id}/',
+        'num_comments': i,
+        'created_utc': 1735689600.0 - i * 60,
+        'subreddit': subreddit,
+    }}
@@ -0,0 +1,166 @@
+"""
+Throughput of the sync vs async upstream-bound views against a stub API.
+
+The sync views are driven from a pool of ``--threads`` threads, standing in
+for a threaded WSGI worker; the async views from ``--concurrency`` tasks on
+one event loop, standing in for an ASGI worker. Each request is for a
+different channel/subreddit and the caches are expired, so every request
+waits ``--latency`` ms on the stub.
+"""
+import asyncio
+import contextlib
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.test import AsyncRequestFactory, RequestFactory
+
+from dashboard import async_http, async_views, views
+from dashboard.discord_api import async_discord_client, discord_client
+from dashboard.models import UserProfile
+from dashboard.profiles import get_profile
+from dashboard.reddit_api import async_reddit_client
+from dashboard.reddit_clients import new_reddit, reddit_clients
+from dashboard.sources import get_sources
+
+from . import median, percentile, scratch_database
+from .stubs import UpstreamStub
+
+ENDPOINTS = {
+    'discord': ('/api/discord/messages/', 'fetch_discord_messages'),
+    'reddit': ('/api/reddit/posts/', 'fetch_reddit_posts'),
+}
+
+
+def add_arguments(parser):
+    parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=sorted(ENDPOINTS))
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=200, help="Stub response time in ms.")
+    parser.add_argument('--threads', type=int, default=32, help="Threads driving the sync views.")
+    parser.add_argument('--concurrency', type=int, default=1000, help="In-flight async view calls.")
+    parser.add_argument('--users', type=int, default=500)
+
+
+def run(options, stdout):
+    with scratch_database(), UpstreamStub(latency=options['latency'] / 1000) as stub:
+        users = _create_users(options['users'])
+        restore = _point_clients_at(stub.base_url)
+        try:
+            stdout.write(f"{'endpoint':<10} {'mode':<6} {'workers':>8} {'req/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+            for endpoint in options['endpoints']:
+                path, view_name = ENDPOINTS[endpoint]
+                for mode, workers, bench in (
+                    ('sync', options['threads'], _run_sync),
+                    ('async', options['concurrency'], _run_async),
+                ):
+                    with _expired_caches():
+                        elapsed, samples = bench(view_name, path, users, options['requests'], workers)
+                    stdout.write(
+                        f"{endpoint:<10} {mode:<6} {workers:>8} {len(samples) / elapsed:>9.1f} "
+                        f"{median(samples):>9.1f} {percentile(samples, 99):>9.1f}"
+                    )
+        finally:
+            restore()
+
+
+def _create_users(count):
+    User.objects.bulk_create([User(username=f'bench{i}') for i in range(count)])
+    users = list(User.objects.order_by('pk'))
+    for i, user in enumerate(users):
+        # Not bulk_create: save() subscribes the user to their channel and subreddit.
+        UserProfile.objects.create(
+            user=user,
+            discord_bot_token=f'token{i}',
+            discord_channel_id=str(1000 + i),
+            reddit_client_id=f'client{i % 10}',
+            reddit_client_secret='secret',
+            reddit_user_agent='benchmark',
+            reddit_subreddit=f'sub{i}',
+        )
+    for user in users:
+        # Warm the profile and subscription caches; the views shouldn't hit the DB.
+        get_profile(user)
+        get_sources(user.pk)
+    return users
+
+
+def _point_clients_at(base_url):
+    saved = (discord_client.base_url, async_discord_client.base_url, async_reddit_client.oauth_base,
+             async_reddit_client.token_url, reddit_clients._factory)
+    discord_client.base_url = async_discord_client.base_url = f'{base_url}/api/v10'
+    async_reddit_client.oauth_base = base_url
+    async_reddit_client.token_url = f'{base_url}/api/v1/access_token'
+    reddit_clients.clear()
+    reddit_clients._factory = functools.partial(new_reddit, oauth_url=base_url, reddit_url=base_url)
+
+    def restore():
+        (discord_client.base_url, async_discord_client.base_url, async_reddit_client.oauth_base,
+         async_reddit_client.token_url, reddit_clients._factory) = saved
+        reddit_clients.clear()
+    return restore
+
+
+@contextlib.contextmanager
+def _expired_caches():
+    # Keep expired entries (and so Discord's incremental refresh) but never
+    # serve from the cache.
+    caches = (views.discord_message_cache, views.reddit_listing_cache)
+    saved = [cache.ttl for cache in caches]
+    for cache in caches:
+        cache.ttl = 0
+        cache.clear()
+    try:
+        yield
+    finally:
+        for cache, ttl in zip(caches, saved):
+            cache.ttl = ttl
+            cache.clear()
+
+
+def _run_sync(view_name, path, users, total, threads):
+    view = getattr(views, view_name)
+    factory = RequestFactory()
+
+    def call(i):
+        request = factory.get(path)
+        request.user = users[i % len(users)]
+        start = time.perf_counter()
+        response = view(request)
+        assert b'"success": true' in response.content, response.content
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        samples = list(executor.map(call, range(total)))
+    return time.perf_counter() - start, samples
+
+
+def _run_async(view_name, path, users, total, concurrency):
+    view = getattr(async_views, view_name)
+    factory = AsyncRequestFactory()
+
+    async def call(i, semaphore):
+        user = users[i % len(users)]
+        request = factory.get(path)
+        request.user = user
+        request.auser = functools.partial(_auser, user)
+        async with semaphore:
+            start = time.perf_counter()
+            response = await view(request)
+        assert b'"success": true' in response.content, response.content
+        return (time.perf_counter() - start) * 1000
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        start = time.perf_counter()
+        samples = await asyncio.gather(*(call(i, semaphore) for i in range(total)))
+        elapsed = time.perf_counter() - start
+        await async_http.close_sessions()
+        return elapsed, samples
+
+    return asyncio.run(main())
+
+
+async def _auser(user):
+    return user
@@ -0,0 +1,160 @@
+"""
+Bulk import of scheduled Reddit posts and Discord messages.
+
+Rows come from a CSV or JSON Lines file and are parsed lazily, validated and
+inserted ``batch_size`` at a time with bulk_create, each batch in its own
+transaction, so memory stays bounded however large the file is. Invalid rows
+are skipped and reported with their line number; the valid ones are imported.
+
+Every row has a ``type`` ('reddit' or 'discord'; the importer's default if
+missing) and a ``scheduled_time`` (ISO 8601, naive times are in the server's
+time zone). Reddit rows have a ``title`` and a ``content`` or ``url``.
+Discord rows have a ``message`` and optionally a ``channel_id``, which
+defaults to the user's profile channel.
+"""
+import csv
+import json
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+
+from .models import DiscordMessageSchedule, RedditPostSchedule, Source, UserProfile
+
+FORMATS = ('csv', 'jsonl')
+KINDS = (Source.REDDIT, Source.DISCORD)
+DISCORD_MESSAGE_MAX_LENGTH = 2000
+REDDIT_TITLE_MAX_LENGTH = 300
+MAX_REPORTED_ERRORS = 100
+
+_validate_url = URLValidator()
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = {kind: 0 for kind in KINDS}
+        self.error_count = 0
+        self.errors = []  # the first MAX_REPORTED_ERRORS (line, message)
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def guess_format(filename):
+    return 'csv' if filename.lower().endswith('.csv') else 'jsonl'
+
+
+def read_rows(lines, format):
+    """
+    Yield ``(line_number, row)`` for an iterable of text lines, where ``row``
+    is a dict, or None if the line could not be parsed.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def import_schedules(user, lines, format='jsonl', default_kind=None, batch_size=1000):
+    """Import ``user``'s schedules from ``lines``; return an ImportResult."""
+    default_channel = (
+        UserProfile.objects.filter(user=user).values_list('discord_channel_id', flat=True).first() or ''
+    )
+    result = ImportResult()
+    batch = []
+    for number, row in read_rows(lines, format):
+        if row is None:
+            result.add_error(number, "Invalid JSON object")
+            continue
+        try:
+            batch.append(build_schedule(user.pk, row, default_kind, default_channel))
+        except ValueError as e:
+            result.add_error(number, str(e))
+            continue
+        if len(batch) >= batch_size:
+            _insert(batch, result)
+            batch = []
+    _insert(batch, result)
+    return result
+
+
+def build_schedule(user_id, row, default_kind=None, default_channel=''):
+    """An unsaved RedditPostSchedule or DiscordMessageSchedule for ``row``."""
+    kind = _text(row, 'type').lower() or default_kind
+    if kind not in KINDS:
+        raise ValueError("type must be 'reddit' or 'discord'")
+    scheduled_time = _scheduled_time(_text(row, 'scheduled_time'))
+
+    if kind == Source.REDDIT:
+        title, content, url = _text(row, 'title'), _text(row, 'content'), _text(row, 'url')
+        if not title:
+            raise ValueError("title is required")
+        if len(title) > REDDIT_TITLE_MAX_LENGTH:
+            raise ValueError(f"title is longer than {REDDIT_TITLE_MAX_LENGTH} characters")
+        if not content and not url:
+            raise ValueError("content or url is required")
+        if url:
+            try:
+                _validate_url(url)
+            except ValidationError:
+                raise ValueError("url is not a valid URL")
+        return RedditPostSchedule(
+            user_id=user_id, title=title, content=content, url=url, scheduled_time=scheduled_time
+        )
+
+    message, channel_id = _text(row, 'message'), _text(row, 'channel_id') or default_channel
+    if not message:
+        raise ValueError("message is required")
+    if len(message) > DISCORD_MESSAGE_MAX_LENGTH:
+        raise ValueError(f"message is longer than {DISCORD_MESSAGE_MAX_LENGTH} characters")
+    if not channel_id.isdigit():
+        raise ValueError("channel_id is required and must be a Discord channel ID")
+    return DiscordMessageSchedule(
+        user_id=user_id, channel_id=channel_id, message=message, scheduled_time=scheduled_time
+    )
+
+
+def _text(row, field):
+    value = row.get(field)
+    return '' if value is None else str(value).strip()
+
+
+# Campaign rows tend to share a handful of send times.
+@lru_cache(maxsize=1024)
+def _scheduled_time(value):
+    if not value:
+        raise ValueError("scheduled_time is required")
+    try:
+        scheduled_time = parse_datetime(value)
+    except ValueError:
+        scheduled_time = None
+    if scheduled_time is None:
+        raise ValueError("scheduled_time is not an ISO 8601 date and time")
+    if is_naive(scheduled_time):
+        scheduled_time = make_aware(scheduled_time)
+    return scheduled_time
+
+
+def _insert(batch, result):
+    by_model = {}
+    for item in batch:
+        by_model.setdefault(type(item), []).append(item)
+    with transaction.atomic():
+        for model, items in by_model.items():
+            model.objects.bulk_create(items)
+            kind = Source.REDDIT if model is RedditPostSchedule else Source.DISCORD
+            result.created[kind] += len(items)
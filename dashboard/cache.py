@@ -0,0 +1,215 @@
+"""
+In-process caches shared by the dashboard's upstream-bound views.
+
+Every open dashboard tab polls the same Discord channels and subreddits, so
+responses are cached per source and concurrent misses for the same key are
+collapsed into a single upstream call.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from .metrics import CACHE_REQUESTS
+
+
+class _InFlight:
+    """A fetch currently running for one key; followers wait on ``done``."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire ``ttl`` seconds after they were
+    fetched. At most ``max_entries`` keys are kept; the least recently used
+    key is evicted first.
+
+    Expired entries are kept until evicted so that a refresh can build on the
+    previous value (e.g. only fetching Discord messages newer than it).
+
+    Lookups of a cache with a ``name`` are counted in CACHE_REQUESTS.
+    """
+
+    def __init__(self, ttl, max_entries=1024, clock=time.monotonic, name=None):
+        self.ttl = ttl
+        self.name = name
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (fetched_at, value)
+        self._inflight = {}
+        self._ainflight = weakref.WeakKeyDictionary()  # event loop -> {key: Future}
+
+    def get(self, key):
+        """Return the fresh cached value for ``key`` or ``None``."""
+        with self._lock:
+            value = self._get_fresh(key)
+        self.count('miss' if value is None else 'hit')
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def expire(self, key):
+        """Force a refresh of ``key`` on next access, keeping its stale value."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (float('-inf'), entry[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Return the cached value for ``key``, calling ``fetch()`` on a miss.
+
+        Only one thread runs ``fetch`` for a given key at a time; the others
+        block until it finishes and share its result (or its exception).
+        A ``None`` result is handed to the waiting callers but not cached, so
+        failed upstream calls are retried on the next request.
+        """
+        return self.get_or_refresh(key, lambda stale: fetch())
+
+    def peek(self, key):
+        """Return ``(value, age in seconds)`` for ``key``, even if expired, or ``(None, None)``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, None
+            return entry[1], self._clock() - entry[0]
+
+    def get_or_refresh(self, key, refresh):
+        """
+        Like ``get_or_fetch`` but calls ``refresh(stale)`` with the expired
+        value for ``key`` (or ``None``) so it can fetch only what changed.
+        """
+        return self._refresh(key, refresh, use_fresh=True)
+
+    def refresh(self, key, refresh):
+        """Call ``refresh(current)`` for ``key`` now, even if it is still fresh."""
+        return self._refresh(key, refresh, use_fresh=False)
+
+    def _refresh(self, key, refresh, use_fresh):
+        with self._lock:
+            value = self._get_fresh(key) if use_fresh else None
+            if value is not None:
+                self.count('hit')
+                return value
+            entry = self._entries.get(key)
+            stale = entry[1] if entry is not None else None
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InFlight()
+
+        if use_fresh:
+            self.count('miss')
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = refresh(stale)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if call.error is None and call.value is not None:
+                    self._store(key, call.value)
+                del self._inflight[key]
+            call.done.set()
+        return call.value
+
+    async def aget_or_refresh(self, key, refresh):
+        """
+        Async ``get_or_refresh``: ``refresh(stale)`` is a coroutine function
+        and concurrent callers on the same event loop await a single call. If
+        the caller making it is cancelled (e.g. its client went away), one of
+        the others makes it instead.
+        """
+        loop = asyncio.get_running_loop()
+        retry = False
+        while True:
+            with self._lock:
+                value = self._get_fresh(key)
+                if value is not None:
+                    if not retry:
+                        self.count('hit')
+                    return value
+                entry = self._entries.get(key)
+                stale = entry[1] if entry is not None else None
+                inflight = self._ainflight.setdefault(loop, {})
+                future = inflight.get(key)
+                leader = future is None
+                if leader:
+                    future = inflight[key] = loop.create_future()
+
+            if not retry:
+                self.count('miss')
+            if leader:
+                break
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # this caller was cancelled
+            retry = True
+
+        value = None
+        try:
+            value = await refresh(stale)
+        except asyncio.CancelledError:
+            future.cancel()  # the followers retry, and one takes over
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # followers re-raise it; don't log it as unretrieved
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            with self._lock:
+                if value is not None:
+                    self._store(key, value)
+                del inflight[key]
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def count(self, result):
+        """Count a lookup as a 'hit', 'stale' (served expired) or 'miss'."""
+        if self.name is not None:
+            CACHE_REQUESTS.inc(cache=self.name, result=result)
+
+    # Callers must hold self._lock.
+    def _get_fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        fetched_at, value = entry
+        if self._clock() - fetched_at >= self.ttl:
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key, value):
+        self._entries[key] = (self._clock(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
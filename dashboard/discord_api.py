@@ -0,0 +1,347 @@
+"""
+Shared client for Discord's REST API.
+
+All Discord calls go through one pooled ``requests`` session with timeouts,
+bounded retries, and a tracker for Discord's rate-limit buckets. The tracker
+learns each route's bucket from ``X-RateLimit-*`` response headers and waits
+for the bucket to reset, rather than sending requests that would get a 429.
+See https://discord.com/developers/docs/topics/rate-limits.
+"""
+import asyncio
+import json as jsonlib
+import threading
+import time
+from collections import namedtuple
+from contextlib import ExitStack
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .async_http import aiohttp, get_session
+from .metrics import UPSTREAM_RETRIES, observe_upstream
+
+# Top-level route parameters; Discord keeps separate buckets for each value.
+MAJOR_PARAMETERS = ('channel_id', 'guild_id', 'webhook_id')
+
+# Gateway errors Discord asks clients to retry; the request was not handled.
+RETRY_STATUSES = (502, 503, 504)
+
+# How often buckets past their reset are dropped (seconds).
+PRUNE_INTERVAL = 60
+
+
+class RateLimited(Exception):
+    """Raised when honouring a rate limit would mean waiting too long."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Discord rate limit, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class _Bucket:
+    def __init__(self):
+        self.remaining = None  # None until Discord tells us
+        self.reset_at = 0.0
+
+
+class RateLimiter:
+    """
+    Per bot token bookkeeping of Discord rate-limit buckets.
+
+    Several routes can share a bucket, which Discord identifies with the
+    ``X-RateLimit-Bucket`` header, and a bucket is tracked separately for each
+    major parameter (e.g. each channel). Buckets past their reset behave like
+    unknown ones, so they are dropped every PRUNE_INTERVAL seconds to keep
+    the bookkeeping to the tokens and channels in recent use.
+    """
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._route_buckets = {}  # (token, method, route) -> bucket hash
+        self._buckets = {}  # (token, bucket hash, major) -> _Bucket
+        self._global_reset = {}  # token -> reset_at
+        self._next_prune = clock() + PRUNE_INTERVAL
+
+    def acquire(self, token, method, route, major, max_wait):
+        """Block until a request on this route may be sent."""
+        while True:
+            delay = self.reserve(token, method, route, major, max_wait)
+            if delay <= 0:
+                return
+            self._sleep(delay)
+
+    async def aacquire(self, token, method, route, major, max_wait):
+        while True:
+            delay = self.reserve(token, method, route, major, max_wait)
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def reserve(self, token, method, route, major, max_wait):
+        """
+        Take a slot in the route's bucket and return 0, or return how long to
+        wait before asking again. Raises RateLimited past ``max_wait``.
+        """
+        with self._lock:
+            delay = self._delay(token, method, route, major)
+        if delay > max_wait:
+            raise RateLimited(delay)
+        return delay
+
+    def update(self, token, method, route, major, status_code, headers, retry_after=None):
+        """Record a response; ``retry_after`` is taken from a 429's body."""
+        with self._lock:
+            now = self._clock()
+            if now >= self._next_prune:
+                self._prune(now)
+            if status_code == 429:
+                if headers.get('X-RateLimit-Global') or headers.get('X-RateLimit-Scope') == 'global':
+                    self._global_reset[token] = now + retry_after
+                    return
+            bucket_hash = headers.get('X-RateLimit-Bucket')
+            if bucket_hash is None:
+                if status_code != 429:
+                    return
+                bucket_hash = self._route_buckets.get((token, method, route), f'{method} {route}')
+            self._route_buckets[token, method, route] = bucket_hash
+            bucket = self._buckets.setdefault((token, bucket_hash, major), _Bucket())
+            if status_code == 429:
+                bucket.remaining = 0
+                bucket.reset_at = now + retry_after
+                return
+            try:
+                bucket.remaining = int(headers['X-RateLimit-Remaining'])
+                bucket.reset_at = now + float(headers['X-RateLimit-Reset-After'])
+            except (KeyError, ValueError):
+                pass
+
+    # Callers must hold self._lock.
+    def _prune(self, now):
+        self._next_prune = now + PRUNE_INTERVAL
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket.reset_at > now}
+        live = {(token, bucket_hash) for token, bucket_hash, _ in self._buckets}
+        self._route_buckets = {
+            key: bucket_hash for key, bucket_hash in self._route_buckets.items() if (key[0], bucket_hash) in live
+        }
+        self._global_reset = {token: reset_at for token, reset_at in self._global_reset.items() if reset_at > now}
+
+    def _delay(self, token, method, route, major):
+        now = self._clock()
+        global_reset = self._global_reset.get(token, 0.0)
+        if global_reset > now:
+            return global_reset - now
+        bucket_hash = self._route_buckets.get((token, method, route))
+        bucket = self._buckets.get((token, bucket_hash, major))
+        if bucket is None:
+            return 0
+        if bucket.reset_at <= now:
+            bucket.remaining = None
+        elif bucket.remaining is not None:
+            if bucket.remaining <= 0:
+                return bucket.reset_at - now
+            # Reserve a slot so concurrent callers don't overshoot the bucket.
+            bucket.remaining -= 1
+        return 0
+
+
+def _retry_after(body, headers):
+    try:
+        return float(body['retry_after'])
+    except (KeyError, TypeError, ValueError):
+        return float(headers.get('Retry-After', 1))
+
+
+class DiscordClient:
+    def __init__(self, base_url='https://discord.com/api/v10', timeout=(3.05, 10), max_retries=3,
+                 max_rate_limit_wait=30, pool_size=32, session=None, rate_limiter=None, sleep=time.sleep):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self.rate_limiter = rate_limiter or RateLimiter(sleep=sleep)
+        self._sleep = sleep
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.session = session
+
+    def request(self, method, route, bot_token, params=None, json=None, files=None, **route_params):
+        """
+        Send ``method`` to ``route`` (e.g. ``/channels/{channel_id}/messages``)
+        and return the final ``requests.Response``.
+
+        ``files`` maps form fields to ``(filename, path, content_type)``; they
+        are re-read from disk for each attempt and sent as a multipart body,
+        with ``json`` as Discord's ``payload_json`` field.
+
+        429s and Discord's retryable gateway errors are retried up to
+        ``max_retries`` times, and so are connection failures for GETs. Raises
+        ``requests.RequestException`` or ``RateLimited`` when giving up.
+        """
+        major = next((route_params[p] for p in MAJOR_PARAMETERS if p in route_params), None)
+        url = self.base_url + route.format(**route_params)
+        headers = {"Authorization": f"Bot {bot_token}"}
+        attempt = 0
+        endpoint = f'{method} {route}'
+        while True:
+            self.rate_limiter.acquire(bot_token, method, route, major, self.max_rate_limit_wait)
+            start = time.perf_counter()
+            try:
+                if files:
+                    with ExitStack() as stack:
+                        opened = {
+                            field: (filename, stack.enter_context(open(path, 'rb')), content_type)
+                            for field, (filename, path, content_type) in files.items()
+                        }
+                        response = self.session.request(
+                            method, url, params=params, data={'payload_json': jsonlib.dumps(json or {})},
+                            files=opened, headers=headers, timeout=self.timeout,
+                        )
+                else:
+                    response = self.session.request(
+                        method, url, params=params, json=json, headers=headers, timeout=self.timeout
+                    )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                observe_upstream('discord', endpoint, 'error', time.perf_counter() - start)
+                # Unless we never connected, a POST may have been delivered
+                # even though we never saw the reply.
+                if attempt >= self.max_retries or (method != 'GET' and not isinstance(e, requests.ConnectTimeout)):
+                    raise
+                attempt += 1
+                UPSTREAM_RETRIES.inc(service='discord')
+                self._sleep(_backoff(attempt))
+                continue
+            observe_upstream('discord', endpoint, response.status_code, time.perf_counter() - start)
+
+            retry_after = None
+            if response.status_code == 429:
+                try:
+                    retry_after = _retry_after(response.json(), response.headers)
+                except ValueError:
+                    retry_after = _retry_after(None, response.headers)
+            self.rate_limiter.update(
+                bot_token, method, route, major, response.status_code, response.headers, retry_after
+            )
+            if attempt >= self.max_retries:
+                return response
+            if response.status_code == 429:
+                attempt += 1
+                UPSTREAM_RETRIES.inc(service='discord')
+                continue  # acquire() now waits out retry_after
+            if response.status_code in RETRY_STATUSES:
+                attempt += 1
+                UPSTREAM_RETRIES.inc(service='discord')
+                self._sleep(_backoff(attempt))
+                continue
+            return response
+
+    def get_messages(self, bot_token, channel_id, limit=10, after=None, before=None):
+        params = {"limit": limit}
+        if after:
+            params["after"] = after
+        if before:
+            params["before"] = before
+        return self.request('GET', '/channels/{channel_id}/messages', bot_token,
+                            params=params, channel_id=channel_id)
+
+    def create_message(self, bot_token, channel_id, content, attachment=None):
+        """Post a message; ``attachment`` is an optional ``(filename, path, content_type)``."""
+        payload = {"content": content}
+        files = None
+        if attachment is not None:
+            payload["attachments"] = [{"id": 0, "filename": attachment[0]}]
+            files = {"files[0]": attachment}
+        return self.request('POST', '/channels/{channel_id}/messages', bot_token,
+                            json=payload, files=files, channel_id=channel_id)
+
+
+# What AsyncDiscordClient returns; ``data`` is the decoded JSON body or None.
+AsyncResponse = namedtuple('AsyncResponse', ['status_code', 'headers', 'data'])
+
+
+class AsyncDiscordClient:
+    """
+    aiohttp counterpart of DiscordClient for the async views, with the same
+    retry rules. Share the sync client's rate limiter so both respect the
+    same buckets.
+    """
+
+    def __init__(self, base_url='https://discord.com/api/v10', max_retries=3, max_rate_limit_wait=30,
+                 rate_limiter=None):
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self.rate_limiter = rate_limiter or RateLimiter()
+
+    async def request(self, method, route, bot_token, params=None, json=None, **route_params):
+        major = next((route_params[p] for p in MAJOR_PARAMETERS if p in route_params), None)
+        url = self.base_url + route.format(**route_params)
+        headers = {"Authorization": f"Bot {bot_token}"}
+        attempt = 0
+        endpoint = f'{method} {route}'
+        while True:
+            await self.rate_limiter.aacquire(bot_token, method, route, major, self.max_rate_limit_wait)
+            start = time.perf_counter()
+            try:
+                async with get_session().request(method, url, params=params, json=json, headers=headers) as response:
+                    status = response.status
+                    response_headers = response.headers
+                    try:
+                        data = await response.json(content_type=None)
+                    except ValueError:
+                        data = None
+            except (aiohttp.ServerDisconnectedError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                observe_upstream('discord', endpoint, 'error', time.perf_counter() - start)
+                if attempt >= self.max_retries or (method != 'GET' and not isinstance(e, aiohttp.ClientConnectorError)):
+                    raise
+                attempt += 1
+                UPSTREAM_RETRIES.inc(service='discord')
+                await asyncio.sleep(_backoff(attempt))
+                continue
+            observe_upstream('discord', endpoint, status, time.perf_counter() - start)
+
+            retry_after = _retry_after(data, response_headers) if status == 429 else None
+            self.rate_limiter.update(bot_token, method, route, major, status, response_headers, retry_after)
+            if attempt < self.max_retries and (status == 429 or status in RETRY_STATUSES):
+                attempt += 1
+                UPSTREAM_RETRIES.inc(service='discord')
+                if status != 429:
+                    await asyncio.sleep(_backoff(attempt))
+                continue
+            return AsyncResponse(status, response_headers, data)
+
+    async def get_messages(self, bot_token, channel_id, limit=10, after=None):
+        params = {"limit": limit}
+        if after:
+            params["after"] = after
+        return await self.request('GET', '/channels/{channel_id}/messages', bot_token,
+                                  params=params, channel_id=channel_id)
+
+    async def create_message(self, bot_token, channel_id, content):
+        return await self.request('POST', '/channels/{channel_id}/messages', bot_token,
+                                  json={"content": content}, channel_id=channel_id)
+
+
+def _backoff(attempt):
+    return min(0.5 * 2 ** (attempt - 1), 8)
+
+
+discord_client = DiscordClient(
+    base_url=getattr(settings, 'DISCORD_API_BASE', 'https://discord.com/api/v10'),
+    timeout=getattr(settings, 'DISCORD_API_TIMEOUT', (3.05, 10)),
+    max_retries=getattr(settings, 'DISCORD_API_MAX_RETRIES', 3),
+    max_rate_limit_wait=getattr(settings, 'DISCORD_MAX_RATE_LIMIT_WAIT', 30),
+    pool_size=getattr(settings, 'DISCORD_HTTP_POOL_SIZE', 32),
+)
+
+async_discord_client = AsyncDiscordClient(
+    base_url=discord_client.base_url,
+    max_retries=discord_client.max_retries,
+    max_rate_limit_wait=discord_client.max_rate_limit_wait,
+    rate_limiter=discord_client.rate_limiter,
+)
@@ -1,6 +1,9 @@
+import re
+
 from django import forms
 from django.contrib.auth.models import User
-from .models import UserProfile, RedditPostSchedule
+from .models import UserProfile, RedditPostSchedule, Source
+from .sources import get_sources, normalize, set_subscriptions
 
 class RegistrationForm(forms.ModelForm):
     password = forms.CharField(widget=forms.PasswordInput)
@@ -21,7 +24,19 @@ class LoginForm(forms.Form):
     username = forms.CharField()
     password = forms.CharField(widget=forms.PasswordInput)
 
+SUBREDDIT_NAME = re.compile(r'^[A-Za-z0-9_]{2,21}$')
+
 class UserProfileForm(forms.ModelForm):
+    # Followed as well as the profile's own channel and subreddit.
+    extra_discord_channels = forms.CharField(
+        widget=forms.Textarea(attrs={'rows': 3}), required=False,
+        label="More Discord channel IDs", help_text="One per line.",
+    )
+    extra_subreddits = forms.CharField(
+        widget=forms.Textarea(attrs={'rows': 3}), required=False,
+        label="More subreddits", help_text="One per line.",
+    )
+
     class Meta:
         model = UserProfile
         fields = [
@@ -30,6 +45,55 @@ class UserProfileForm(forms.ModelForm):
             'reddit_user_agent', 'reddit_subreddit'
         ]
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            sources = get_sources(self.instance.user_id)
+            self.fields['extra_discord_channels'].initial = "\n".join(
+                name for kind, name in sources
+                if kind == Source.DISCORD and name != self.instance.discord_channel_id
+            )
+            self.fields['extra_subreddits'].initial = "\n".join(
+                name for kind, name in sources
+                if kind == Source.REDDIT and name != normalize(Source.REDDIT, self.instance.reddit_subreddit)
+            )
+
+    # Channel IDs end up in Discord API paths, so only snowflakes are allowed.
+    def clean_discord_channel_id(self):
+        channel_id = self.cleaned_data['discord_channel_id'].strip()
+        if channel_id and not channel_id.isdigit():
+            raise forms.ValidationError("Enter a Discord channel ID (digits only).")
+        return channel_id
+
+    def clean_extra_discord_channels(self):
+        channels = [line.strip() for line in self.cleaned_data['extra_discord_channels'].splitlines()]
+        invalid = [channel for channel in channels if channel and not channel.isdigit()]
+        if invalid:
+            raise forms.ValidationError(f"Not Discord channel IDs: {', '.join(invalid)}")
+        return "\n".join(channels)
+
+    # Subreddit names end up in Reddit API paths and shared cache keys.
+    def clean_reddit_subreddit(self):
+        subreddit = normalize(Source.REDDIT, self.cleaned_data['reddit_subreddit'])
+        if subreddit and not SUBREDDIT_NAME.match(subreddit):
+            raise forms.ValidationError("Enter a subreddit name (letters, digits and underscores).")
+        return subreddit
+
+    def clean_extra_subreddits(self):
+        subreddits = [normalize(Source.REDDIT, line) for line in self.cleaned_data['extra_subreddits'].splitlines()]
+        invalid = [subreddit for subreddit in subreddits if subreddit and not SUBREDDIT_NAME.match(subreddit)]
+        if invalid:
+            raise forms.ValidationError(f"Not subreddit names: {', '.join(invalid)}")
+        return "\n".join(subreddits)
+
+    def save_subscriptions(self, user_id):
+        """Subscribe the profile's user to exactly the sources on the form."""
+        profile = self.instance
+        set_subscriptions(user_id, Source.DISCORD,
+                          [profile.discord_channel_id] + self.cleaned_data['extra_discord_channels'].splitlines())
+        set_subscriptions(user_id, Source.REDDIT,
+                          [profile.reddit_subreddit] + self.cleaned_data['extra_subreddits'].splitlines())
+
 class RedditPostForm(forms.ModelForm):
     class Meta:
         model = RedditPostSchedule
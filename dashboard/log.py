@@ -0,0 +1,25 @@
+"""
+JSON log formatting, so request timings and scheduler events can be searched
+and aggregated by field. Anything passed in ``extra=`` becomes a field.
+"""
+import json
+import logging
+
+# Attributes every LogRecord has; anything else came from ``extra``.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
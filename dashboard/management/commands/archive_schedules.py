@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from dashboard.models import (
+    DiscordMessageSchedule, DiscordMessageScheduleArchive,
+    RedditPostSchedule, RedditPostScheduleArchive,
+)
+
+
+class Command(BaseCommand):
+    help = "Move sent and failed scheduled posts and messages older than --days into the archive tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help="Archive items scheduled more than this many days ago (default: 30).")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+
+        # Done and failed rows are moved separately, so that each batch is a
+        # range of the (status, scheduled_time) index rather than a table scan.
+        reddit = sum(
+            archive(
+                RedditPostSchedule.objects.filter(**status, scheduled_time__lt=cutoff),
+                lambda post: RedditPostScheduleArchive(
+                    id=post.id, user_id=post.user_id, title=post.title, content=post.content,
+                    url=post.url, media_id=post.media_id, scheduled_time=post.scheduled_time,
+                    failed=post.failed, last_error=post.last_error,
+                ),
+                RedditPostScheduleArchive,
+                batch_size,
+            )
+            for status in ({'posted': True}, {'posted': False, 'failed': True})
+        )
+        discord = sum(
+            archive(
+                DiscordMessageSchedule.objects.filter(**status, scheduled_time__lt=cutoff),
+                lambda msg: DiscordMessageScheduleArchive(
+                    id=msg.id, user_id=msg.user_id, channel_id=msg.channel_id, message=msg.message,
+                    media_id=msg.media_id, scheduled_time=msg.scheduled_time, created_at=msg.created_at,
+                    failed=msg.failed, last_error=msg.last_error,
+                ),
+                DiscordMessageScheduleArchive,
+                batch_size,
+            )
+            for status in ({'sent': True}, {'sent': False, 'failed': True})
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {reddit} Reddit posts and {discord} Discord messages."
+        ))
+
+
+def archive(queryset, to_archive, archive_model, batch_size):
+    """Move rows in batches, each in its own transaction; return the count."""
+    moved = 0
+    while True:
+        with transaction.atomic():
+            batch = list(queryset.order_by('scheduled_time')[:batch_size])
+            if not batch:
+                return moved
+            archive_model.objects.bulk_create([to_archive(row) for row in batch], ignore_conflicts=True)
+            queryset.model.objects.filter(pk__in=[row.pk for row in batch]).delete()
+        moved += len(batch)
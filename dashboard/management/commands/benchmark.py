@@ -0,0 +1,18 @@
+from importlib import import_module
+
+from django.core.management.base import BaseCommand
+
+from dashboard.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = "Run one of the dashboard's performance benchmarks."
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='benchmark', required=True)
+        for name, module in BENCHMARKS.items():
+            module = import_module(module)
+            module.add_arguments(subparsers.add_parser(name, help=module.__doc__.strip().splitlines()[0]))
+
+    def handle(self, *args, **options):
+        import_module(BENCHMARKS[options['benchmark']]).run(options, self.stdout)
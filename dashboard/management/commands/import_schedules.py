@@ -0,0 +1,39 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import bulk
+
+
+class Command(BaseCommand):
+    help = (
+        "Schedule Reddit posts and Discord messages for a user from a CSV or JSONL file "
+        "(see dashboard/bulk.py for the columns). Running servers pick the items up "
+        "within SCHEDULER_RESYNC_INTERVAL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help="Username to schedule the items for.")
+        parser.add_argument('--format', choices=bulk.FORMATS,
+                            help="File format (default: from the file extension).")
+        parser.add_argument('--type', choices=bulk.KINDS, help="Type of rows without a type column.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['user']}")
+        format = options['format'] or bulk.guess_format(options['path'])
+
+        with open(options['path'], newline='', encoding='utf-8-sig') as f:
+            result = bulk.import_schedules(user, f, format, options['type'], options['batch_size'])
+
+        for line, error in result.errors:
+            self.stderr.write(f"Line {line}: {error}")
+        if result.error_count > len(result.errors):
+            self.stderr.write(f"... and {result.error_count - len(result.errors)} more errors")
+        self.stdout.write(self.style.SUCCESS(
+            f"Scheduled {result.created['reddit']} Reddit posts and {result.created['discord']} Discord messages; "
+            f"skipped {result.error_count} invalid rows."
+        ))
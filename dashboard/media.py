@@ -0,0 +1,286 @@
+"""
+Images and videos attached to scheduled Reddit posts and Discord messages.
+
+Uploads to the views that take attachments (decorated with
+``hashing_uploads``) are streamed to a temporary file on disk by
+``HashingUploadHandler``, which computes the file's SHA-256 as the chunks
+arrive and stops the upload once it passes MEDIA_MAX_UPLOAD_SIZE, so a large
+video is never held in memory and never read a second time. ``store_upload``
+then checks what the file really is from its first bytes and moves it to a
+path derived from its hash; uploading the same file again reuses the stored
+copy.
+
+Thumbnails (a frame for videos) are generated by ``thumbnailer`` on a small
+pool of worker threads once the upload is saved, off the request path.
+Pillow and ffmpeg are optional; without them thumbnails are marked
+unavailable.
+"""
+import functools
+import hashlib
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.db import IntegrityError, close_old_connections, transaction
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+from .models import MediaFile
+
+try:
+    from PIL import Image
+except ImportError:  # only needed for image thumbnails
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Extensions kept on stored files so they are served with the right type.
+EXTENSIONS = {
+    'image/jpeg': '.jpg', 'image/png': '.png', 'image/gif': '.gif', 'image/webp': '.webp',
+    'video/mp4': '.mp4', 'video/quicktime': '.mov', 'video/webm': '.webm',
+}
+
+
+# Leading bytes of the accepted file types. MP4 and QuickTime files both
+# start with an "ftyp" box; its brand tells them apart (see _sniff).
+SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'\x1aE\xdf\xa3', 'video/webm'),
+]
+
+
+def max_upload_size():
+    return getattr(settings, 'MEDIA_MAX_UPLOAD_SIZE', 512 * 1024 * 1024)
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """
+    Writes uploads to a temporary file, setting ``sha256`` on the result.
+    Stops the upload, setting ``too_large``, once a file passes
+    MEDIA_MAX_UPLOAD_SIZE.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_size = max_upload_size()
+        self.too_large = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_size:
+            self.too_large = True  # the parser closes, and so deletes, the partial file
+            raise StopUpload(connection_reset=True)
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        upload = super().file_complete(file_size)
+        upload.sha256 = self.sha256.hexdigest()
+        return upload
+
+
+def hashing_uploads(view):
+    """
+    Decorator for views that take attachments: their uploads go through
+    HashingUploadHandler. Upload handlers can't be changed once anything has
+    read request.POST, which CsrfViewMiddleware does, so the CSRF check is
+    made here instead, after the handler is installed.
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers = [HashingUploadHandler(request)]
+        return protected(request, *args, **kwargs)
+    return wrapper
+
+
+class InvalidMedia(ValueError):
+    pass
+
+
+def uploaded_media(request, field='media'):
+    """
+    The file uploaded as ``field``, or None. Raises InvalidMedia if the
+    upload was stopped for being over MEDIA_MAX_UPLOAD_SIZE, in which case
+    the fields after it are missing too, so call this before reading them.
+    """
+    upload = request.FILES.get(field)
+    if any(getattr(handler, 'too_large', False) for handler in request.upload_handlers):
+        raise InvalidMedia(f"Attachments are limited to {max_upload_size() // (1024 * 1024)} MB.")
+    return upload
+
+
+def store_upload(upload):
+    """
+    Store an uploaded image or video and return its MediaFile, reusing the
+    existing one if the same content was uploaded before. Raises
+    InvalidMedia for other file types, whatever the client says they are,
+    and files over MEDIA_MAX_UPLOAD_SIZE.
+    """
+    content_type = _sniff(upload)
+    if content_type is None:
+        raise InvalidMedia("Only images and videos can be attached.")
+    kind = content_type.split('/')[0]
+    max_size = max_upload_size()
+    if upload.size > max_size:
+        raise InvalidMedia(f"Attachments are limited to {max_size // (1024 * 1024)} MB.")
+
+    sha256 = getattr(upload, 'sha256', None) or _hash(upload)
+    existing = MediaFile.objects.filter(sha256=sha256).first()
+    if existing is not None:
+        return existing
+
+    name = f"uploads/{sha256[:2]}/{sha256}{EXTENSIONS.get(content_type, '')}"
+    _save(upload, default_storage.path(name))
+    try:
+        with transaction.atomic():
+            media = MediaFile.objects.create(
+                sha256=sha256, kind=kind, content_type=content_type, size=upload.size, file=name,
+            )
+    except IntegrityError:
+        # Someone stored the same file at the same time.
+        return MediaFile.objects.get(sha256=sha256)
+    transaction.on_commit(lambda: thumbnailer.submit(media.pk))
+    return media
+
+
+def _sniff(upload):
+    """The upload's content type, judged from its first bytes, or None."""
+    upload.seek(0)
+    head = upload.read(16)
+    upload.seek(0)
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:8] == b'ftyp':
+        return 'video/quicktime' if head[8:12] == b'qt  ' else 'video/mp4'
+    return None
+
+
+def _hash(upload):
+    # Uploads that didn't come through HashingUploadHandler, e.g. in tests.
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _save(upload, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if hasattr(upload, 'temporary_file_path'):
+        # Usually a rename; the upload handler already wrote it to disk.
+        file_move_safe(upload.temporary_file_path(), path, allow_overwrite=True)
+        return
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as out:
+        for chunk in upload.chunks():
+            out.write(chunk)
+    os.replace(partial, path)
+
+
+class Thumbnailer:
+    """
+    Generates MediaFile thumbnails on ``max_workers`` threads. Pillow and
+    ffmpeg (a subprocess) do their work outside the GIL, so a few threads
+    keep them busy without slowing the web workers' threads.
+    """
+
+    def __init__(self, max_workers=2, size=320, ffmpeg='ffmpeg', timeout=60):
+        self.max_workers = max_workers
+        self.size = size
+        self.ffmpeg = ffmpeg
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._queued = set()  # MediaFile pks queued or being processed
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='thumbnailer')
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='thumbnailer')
+
+    def start(self):
+        """Queue thumbnails left pending, e.g. by a restart."""
+        pending = MediaFile.objects.filter(thumbnail_status=MediaFile.THUMBNAIL_PENDING)
+        for pk in pending.values_list('pk', flat=True):
+            self.submit(pk)
+
+    def submit(self, media_id):
+        with self._lock:
+            if media_id in self._queued:
+                return None
+            self._queued.add(media_id)
+        return self._executor.submit(self._run, media_id)
+
+    def _run(self, media_id):
+        try:
+            media = MediaFile.objects.filter(pk=media_id, thumbnail_status=MediaFile.THUMBNAIL_PENDING).first()
+            if media is None:
+                return
+            name = f"thumbnails/{media.sha256[:2]}/{media.sha256}.jpg"
+            try:
+                status = self.render(media, default_storage.path(name))
+            except Exception as e:
+                logger.warning("Error generating thumbnail for media %s: %s", media.pk, e,
+                               extra={'media': media.pk, 'kind': media.kind})
+                status = MediaFile.THUMBNAIL_FAILED
+            MediaFile.objects.filter(pk=media.pk).update(
+                thumbnail=name if status == MediaFile.THUMBNAIL_READY else '', thumbnail_status=status,
+            )
+        finally:
+            with self._lock:
+                self._queued.discard(media_id)
+            close_old_connections()
+
+    def render(self, media, path):
+        """Write ``media``'s thumbnail to ``path`` as a JPEG; return the new status."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, partial = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.jpg')
+        os.close(fd)
+        try:
+            if media.kind == MediaFile.IMAGE:
+                if Image is None:
+                    return MediaFile.THUMBNAIL_UNAVAILABLE
+                with Image.open(media.file.path) as image:
+                    image.draft('RGB', (self.size, self.size))  # JPEGs decode at reduced size
+                    image.thumbnail((self.size, self.size))
+                    image.convert('RGB').save(partial, 'JPEG', quality=85)
+            else:
+                try:
+                    subprocess.run(
+                        [self.ffmpeg, '-v', 'error', '-y', '-i', media.file.path, '-frames:v', '1',
+                         '-vf', f'scale={self.size}:{self.size}:force_original_aspect_ratio=decrease',
+                         '-f', 'image2', partial],
+                        check=True, capture_output=True, timeout=self.timeout,
+                    )
+                except FileNotFoundError:
+                    return MediaFile.THUMBNAIL_UNAVAILABLE
+            os.replace(partial, path)
+            return MediaFile.THUMBNAIL_READY
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+
+thumbnailer = Thumbnailer(
+    max_workers=getattr(settings, 'MEDIA_THUMBNAIL_WORKERS', 2),
+    size=getattr(settings, 'MEDIA_THUMBNAIL_SIZE', 320),
+    ffmpeg=getattr(settings, 'MEDIA_FFMPEG', 'ffmpeg'),
+)
@@ -0,0 +1,368 @@
+"""
+Local proxy for Discord avatars and Reddit images and videos.
+
+The JSON views rewrite third-party media URLs with ``proxy_url`` so browsers
+load them from ``/api/media/proxy/``, which serves them from an on-disk cache
+instead of every dashboard fetching them from Discord's and Reddit's CDNs
+on every render. Proxied URLs are signed and only hosts in MEDIA_PROXY_HOSTS
+are fetched, redirects included, so the endpoint can't be used as an open
+proxy.
+
+Cached files are fresh for the upstream's max-age, or MEDIA_PROXY_TTL
+seconds, and then revalidated with If-None-Match/If-Modified-Since; a 304
+renews them without a download, and if the upstream fails the stale copy is
+served. Images can be resized to one of MEDIA_PROXY_SIZES; each size is
+cached as an entry of its own. The cache is bounded to MEDIA_PROXY_CACHE_BYTES
+and evicts the least recently used files first. Files over
+MEDIA_PROXY_MAX_FILE_SIZE aren't cached; the view redirects to them.
+"""
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from urllib.parse import urlencode, urljoin, urlsplit
+
+import requests
+from django.conf import settings
+from django.core.signing import Signer
+from django.urls import reverse
+from requests.adapters import HTTPAdapter
+
+from .metrics import CACHE_REQUESTS, observe_upstream
+
+try:
+    from PIL import Image
+except ImportError:  # only needed for resizing; images are served as is without it
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# A cached file; ``digest`` is the SHA-256 of its content.
+Entry = namedtuple('Entry', ['path', 'content_type', 'digest'])
+
+
+class ProxyError(Exception):
+    """The upstream file couldn't be fetched and no copy is cached."""
+
+
+class TooLarge(ProxyError):
+    pass
+
+
+def _signer():
+    return Signer(salt='dashboard.media_proxy')
+
+
+def signature(url, size=None):
+    return _signer().signature(f"{url}|{size or ''}")
+
+
+def proxy_url(url, size=None):
+    """``url`` through the proxy, or unchanged if its host isn't proxied."""
+    if not url or not getattr(settings, 'MEDIA_PROXY_ENABLED', True):
+        return url
+    return _proxy_url(url, size)
+
+
+@functools.lru_cache(maxsize=8192)
+def _proxy_url(url, size):
+    if urlsplit(url).hostname not in media_proxy.hosts:
+        return url
+    query = {'url': url}
+    if size:
+        query['size'] = size
+    query['sig'] = signature(url, size)
+    return f"{reverse('media_proxy')}?{urlencode(query)}"
+
+
+def _key(url, size=None):
+    return hashlib.sha256(f"{url}|{size or ''}".encode()).hexdigest()
+
+
+def _max_age(headers, default):
+    match = re.search(r'max-age=(\d+)', headers.get('Cache-Control', ''))
+    return int(match.group(1)) if match else default
+
+
+class MediaProxy:
+    def __init__(self, root, hosts, max_bytes=512 * 1024 * 1024, max_file_size=20 * 1024 * 1024, ttl=86400,
+                 sizes=(64, 320, 640), timeout=(3.05, 10), pool_size=16, session=None, clock=time.time):
+        self.root = str(root)
+        self.hosts = frozenset(hosts)
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.ttl = ttl
+        self.sizes = tuple(sizes)
+        self.timeout = timeout
+        self._clock = clock
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.session = session
+        self._lock = threading.Lock()  # guards the index
+        self._index = None  # key -> metadata, least recently used first; loaded on first use
+        self._bytes = 0
+        self._too_large = {}  # key -> until when to redirect without asking upstream
+        # Concurrent misses for the same file download it once.
+        self._fetch_locks = [threading.Lock() for _ in range(64)]
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._fetch_locks = [threading.Lock() for _ in range(64)]
+
+    def get(self, url, size=None):
+        """
+        Return the cached Entry for ``url``, resized to fit ``size`` pixels
+        if given, fetching or revalidating it first if needed. Raises
+        TooLarge or ProxyError.
+        """
+        key = _key(url)
+        if self._too_large.get(key, 0) > self._clock():
+            raise TooLarge(url)
+        try:
+            original = self._get(key, lambda meta: self._download(url, meta), self._fresh)
+        except TooLarge:
+            if len(self._too_large) >= 4096:
+                self._too_large.clear()
+            self._too_large[key] = self._clock() + self.ttl
+            raise
+        if size is None or Image is None or original.content_type in ('image/gif', 'image/svg+xml') \
+                or not original.content_type.startswith('image/'):
+            return original
+        try:
+            return self._get(
+                _key(url, size), lambda meta: self._resize(_key(url, size), original, size),
+                lambda meta: meta.get('source') == original.digest,
+            )
+        except Exception as e:
+            logger.warning("Error resizing %s: %s", url, e, extra={'size': size})
+            return original
+
+    def __len__(self):
+        return len(self._index or ())
+
+    def _get(self, key, fetch, is_current):
+        meta = self._lookup(key)
+        if meta is not None and is_current(meta):
+            CACHE_REQUESTS.inc(cache='media_proxy', result='hit')
+            return self._entry(key, meta)
+        with self._fetch_locks[int(key[:8], 16) % len(self._fetch_locks)]:
+            meta = self._lookup(key)
+            if meta is not None and is_current(meta):
+                CACHE_REQUESTS.inc(cache='media_proxy', result='hit')
+                return self._entry(key, meta)
+            CACHE_REQUESTS.inc(cache='media_proxy', result='miss' if meta is None else 'stale')
+            return fetch(meta)
+
+    def _fresh(self, meta):
+        return self._clock() - meta['fetched_at'] < meta['max_age']
+
+    def _download(self, url, meta):
+        key = _key(url)
+        headers = {}
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        host = urlsplit(url).hostname
+        start = time.perf_counter()
+        try:
+            with self._request(url, headers) as response:
+                if response.status_code == 304 and meta is not None:
+                    observe_upstream('media', host, 304, time.perf_counter() - start)
+                    meta.update(fetched_at=self._clock(), max_age=_max_age(response.headers, self.ttl))
+                    self._store(key, meta)
+                    return self._entry(key, meta)
+                try:
+                    meta = self._save_response(key, url, response)
+                finally:
+                    observe_upstream('media', host, response.status_code, time.perf_counter() - start)
+        except requests.RequestException as e:
+            observe_upstream('media', host, 'error', time.perf_counter() - start)
+            error = ProxyError(str(e))
+        except TooLarge:
+            raise
+        except ProxyError as e:
+            error = e
+        else:
+            return self._entry(key, meta)
+        if meta is None:
+            raise error
+        logger.warning("Serving stale %s: %s", url, error)
+        return self._entry(key, meta)
+
+    def _request(self, url, headers):
+        """GET ``url``, following redirects by hand so each hop's host is checked."""
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True,
+                                        allow_redirects=False)
+            if response.status_code not in REDIRECT_STATUSES or 'Location' not in response.headers:
+                return response
+            response.close()
+            location = urljoin(url, response.headers['Location'])
+            if urlsplit(location).scheme != 'https' or urlsplit(location).hostname not in self.hosts:
+                raise ProxyError(f"{urlsplit(url).hostname} redirected to {urlsplit(location).hostname}")
+            url = location
+        raise ProxyError(f"Too many redirects from {urlsplit(url).hostname}")
+
+    def _save_response(self, key, url, response):
+        if response.status_code != 200:
+            raise ProxyError(f"{urlsplit(url).hostname} returned {response.status_code}")
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if not content_type.startswith(('image/', 'video/')):
+            raise ProxyError(f"{urlsplit(url).hostname} returned {content_type or 'no content type'}")
+        if int(response.headers.get('Content-Length') or 0) > self.max_file_size:
+            raise TooLarge(url)
+        digest, size = self._write(key, response.iter_content(CHUNK_SIZE))
+        meta = {
+            'url': url, 'content_type': content_type, 'digest': digest, 'bytes': size,
+            'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': self._clock(), 'max_age': _max_age(response.headers, self.ttl),
+        }
+        self._store(key, meta)
+        return meta
+
+    def _resize(self, key, original, size):
+        with Image.open(original.path) as image:
+            image.draft('RGB', (size, size))  # JPEGs decode at reduced size
+            image.thumbnail((size, size))
+            if image.mode in ('RGBA', 'LA', 'P'):
+                format, content_type = 'PNG', 'image/png'
+            else:
+                format, content_type = 'JPEG', 'image/jpeg'
+                image = image.convert('RGB')
+            resized = io.BytesIO()
+            image.save(resized, format)
+        digest, size_bytes = self._write(key, [resized.getvalue()])
+        meta = {
+            'content_type': content_type, 'digest': digest, 'bytes': size_bytes,
+            'source': original.digest, 'fetched_at': self._clock(),
+        }
+        self._store(key, meta)
+        return self._entry(key, meta)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _entry(self, key, meta):
+        return Entry(self._path(key), meta['content_type'], meta['digest'])
+
+    def _write(self, key, chunks):
+        """Write ``chunks`` to ``key``'s file; return its digest and size."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, partial = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_file_size:
+                        raise TooLarge(key)
+                    digest.update(chunk)
+                    out.write(chunk)
+            os.replace(partial, path)
+        except BaseException:
+            os.remove(partial)
+            raise
+        return digest.hexdigest(), size
+
+    def _store(self, key, meta):
+        """Save ``key``'s metadata and evict least recently used files past ``max_bytes``."""
+        path = self._path(key) + '.json'
+        fd, partial = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as out:
+            json.dump(meta, out)
+        os.replace(partial, path)
+        evicted = []
+        with self._lock:
+            index = self._load_index()
+            old = index.pop(key, None)
+            self._bytes += meta['bytes'] - (old['bytes'] if old else 0)
+            index[key] = meta
+            while self._bytes > self.max_bytes and len(index) > 1:
+                old_key, old = index.popitem(last=False)
+                self._bytes -= old['bytes']
+                evicted.append(old_key)
+        for old_key in evicted:
+            for name in (self._path(old_key), self._path(old_key) + '.json'):
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+
+    def _lookup(self, key):
+        with self._lock:
+            index = self._load_index()
+            meta = index.get(key)
+            if meta is not None:
+                index.move_to_end(key)
+        if meta is None:
+            # Possibly cached by another process sharing the directory.
+            try:
+                with open(self._path(key) + '.json') as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, ValueError):
+                return None
+            with self._lock:
+                if key not in self._index:
+                    self._index[key] = meta
+                    self._bytes += meta['bytes']
+            return meta
+        try:
+            # Recency for rebuilding the index after a restart.
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            # Evicted by another process sharing the directory.
+            with self._lock:
+                if self._index.pop(key, None) is not None:
+                    self._bytes -= meta['bytes']
+            return None
+        return meta
+
+    # Callers must hold self._lock.
+    def _load_index(self):
+        if self._index is not None:
+            return self._index
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(dirpath, name)) as f:
+                        meta = json.load(f)
+                    used_at = os.stat(os.path.join(dirpath, name[:-5])).st_mtime
+                except (OSError, ValueError):
+                    continue
+                entries.append((used_at, name[:-5], meta))
+        entries.sort(key=lambda entry: entry[0])
+        self._index = OrderedDict((key, meta) for _, key, meta in entries)
+        self._bytes = sum(meta['bytes'] for meta in self._index.values())
+        return self._index
+
+
+media_proxy = MediaProxy(
+    root=getattr(settings, 'MEDIA_PROXY_ROOT', os.path.join(settings.MEDIA_ROOT, 'proxy')),
+    hosts=getattr(settings, 'MEDIA_PROXY_HOSTS', ()),
+    max_bytes=getattr(settings, 'MEDIA_PROXY_CACHE_BYTES', 512 * 1024 * 1024),
+    max_file_size=getattr(settings, 'MEDIA_PROXY_MAX_FILE_SIZE', 20 * 1024 * 1024),
+    ttl=getattr(settings, 'MEDIA_PROXY_TTL', 86400),
+    sizes=getattr(settings, 'MEDIA_PROXY_SIZES', (64, 320, 640)),
+)
@@ -0,0 +1,220 @@
+"""
+In-process metrics, served in the Prometheus text format at /metrics.
+
+Counters, gauges and histograms are kept per process (scrape every worker,
+or run one), updated from the hot paths: every view (middleware.py), every
+HTTP call to Discord and Reddit, the response caches, and the scheduler.
+Gauges can be given a function that is called at scrape time instead of
+being set, for values that are cheaper to read when asked for (e.g. the
+scheduler's queue depth).
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; upstream calls and views are expected between a few ms and ~10s.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Scheduler lag is seconds to (with retries and backoff) an hour or more.
+LAG_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600, 4 * 3600)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """The registered metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> value
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}")
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _format(self, key, suffix='', extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        labels = ','.join(f'{label}="{_escape(value)}"' for label, value in pairs)
+        return f"{self.name}{suffix}{{{labels}}}" if labels else f"{self.name}{suffix}"
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self._format(key)} {_number(value)}" for key, value in values]
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """
+        Read the gauge from ``function()`` at scrape time. It returns a dict
+        mapping label values (a tuple, in ``labels`` order) to values.
+        """
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            values = list(self._function().items())
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return [f"{self._format(tuple(map(str, key)))} {_number(value)}" for key, value in values]
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = _HistogramValue(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram.counts[i] += 1
+                    break
+            histogram.sum += value
+            histogram.count += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the block takes. Labels can be added to the yielded dict."""
+        labels = dict(labels)
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(h.counts), h.sum, h.count) for key, h in self._values.items()]
+        lines = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self._format(key, '_bucket', [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self._format(key, '_bucket', [('le', '+Inf')])} {count}")
+            lines.append(f"{self._format(key, '_sum')} {_number(total)}")
+            lines.append(f"{self._format(key, '_count')} {count}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ----- The dashboard's metrics -----
+REQUEST_LATENCY = Histogram(
+    'dashboard_request_duration_seconds', "Time to respond, per view.", ['view', 'method', 'status'],
+)
+UPSTREAM_LATENCY = Histogram(
+    'dashboard_upstream_request_duration_seconds', "Time per HTTP call to Discord or Reddit.",
+    ['service', 'endpoint', 'status'],
+)
+UPSTREAM_RATE_LIMITED = Counter(
+    'dashboard_upstream_rate_limited_total', "429 responses from Discord or Reddit.", ['service'],
+)
+UPSTREAM_RETRIES = Counter(
+    'dashboard_upstream_retries_total', "Upstream calls retried after an error or 429.", ['service'],
+)
+CACHE_REQUESTS = Counter(
+    'dashboard_cache_requests_total', "Cache lookups by result (hit, stale or miss).", ['cache', 'result'],
+)
+SCHEDULER_LAG = Histogram(
+    'dashboard_scheduler_lag_seconds', "Time from an item's scheduled_time to it being sent.", ['kind'],
+    buckets=LAG_BUCKETS,
+)
+SCHEDULER_SENDS = Counter(
+    'dashboard_scheduler_sends_total', "Scheduled items by outcome (sent, retry or failed).", ['kind', 'result'],
+)
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    'dashboard_scheduler_queue_depth', "Items that are due and not yet sent.", ['kind'],
+)
+PREFETCH_SOURCES = Gauge(
+    'dashboard_prefetch_sources', "Sources the prefetcher is keeping warm in this process.",
+)
+ARCHIVE_ROWS = Counter(
+    'dashboard_archive_rows_total', "Fetched messages and posts written to or dropped from the archive.",
+    ['kind', 'result'],
+)
+ARCHIVE_PENDING = Gauge(
+    'dashboard_archive_pending_rows', "Rows buffered in this process waiting to be archived.",
+)
+
+
+def observe_upstream(service, endpoint, status, seconds):
+    """Record one HTTP call; ``status`` is the response status or 'error'."""
+    UPSTREAM_LATENCY.observe(seconds, service=service, endpoint=endpoint, status=status)
+    if status == 429:
+        UPSTREAM_RATE_LIMITED.inc(service=service)
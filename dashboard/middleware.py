@@ -0,0 +1,42 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from .metrics import REQUEST_LATENCY
+
+logger = logging.getLogger('dashboard.requests')
+
+SLOW_REQUEST_SECONDS = getattr(settings, 'SLOW_REQUEST_SECONDS', 1)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Time every request, per view, into REQUEST_LATENCY and the log."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            start = time.perf_counter()
+            response = await get_response(request)
+            _record(request, response, time.perf_counter() - start)
+            return response
+    else:
+        def middleware(request):
+            start = time.perf_counter()
+            response = get_response(request)
+            _record(request, response, time.perf_counter() - start)
+            return response
+    return middleware
+
+
+def _record(request, response, seconds):
+    match = request.resolver_match
+    # Unmatched paths (404s) share one label so scanners can't blow up the series.
+    view = (match.url_name or match.view_name) if match else 'unmatched'
+    REQUEST_LATENCY.observe(seconds, view=view, method=request.method, status=response.status_code)
+    level = logging.WARNING if seconds >= SLOW_REQUEST_SECONDS else logging.DEBUG
+    logger.log(level, "%s %s %s", request.method, view, response.status_code, extra={
+        'view': view, 'method': request.method, 'status': response.status_code,
+        'duration_ms': round(seconds * 1000, 1),
+    })
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0003_discordmessageschedule_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discordmessageschedule',
+            name='claim_token',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='discordmessageschedule',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='redditpostschedule',
+            name='claim_token',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='redditpostschedule',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0004_schedule_claims'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscordMessageScheduleArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('message', models.TextField()),
+                ('scheduled_time', models.DateTimeField()),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RedditPostScheduleArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=300)),
+                ('content', models.TextField(blank=True)),
+                ('url', models.URLField(blank=True)),
+                ('scheduled_time', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='discordmessageschedule',
+            index=models.Index(condition=models.Q(('sent', False)), fields=['scheduled_time'], name='discord_sched_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discordmessageschedule',
+            index=models.Index(fields=['sent', 'scheduled_time'], name='discord_sched_status_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='redditpostschedule',
+            index=models.Index(condition=models.Q(('posted', False)), fields=['scheduled_time'], name='reddit_sched_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='redditpostschedule',
+            index=models.Index(fields=['posted', 'scheduled_time'], name='reddit_sched_status_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='discordmessageschedulearchive',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='redditpostschedulearchive',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
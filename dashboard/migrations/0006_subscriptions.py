@@ -0,0 +1,52 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def subscribe_existing_profiles(apps, schema_editor):
+    UserProfile = apps.get_model('dashboard', 'UserProfile')
+    Source = apps.get_model('dashboard', 'Source')
+    Subscription = apps.get_model('dashboard', 'Subscription')
+    for profile in UserProfile.objects.all():
+        for kind, name in (('discord', profile.discord_channel_id.strip()),
+                           ('reddit', profile.reddit_subreddit.strip().lower())):
+            if name:
+                source, _ = Source.objects.get_or_create(kind=kind, name=name)
+                Subscription.objects.get_or_create(user_id=profile.user_id, source=source)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0005_schedule_indexes_and_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Source',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('discord', 'Discord channel'), ('reddit', 'Subreddit')], max_length=10)),
+                ('name', models.CharField(max_length=100)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'name'), name='source_kind_name_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Subscription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subscriptions', to='dashboard.source')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subscriptions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'source'), name='subscription_user_source_uniq')],
+            },
+        ),
+        migrations.RunPython(subscribe_existing_profiles, migrations.RunPython.noop),
+    ]
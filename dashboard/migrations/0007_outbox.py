@@ -0,0 +1,48 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0006_subscriptions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discordmessageschedule',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='discordmessageschedule',
+            name='channel_id',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='discordmessageschedule',
+            name='failed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='discordmessageschedule',
+            name='last_error',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='redditpostschedule',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='redditpostschedule',
+            name='failed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='redditpostschedule',
+            name='last_error',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0007_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('kind', models.CharField(choices=[('image', 'Image'), ('video', 'Video')], max_length=10)),
+                ('content_type', models.CharField(max_length=100)),
+                ('size', models.BigIntegerField()),
+                ('file', models.FileField(max_length=200, upload_to='')),
+                ('thumbnail', models.FileField(blank=True, max_length=200, upload_to='')),
+                ('thumbnail_status', models.CharField(default='pending', max_length=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='discordmessageschedule',
+            name='message',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='discordmessageschedule',
+            name='media',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='dashboard.mediafile'),
+        ),
+        migrations.AddField(
+            model_name='redditpostschedule',
+            name='media',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='dashboard.mediafile'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0008_media'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedDiscordMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('channel_id', models.CharField(max_length=100)),
+                ('prev_id', models.BigIntegerField(null=True)),
+                ('author_id', models.CharField(max_length=32)),
+                ('author', models.CharField(max_length=100)),
+                ('avatar', models.CharField(blank=True, max_length=100)),
+                ('content', models.TextField(blank=True)),
+                ('timestamp', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['channel_id', '-id'], name='archived_msg_channel_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedRedditPost',
+            fields=[
+                ('id', models.CharField(max_length=16, primary_key=True, serialize=False)),
+                ('subreddit', models.CharField(max_length=100)),
+                ('prev_id', models.CharField(max_length=16, null=True)),
+                ('title', models.CharField(max_length=300)),
+                ('author', models.CharField(max_length=100)),
+                ('score', models.IntegerField(default=0)),
+                ('url', models.TextField(blank=True)),
+                ('selftext', models.TextField(blank=True)),
+                ('selftext_truncated', models.BooleanField(default=False)),
+                ('media_type', models.CharField(max_length=10)),
+                ('media_url', models.TextField(blank=True)),
+                ('permalink', models.CharField(blank=True, max_length=300)),
+                ('num_comments', models.IntegerField(default=0)),
+                ('created_utc', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['subreddit', '-created_utc'], name='archived_post_subreddit_idx')],
+            },
+        ),
+    ]
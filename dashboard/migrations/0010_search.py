@@ -0,0 +1,77 @@
+from django.db import migrations, models, transaction
+from django.db.utils import OperationalError
+
+# FTS5 indexes over the archive (see search.py), kept up to date by triggers.
+# They index the archive tables' text without storing a second copy of it.
+# SQLite drops the triggers when a migration rebuilds one of these tables, so
+# such a migration has to create them again.
+INDEXES = [
+    ('dashboard_archiveddiscordmessage', 'id', ['content']),
+    ('dashboard_archivedredditpost', 'number', ['title', 'selftext']),
+]
+
+
+def _index_sql(table, key, columns):
+    fts = f'{table}_fts'
+    names = ', '.join(columns)
+    new = ', '.join(f'new.{column}' for column in columns)
+    old = ', '.join(f'old.{column}' for column in columns)
+    delete = f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.{key}, {old});"
+    insert = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.{key}, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({names}, content='{table}', content_rowid='{key}', prefix='2 3')",
+        f"CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER {fts}_update AFTER UPDATE OF {names} ON {table} BEGIN {delete} {insert} END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def number_existing_posts(apps, schema_editor):
+    ArchivedRedditPost = apps.get_model('dashboard', 'ArchivedRedditPost')
+    for post in ArchivedRedditPost.objects.only('pk').iterator():
+        ArchivedRedditPost.objects.filter(pk=post.pk).update(number=int(post.pk, 36))
+
+
+def create_search_indexes(apps, schema_editor):
+    # Other databases, and SQLite builds without FTS5, search with LIKE.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            for table, key, columns in INDEXES:
+                for sql in _index_sql(table, key, columns):
+                    schema_editor.execute(sql)
+    except OperationalError:
+        pass
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, _, _ in INDEXES:
+        for trigger in ('insert', 'delete', 'update'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0009_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedredditpost',
+            name='number',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunPython(number_existing_posts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='archivedredditpost',
+            name='number',
+            field=models.BigIntegerField(unique=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+def normalize_subreddit_sources(apps, schema_editor):
+    """
+    0006 stored subreddits entered as "r/name" or "/r/name" as is, so those
+    subscriptions never matched; move them to the normalized source.
+    """
+    Source = apps.get_model('dashboard', 'Source')
+    Subscription = apps.get_model('dashboard', 'Subscription')
+    for source in Source.objects.filter(kind='reddit'):
+        name = source.name
+        if name.startswith('/'):
+            name = name[1:]
+        if name.startswith('r/'):
+            name = name[2:]
+        if name == source.name:
+            continue
+        target, _ = Source.objects.get_or_create(kind='reddit', name=name)
+        # Users already subscribed to both keep the existing subscription.
+        Subscription.objects.filter(source=source).exclude(
+            user_id__in=Subscription.objects.filter(source=target).values('user_id')
+        ).update(source=target)
+        source.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0010_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_subreddit_sources, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 21:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0011_normalize_subreddit_sources'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discordmessageschedulearchive',
+            name='channel_id',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 21:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0012_archive_channel_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discordmessageschedulearchive',
+            name='media',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='dashboard.mediafile'),
+        ),
+        migrations.AddField(
+            model_name='redditpostschedulearchive',
+            name='media',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='dashboard.mediafile'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.7 on 2026-10-18 21:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0013_archive_media'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='discordmessageschedule',
+            name='discord_sched_pending_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='redditpostschedule',
+            name='reddit_sched_pending_idx',
+        ),
+        migrations.AddField(
+            model_name='discordmessageschedulearchive',
+            name='failed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='discordmessageschedulearchive',
+            name='last_error',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='redditpostschedulearchive',
+            name='failed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='redditpostschedulearchive',
+            name='last_error',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddIndex(
+            model_name='discordmessageschedule',
+            index=models.Index(condition=models.Q(('failed', False), ('sent', False)), fields=['scheduled_time'], name='discord_sched_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='redditpostschedule',
+            index=models.Index(condition=models.Q(('failed', False), ('posted', False)), fields=['scheduled_time'], name='reddit_sched_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+from django.db import migrations, models, transaction
+from django.db.models import F
+from django.db.utils import OperationalError
+
+# Points the Reddit search index (see 0010_search) at the full self text
+# rather than the listing preview. Posts archived before this only have the
+# preview, until they are fetched again.
+TABLE = 'dashboard_archivedredditpost'
+FTS = f'{TABLE}_fts'
+
+
+def _index_sql(columns):
+    names = ', '.join(columns)
+    new = ', '.join(f'new.{column}' for column in columns)
+    old = ', '.join(f'old.{column}' for column in columns)
+    delete = f"INSERT INTO {FTS}({FTS}, rowid, {names}) VALUES ('delete', old.number, {old});"
+    insert = f"INSERT INTO {FTS}(rowid, {names}) VALUES (new.number, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE {FTS} USING fts5({names}, content='{TABLE}', content_rowid='number', prefix='2 3')",
+        f"CREATE TRIGGER {FTS}_insert AFTER INSERT ON {TABLE} BEGIN {insert} END",
+        f"CREATE TRIGGER {FTS}_delete AFTER DELETE ON {TABLE} BEGIN {delete} END",
+        f"CREATE TRIGGER {FTS}_update AFTER UPDATE OF {names} ON {TABLE} BEGIN {delete} {insert} END",
+        f"INSERT INTO {FTS}({FTS}) VALUES ('rebuild')",
+    ]
+
+
+def _create_index(schema_editor, columns):
+    # Other databases, and SQLite builds without FTS5, search with LIKE.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            for sql in _index_sql(columns):
+                schema_editor.execute(sql)
+    except OperationalError:
+        pass
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for trigger in ('insert', 'delete', 'update'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS}_{trigger}')
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS}')
+
+
+def index_full_selftext(apps, schema_editor):
+    _create_index(schema_editor, ['title', 'full_selftext'])
+
+
+def index_preview(apps, schema_editor):
+    _create_index(schema_editor, ['title', 'selftext'])
+
+
+def copy_previews(apps, schema_editor):
+    ArchivedRedditPost = apps.get_model('dashboard', 'ArchivedRedditPost')
+    ArchivedRedditPost.objects.update(full_selftext=F('selftext'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0014_archive_failed_schedules'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_index, index_preview),
+        migrations.AddField(
+            model_name='archivedredditpost',
+            name='full_selftext',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(copy_previews, migrations.RunPython.noop),
+        migrations.RunPython(index_full_selftext, drop_index),
+    ]
@@ -17,23 +17,228 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} Profile"
 
+    def save(self, *args, **kwargs):
+        from .profiles import invalidate_profile
+        from .sources import subscribe
+        super().save(*args, **kwargs)
+        # The profile's own channel and subreddit are always subscribed.
+        if self.discord_channel_id:
+            subscribe(self.user_id, Source.DISCORD, self.discord_channel_id)
+        if self.reddit_subreddit:
+            subscribe(self.user_id, Source.REDDIT, self.reddit_subreddit)
+        invalidate_profile(self.user_id)
+
+    def delete(self, *args, **kwargs):
+        from .profiles import invalidate_profile
+        user_id = self.user_id
+        result = super().delete(*args, **kwargs)
+        invalidate_profile(user_id)
+        return result
+
+class Source(models.Model):
+    """
+    A Discord channel or subreddit that at least one user subscribes to.
+
+    There is one row per distinct source however many users follow it, so
+    work done per source (fetching, prefetching) scales with the number of
+    distinct sources rather than with subscribers.
+    """
+    DISCORD = 'discord'
+    REDDIT = 'reddit'
+    KIND_CHOICES = [(DISCORD, 'Discord channel'), (REDDIT, 'Subreddit')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    name = models.CharField(max_length=100)  # channel id, or lowercased subreddit
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'name'], name='source_kind_name_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}:{self.name}"
+
+class Subscription(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions')
+    source = models.ForeignKey(Source, on_delete=models.CASCADE, related_name='subscriptions')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'source'], name='subscription_user_source_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} -> {self.source}"
+
+class MediaFile(models.Model):
+    """
+    An uploaded image or video, stored once per distinct content (see
+    media.py) however many scheduled posts and messages attach it.
+    """
+    IMAGE = 'image'
+    VIDEO = 'video'
+    KIND_CHOICES = [(IMAGE, 'Image'), (VIDEO, 'Video')]
+
+    THUMBNAIL_PENDING = 'pending'
+    THUMBNAIL_READY = 'ready'
+    THUMBNAIL_UNAVAILABLE = 'unavailable'  # no Pillow/ffmpeg for this kind
+    THUMBNAIL_FAILED = 'failed'
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    content_type = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    file = models.FileField(max_length=200)
+    thumbnail = models.FileField(max_length=200, blank=True)
+    thumbnail_status = models.CharField(max_length=12, default=THUMBNAIL_PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.sha256[:12]}"
+
 class RedditPostSchedule(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=300)
     content = models.TextField(blank=True)
     url = models.URLField(blank=True)
+    media = models.ForeignKey(MediaFile, null=True, blank=True, on_delete=models.SET_NULL)
     scheduled_time = models.DateTimeField()
     posted = models.BooleanField(default=False)
+    # Set by the scheduler process that is sending the post (see scheduler.py)
+    claim_token = models.CharField(max_length=32, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.CharField(max_length=500, blank=True)
+    failed = models.BooleanField(default=False)  # gave up retrying
+
+    class Meta:
+        indexes = [
+            # Due-work lookups; partial, so it stays small as history grows.
+            # Backends without partial indexes (MySQL) skip it and use the
+            # composite index below.
+            models.Index(fields=['scheduled_time'], condition=models.Q(posted=False, failed=False),
+                         name='reddit_sched_pending_idx'),
+            models.Index(fields=['posted', 'scheduled_time'], name='reddit_sched_status_time_idx'),
+        ]
 
     def __str__(self):
         return f"Scheduled Post by {self.user.username} at {self.scheduled_time}"
 
 class DiscordMessageSchedule(models.Model):
+    """
+    A scheduled Discord message, or an outbox entry for a message sent from
+    the dashboard (scheduled for the time it was sent).
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    message = models.TextField()
+    # Channel at the time the message was queued; blank means the profile's.
+    channel_id = models.CharField(max_length=100, blank=True)
+    message = models.TextField(blank=True)
+    media = models.ForeignKey(MediaFile, null=True, blank=True, on_delete=models.SET_NULL)
     scheduled_time = models.DateTimeField()
     sent = models.BooleanField(default=False)
+    # Set by the scheduler process that is sending the message (see scheduler.py)
+    claim_token = models.CharField(max_length=32, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.CharField(max_length=500, blank=True)
+    failed = models.BooleanField(default=False)  # gave up retrying
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['scheduled_time'], condition=models.Q(sent=False, failed=False),
+                         name='discord_sched_pending_idx'),
+            models.Index(fields=['sent', 'scheduled_time'], name='discord_sched_status_time_idx'),
+        ]
+
     def __str__(self):
         return f"Message by {self.user.username} at {self.scheduled_time}"
+
+    @property
+    def status(self):
+        if self.sent:
+            return 'sent'
+        if self.failed:
+            return 'failed'
+        return 'retrying' if self.attempts else 'queued'
+
+# Sent and failed schedules are moved here by the archive_schedules command
+# so the tables the scheduler reads only hold recent and pending rows.
+class RedditPostScheduleArchive(models.Model):
+    id = models.BigIntegerField(primary_key=True)  # same id as in RedditPostSchedule
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    title = models.CharField(max_length=300)
+    content = models.TextField(blank=True)
+    url = models.URLField(blank=True)
+    media = models.ForeignKey(MediaFile, null=True, blank=True, on_delete=models.SET_NULL)
+    scheduled_time = models.DateTimeField()
+    failed = models.BooleanField(default=False)  # given up on rather than posted
+    last_error = models.CharField(max_length=500, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived Post by {self.user.username} at {self.scheduled_time}"
+
+class DiscordMessageScheduleArchive(models.Model):
+    id = models.BigIntegerField(primary_key=True)  # same id as in DiscordMessageSchedule
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    channel_id = models.CharField(max_length=100, blank=True)  # as in DiscordMessageSchedule
+    message = models.TextField()
+    media = models.ForeignKey(MediaFile, null=True, blank=True, on_delete=models.SET_NULL)
+    scheduled_time = models.DateTimeField()
+    created_at = models.DateTimeField()
+    failed = models.BooleanField(default=False)  # given up on rather than sent
+    last_error = models.CharField(max_length=500, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived Message by {self.user.username} at {self.scheduled_time}"
+
+# Messages and posts fetched from Discord and Reddit, kept so history can be
+# served locally (see archive.py). ``prev_id`` is the next older item in the
+# channel or subreddit, when the page the item was fetched in shows it: 0 (or
+# '') at the very start, null when unknown.
+class ArchivedDiscordMessage(models.Model):
+    id = models.BigIntegerField(primary_key=True)  # Discord snowflake
+    channel_id = models.CharField(max_length=100)
+    prev_id = models.BigIntegerField(null=True)
+    author_id = models.CharField(max_length=32)
+    author = models.CharField(max_length=100)
+    avatar = models.CharField(max_length=100, blank=True)
+    content = models.TextField(blank=True)
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['channel_id', '-id'], name='archived_msg_channel_idx'),
+        ]
+
+    def __str__(self):
+        return f"Message {self.id} in {self.channel_id}"
+
+class ArchivedRedditPost(models.Model):
+    id = models.CharField(max_length=16, primary_key=True)  # base36, without "t3_"
+    number = models.BigIntegerField(unique=True)  # the id as an integer, for the search index's rowid
+    subreddit = models.CharField(max_length=100)  # lowercased
+    prev_id = models.CharField(max_length=16, null=True)
+    title = models.CharField(max_length=300)
+    author = models.CharField(max_length=100)
+    score = models.IntegerField(default=0)
+    url = models.TextField(blank=True)
+    selftext = models.TextField(blank=True)  # preview, as in listings
+    selftext_truncated = models.BooleanField(default=False)
+    full_selftext = models.TextField(blank=True)  # what search indexes
+    media_type = models.CharField(max_length=10)
+    media_url = models.TextField(blank=True)
+    permalink = models.CharField(max_length=300, blank=True)
+    num_comments = models.IntegerField(default=0)
+    created_utc = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['subreddit', '-created_utc'], name='archived_post_subreddit_idx'),
+        ]
+
+    def __str__(self):
+        return f"Post {self.id} in r/{self.subreddit}"
@@ -0,0 +1,161 @@
+"""
+Background refresh of the sources users are reading.
+
+Views read the channel and subreddit caches through ``prefetcher``, which
+records every key that is requested along with how to refresh it. While the
+prefetcher's thread runs (it is started with the scheduler, see apps.py) it
+refreshes each recently requested key shortly before it expires, so polling
+users are served from the cache instead of waiting on Discord or Reddit.
+
+A request that finds its entry expired gets the stale value straight away,
+up to one TTL past expiry, and the refresh runs in the background
+(stale-while-revalidate). Keys nobody has asked for in ``idle_timeout``
+seconds, or whose refresh fails, are dropped. At most ``max_sources`` keys
+are kept warm; the least recently requested key is dropped first.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .metrics import PREFETCH_SOURCES
+
+logger = logging.getLogger(__name__)
+
+
+class _Tracked:
+    def __init__(self, refresh, requested_at):
+        self.refresh = refresh
+        self.requested_at = requested_at
+
+
+class Prefetcher:
+    def __init__(self, max_sources=256, idle_timeout=300, refresh_ahead=0.8, interval=1, max_workers=8,
+                 clock=time.monotonic):
+        self.max_sources = max_sources
+        self.idle_timeout = idle_timeout
+        self.refresh_ahead = refresh_ahead
+        self.interval = interval
+        self.max_workers = max_workers
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tracked = OrderedDict()  # (cache, key) -> _Tracked, least recently requested first
+        self._refreshing = set()  # (cache, key) with a refresh queued or running
+        self._executor = None
+        self._thread = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='prefetch')
+            self._thread = threading.Thread(target=self.run, name='prefetcher', daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        was_running = self._thread is not None
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._thread = None
+        if was_running:
+            self.start()
+
+    def run(self):
+        while True:
+            self.run_pending()
+            time.sleep(self.interval)
+
+    def get(self, cache, key, refresh):
+        """``cache.get_or_refresh(key, refresh)``, keeping ``key`` warm from now on."""
+        value = self.cached(cache, key, refresh)
+        if value is None:
+            value = cache.get_or_refresh(key, refresh)
+        return value
+
+    def cached(self, cache, key, refresh):
+        """
+        Track ``key`` and return its cached value if it can be served, or
+        None if the caller has to fetch it. ``refresh`` is a sync
+        ``refresh(stale)`` callable as for ``cache.get_or_refresh``.
+        """
+        self._track(cache, key, refresh)
+        value, age = cache.peek(key)
+        if value is None:
+            return None  # counted as a miss by the caller's fetch
+        if age < cache.ttl:
+            cache.count('hit')
+            return value
+        if self.running and age < 2 * cache.ttl:
+            self._refresh_later(cache, key, refresh)
+            cache.count('stale')
+            return value
+        return None
+
+    def run_pending(self):
+        """Drop idle keys and refresh the ones about to expire."""
+        now = self._clock()
+        due = []
+        with self._lock:
+            for tracked_key, tracked in list(self._tracked.items()):
+                if now - tracked.requested_at < self.idle_timeout:
+                    break  # ordered by request time, the rest are more recent
+                del self._tracked[tracked_key]
+            for (cache, key), tracked in self._tracked.items():
+                _, age = cache.peek(key)
+                # Keys with nothing cached are fetched by the next request.
+                if age is not None and age >= cache.ttl * self.refresh_ahead:
+                    due.append((cache, key, tracked.refresh))
+        for cache, key, refresh in due:
+            self._refresh_later(cache, key, refresh)
+
+    def __len__(self):
+        return len(self._tracked)
+
+    def _track(self, cache, key, refresh):
+        with self._lock:
+            self._tracked[cache, key] = _Tracked(refresh, self._clock())
+            self._tracked.move_to_end((cache, key))
+            while len(self._tracked) > self.max_sources:
+                self._tracked.popitem(last=False)
+
+    def _refresh_later(self, cache, key, refresh):
+        with self._lock:
+            if (cache, key) in self._refreshing or self._executor is None:
+                return
+            self._refreshing.add((cache, key))
+        self._executor.submit(self._refresh, cache, key, refresh)
+
+    def _refresh(self, cache, key, refresh):
+        try:
+            value = cache.refresh(key, refresh)
+        except Exception as e:
+            # Keys are (source, credentials); only the source may be logged.
+            source = key[0] if isinstance(key, tuple) else key
+            logger.warning("Error prefetching %s from %s: %s", source, cache.name, e,
+                           extra={'cache': cache.name, 'source': source})
+            value = None
+        with self._lock:
+            self._refreshing.discard((cache, key))
+            if value is None:
+                # Don't retry a failing source every interval; the next
+                # request for it tracks it again.
+                self._tracked.pop((cache, key), None)
+
+
+prefetcher = Prefetcher(
+    max_sources=getattr(settings, 'PREFETCH_MAX_SOURCES', 256),
+    idle_timeout=getattr(settings, 'PREFETCH_IDLE_TIMEOUT', 300),
+    refresh_ahead=getattr(settings, 'PREFETCH_REFRESH_AHEAD', 0.8),
+    max_workers=getattr(settings, 'PREFETCH_WORKERS', 8),
+)
+
+PREFETCH_SOURCES.set_function(lambda: {(): len(prefetcher)})
@@ -0,0 +1,72 @@
+"""
+Cached access to users' API credentials.
+
+Every JSON endpoint needs the caller's UserProfile, and dashboards poll them
+every few seconds, so profiles are kept in an in-process LRU and, when
+PROFILE_CACHE_ALIAS names a Django cache (e.g. Redis or memcached), in that
+shared cache too. Saving or deleting a profile invalidates both. Other
+processes' in-process copies expire after PROFILE_CACHE_TTL seconds.
+
+Cached profiles are shared between threads: treat them as read-only and load
+the profile from the database when editing it.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache import TTLCache
+from .models import UserProfile
+
+# Cached for users without a profile, so they don't query every poll either.
+_MISSING = 'missing'
+
+_local = TTLCache(
+    ttl=getattr(settings, 'PROFILE_CACHE_TTL', 60),
+    max_entries=getattr(settings, 'PROFILE_CACHE_SIZE', 4096),
+)
+
+
+def _shared_cache():
+    alias = getattr(settings, 'PROFILE_CACHE_ALIAS', None)
+    return caches[alias] if alias else None
+
+
+def _shared_key(user_id):
+    return f'dashboard:profile:{user_id}'
+
+
+def _load(user_id):
+    shared = _shared_cache()
+    if shared is not None:
+        profile = shared.get(_shared_key(user_id))
+        if profile is not None:
+            return profile
+    profile = UserProfile.objects.filter(user_id=user_id).first() or _MISSING
+    if shared is not None:
+        shared.set(_shared_key(user_id), profile, getattr(settings, 'PROFILE_SHARED_CACHE_TTL', 3600))
+    return profile
+
+
+def get_profile(user):
+    """Return ``user``'s profile or raise ``UserProfile.DoesNotExist``."""
+    profile = _local.get_or_fetch(user.pk, lambda: _load(user.pk))
+    if profile == _MISSING:
+        raise UserProfile.DoesNotExist(f"{user} has no profile.")
+    return profile
+
+
+async def aget_profile(user):
+    """Async ``get_profile``; only a cache miss goes to a thread."""
+    profile = _local.get(user.pk)
+    if profile is None:
+        return await sync_to_async(get_profile)(user)
+    if profile == _MISSING:
+        raise UserProfile.DoesNotExist(f"{user} has no profile.")
+    return profile
+
+
+def invalidate_profile(user_id):
+    _local.invalidate(user_id)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete(_shared_key(user_id))
@@ -0,0 +1,106 @@
+"""
+Async, app-only client for Reddit's listing API, used by the async views.
+
+PRAW is synchronous, so under ASGI the read-only listing endpoints talk to
+Reddit's OAuth API directly over the shared aiohttp session. Like the PRAW
+clients in reddit_clients.py, access tokens are fetched with the app's
+credentials (``client_credentials`` grant) and shared per app.
+"""
+import asyncio
+import re
+import time
+
+from django.conf import settings
+
+from .async_http import aiohttp, get_session
+from .cache import TTLCache
+from .metrics import UPSTREAM_RETRIES, observe_upstream
+
+# Path segments that name a subreddit, post or user, for low-cardinality
+# endpoint labels: /r/python/hot -> /r/{subreddit}/hot.
+_ENDPOINT_PARAMETERS = [
+    (re.compile(r'^/r/[^/]+'), '/r/{subreddit}'),
+    (re.compile(r'^/by_id/.*'), '/by_id/{ids}'),
+    (re.compile(r'/comments/[^/]+.*'), '/comments/{id}'),
+    (re.compile(r'^/(user|u)/[^/]+'), '/user/{name}'),
+]
+
+
+def endpoint_name(method, path):
+    """``'GET /r/{subreddit}/hot'`` for ``('GET', '/r/python/hot')``."""
+    for pattern, replacement in _ENDPOINT_PARAMETERS:
+        path = pattern.sub(replacement, path)
+    return f'{method.upper()} {path.rstrip("/") or "/"}'
+
+
+class RedditAPIError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncRedditClient:
+    def __init__(self, oauth_base='https://oauth.reddit.com',
+                 token_url='https://www.reddit.com/api/v1/access_token', token_ttl=3000):
+        self.oauth_base = oauth_base.rstrip('/')
+        self.token_url = token_url
+        # Reddit's app-only tokens last an hour; refresh a little early.
+        self._tokens = TTLCache(ttl=token_ttl, max_entries=1024)
+
+    async def get_listing(self, client_id, client_secret, user_agent, path, params):
+        """
+        GET a listing such as ``/r/python/hot`` and return its ``data`` object.
+        Raises RedditAPIError on failure.
+        """
+        params = dict(params, raw_json=1)
+        key = (client_id, client_secret, user_agent)
+        for attempt in range(2):
+            token = await self._tokens.aget_or_refresh(
+                key, lambda stale: self._fetch_token(client_id, client_secret, user_agent)
+            )
+            headers = {'Authorization': f'bearer {token}', 'User-Agent': user_agent}
+            start = time.perf_counter()
+            status = 'error'
+            try:
+                async with get_session().get(self.oauth_base + path, params=params, headers=headers) as response:
+                    status = response.status
+                    if response.status == 401 and attempt == 0:
+                        self._tokens.invalidate(key)  # revoked or expired early
+                        UPSTREAM_RETRIES.inc(service='reddit')
+                        continue
+                    if response.status != 200:
+                        raise RedditAPIError(f"Reddit returned {response.status}", response.status)
+                    body = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                raise RedditAPIError(str(e)) from e
+            finally:
+                observe_upstream('reddit', endpoint_name('GET', path), status, time.perf_counter() - start)
+            return body['data']
+
+    async def _fetch_token(self, client_id, client_secret, user_agent):
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            async with get_session().post(
+                self.token_url,
+                data={'grant_type': 'client_credentials'},
+                auth=aiohttp.BasicAuth(client_id, client_secret),
+                headers={'User-Agent': user_agent},
+            ) as response:
+                status = response.status
+                if response.status != 200:
+                    raise RedditAPIError(f"Reddit token request returned {response.status}", response.status)
+                body = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise RedditAPIError(str(e)) from e
+        finally:
+            observe_upstream('reddit', 'POST /api/v1/access_token', status, time.perf_counter() - start)
+        if 'access_token' not in body:
+            raise RedditAPIError(body.get('error', 'No access token in response'))
+        return body['access_token']
+
+
+async_reddit_client = AsyncRedditClient(
+    oauth_base=getattr(settings, 'REDDIT_OAUTH_BASE', 'https://oauth.reddit.com'),
+    token_url=getattr(settings, 'REDDIT_TOKEN_URL', 'https://www.reddit.com/api/v1/access_token'),
+)
@@ -0,0 +1,105 @@
+"""
+Process-wide registry of PRAW clients.
+
+A ``praw.Reddit`` instance keeps its OAuth token until it expires and its
+``requests`` session keeps connections to Reddit alive, so building one per
+request throws both away. Clients are shared per set of app credentials and
+evicted (and their sessions closed) once idle or least recently used.
+"""
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import praw
+import prawcore
+from django.conf import settings
+
+from .metrics import observe_upstream
+from .reddit_api import endpoint_name
+
+
+class InstrumentedRequestor(prawcore.Requestor):
+    """prawcore's HTTP layer, timing each call into UPSTREAM_LATENCY."""
+
+    def request(self, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            response = super().request(method, url, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            observe_upstream(
+                'reddit', endpoint_name(method, urlsplit(url).path), status, time.perf_counter() - start
+            )
+
+
+def new_reddit(**credentials):
+    return praw.Reddit(requestor_class=InstrumentedRequestor, **credentials)
+
+
+class RedditClientPool:
+    def __init__(self, max_clients=64, idle_timeout=900, factory=new_reddit, clock=time.monotonic):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self._factory = factory
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()  # (client_id, secret, user_agent) -> [client, last_used]
+
+    def get(self, client_id, client_secret, user_agent):
+        key = (client_id, client_secret, user_agent)
+        now = self._clock()
+        evicted = []
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is None:
+                entry = self._clients[key] = [
+                    self._factory(client_id=client_id, client_secret=client_secret, user_agent=user_agent),
+                    now,
+                ]
+            entry[1] = now
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_clients:
+                evicted.append(self._clients.popitem(last=False)[1][0])
+            for other, (client, last_used) in list(self._clients.items()):
+                if now - last_used < self.idle_timeout:
+                    break  # ordered by last use, the rest are more recent
+                evicted.append(client)
+                del self._clients[other]
+        for client in evicted:
+            _close(client)
+        return entry[0]
+
+    def clear(self):
+        with self._lock:
+            clients = [client for client, _ in self._clients.values()]
+            self._clients.clear()
+        for client in clients:
+            _close(client)
+
+    def __len__(self):
+        return len(self._clients)
+
+
+def _close(client):
+    # All of a client's prawcore sessions share one requestor/HTTP session.
+    core = getattr(client, '_core', None)
+    if core is not None:
+        core.close()
+
+
+reddit_clients = RedditClientPool(
+    max_clients=getattr(settings, 'REDDIT_CLIENT_POOL_SIZE', 64),
+    idle_timeout=getattr(settings, 'REDDIT_CLIENT_IDLE_TIMEOUT', 900),
+)
+
+
+def get_reddit(profile):
+    """Return the shared PRAW client for a profile's Reddit app credentials."""
+    return reddit_clients.get(
+        profile.reddit_client_id,
+        profile.reddit_client_secret,
+        profile.reddit_user_agent,
+    )
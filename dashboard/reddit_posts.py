@@ -0,0 +1,79 @@
+"""
+Compact records for Reddit posts, built from raw listing JSON.
+
+Listings are read as plain JSON (``Reddit.request`` for PRAW, or the async
+client) instead of as PRAW ``Submission`` objects, whose attribute access
+can trigger a lazy fetch of the whole submission for any field the listing
+left out. Each post keeps only the fields the dashboard shows, with its
+media classified once when the page is fetched; ``as_dict`` points its URL
+at the media proxy. Long self posts are cut to REDDIT_SELFTEXT_PREVIEW
+characters; the full text is fetched on demand.
+"""
+from django.conf import settings
+
+from .media_proxy import proxy_url
+
+SELFTEXT_PREVIEW = getattr(settings, 'REDDIT_SELFTEXT_PREVIEW', 500)
+# Images are shown at most this wide (the dashboard's post column).
+IMAGE_SIZE = 640
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+
+
+class RedditPost:
+    __slots__ = (
+        'id', 'name', 'title', 'author', 'score', 'url', 'selftext', 'selftext_truncated',
+        'media_type', 'media_url', 'permalink', 'num_comments', 'created_utc',
+    )
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields[field])
+
+    @classmethod
+    def from_json(cls, data):
+        """Build a post from the ``data`` of a ``t3`` listing child."""
+        media_type, media_url = classify_media(data)
+        selftext = data.get('selftext') or ''
+        return cls(
+            id=data['id'],
+            name=data['name'],
+            title=data['title'],
+            author=data.get('author') or '[deleted]',
+            score=data.get('score', 0),
+            url=data.get('url', ''),
+            selftext=selftext[:SELFTEXT_PREVIEW],
+            selftext_truncated=len(selftext) > SELFTEXT_PREVIEW,
+            media_type=media_type,
+            media_url=media_url,
+            permalink=data.get('permalink', ''),
+            num_comments=data.get('num_comments', 0),
+            created_utc=data.get('created_utc', 0),
+        )
+
+    def as_dict(self):
+        fields = {field: getattr(self, field) for field in self.__slots__}
+        fields['media_url'] = proxy_url(self.media_url, IMAGE_SIZE if self.media_type == "image" else None)
+        return fields
+
+
+def classify_media(data):
+    """Return ``(media_type, media_url)`` for a post's raw data."""
+    media = data.get('media') or {}
+    preview = data.get('preview') or {}
+    url = data.get('url', '')
+    # --- Reddit-hosted video
+    if 'reddit_video' in media:
+        return "video", media['reddit_video']['fallback_url']
+    # --- Preview image
+    if preview.get('images'):
+        return "image", preview['images'][0]['source']['url'].replace("&amp;", "&")
+    # --- Direct image link (like imgur or i.redd.it)
+    if url.endswith(IMAGE_EXTENSIONS):
+        return "image", url
+    return "text", ""
+
+
+def posts_from_listing(listing):
+    """RedditPost records for the posts in a listing's ``data``."""
+    return [RedditPost.from_json(child['data']) for child in listing['children'] if child.get('kind') == 't3']
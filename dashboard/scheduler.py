@@ -0,0 +1,539 @@
+"""
+Timer-driven dispatch of scheduled Reddit posts and Discord messages.
+
+The engine keeps a heap of upcoming (scheduled_time, kind, pk) entries and
+sleeps until the earliest one is due, so items go out on time without the
+database being polled. The schedule views call ``notify()`` when they create
+an item. The table is also re-read every ``resync_interval`` seconds to pick
+up rows created elsewhere, such as the admin.
+
+Due items are sent from a bounded thread pool. Items are queued on lanes by
+``job.lane()`` (the account for Reddit, the channel for Discord), and each
+lane is drained by at most ``concurrency_per_lane`` threads sending one item
+at a time, so a burst from many users drains in parallel without any single
+account exceeding its Reddit/Discord rate limits. The engine doesn't wait
+for the lanes: they report each item as it is sent, and the engine thread
+(the only one that writes to the tables) marks it done right away, so a
+slow lane holds up neither other due items nor the record of what was sent.
+
+Failed items are retried with exponential backoff, starting at the job's
+``retry_delay``, until ``max_attempts`` is reached and the item is marked
+failed. For ``ordered`` jobs (Discord, which doubles as the outbox for
+messages sent from the dashboard) nothing in a lane is sent past an earlier
+item that is waiting for a retry, so a channel's messages arrive in order.
+
+Every web process runs its own engine, so items are claimed before being
+sent: a single conditional UPDATE stamps unclaimed (or lease-expired) rows
+with this batch's ``claim_token`` and a ``claimed_until`` lease, and only the
+rows that carry the token afterwards are sent. Any number of processes or
+hosts can share the tables without sending an item twice. Each item is
+marked done under its token as soon as it is sent, and leases are renewed
+while a lane is still draining. If a process dies, its leases run out and
+another process picks up the rows it hadn't sent.
+"""
+import heapq
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .discord_api import discord_client
+from .metrics import SCHEDULER_LAG, SCHEDULER_QUEUE_DEPTH, SCHEDULER_SENDS
+from .models import DiscordMessageSchedule, MediaFile, RedditPostSchedule, UserProfile
+from .reddit_clients import get_reddit
+
+logger = logging.getLogger(__name__)
+
+
+# How long the engine waits before trying again after an unexpected error.
+ERROR_DELAY = 5
+
+
+class PermanentFailure(Exception):
+    """Raised by a job's ``send`` or ``lane`` for errors that retrying won't fix."""
+
+
+def _profile(item):
+    try:
+        return item.user.userprofile
+    except UserProfile.DoesNotExist:
+        raise PermanentFailure("User has no profile") from None
+
+
+def _pending(job):
+    """The job's items that are neither done nor given up on."""
+    return job.model.objects.filter(**{job.done_field: False}, failed=False)
+
+
+class RedditPostJob:
+    kind = 'reddit'
+    model = RedditPostSchedule
+    done_field = 'posted'
+    ordered = False
+    retry_delay = None  # the engine's
+    max_attempts = getattr(settings, 'SCHEDULER_MAX_ATTEMPTS', 10)
+    # Reddit throttles submissions per account ("you're doing that too much").
+    concurrency_per_lane = getattr(settings, 'SCHEDULER_REDDIT_CONCURRENCY_PER_ACCOUNT', 1)
+
+    def lane(self, post):
+        return post.user_id
+
+    def send(self, post):
+        profile = _profile(post)
+        subreddit = get_reddit(profile).subreddit(profile.reddit_subreddit)
+        media = post.media
+        if media is not None and media.kind == MediaFile.VIDEO:
+            subreddit.submit_video(
+                title=post.title, video_path=media.file.path, without_websockets=True,
+                thumbnail_path=media.thumbnail.path if media.thumbnail else None,
+            )
+        elif media is not None:
+            subreddit.submit_image(title=post.title, image_path=media.file.path, without_websockets=True)
+        elif post.url:
+            subreddit.submit(title=post.title, url=post.url)
+        else:
+            subreddit.submit(title=post.title, selftext=post.content)
+
+
+class DiscordMessageJob:
+    kind = 'discord'
+    model = DiscordMessageSchedule
+    done_field = 'sent'
+    ordered = True
+    # Messages sent from the dashboard are waiting on this, so retry quickly.
+    retry_delay = getattr(settings, 'DISCORD_OUTBOX_RETRY_DELAY', 5)
+    max_attempts = getattr(settings, 'DISCORD_OUTBOX_MAX_ATTEMPTS', 8)
+    # One sender per channel keeps its messages in order; discord_client
+    # waits for the channel's rate-limit bucket as needed.
+    concurrency_per_lane = 1
+
+    def lane(self, msg):
+        profile = _profile(msg)
+        return (profile.discord_bot_token, msg.channel_id or profile.discord_channel_id)
+
+    def send(self, msg):
+        from .views import discord_message_cache
+        token, channel_id = self.lane(msg)
+        attachment = None
+        if msg.media is not None:
+            attachment = (os.path.basename(msg.media.file.name), msg.media.file.path, msg.media.content_type)
+        response = discord_client.create_message(token, channel_id, msg.message, attachment)
+        if response.status_code not in [200, 201, 204]:
+            error = f"Discord returned {response.status_code}"
+            # 429s are retried by discord_client; other 4xx won't go away.
+            if 400 <= response.status_code < 500:
+                raise PermanentFailure(error)
+            raise RuntimeError(error)
+        # Let the channel's next poll pick up the message.
+        discord_message_cache.expire((channel_id, token))
+
+
+class _Lane:
+    """Items queued to be sent in order on one lane, and how many threads are sending them."""
+    __slots__ = ('items', 'senders', 'failed')
+
+    def __init__(self):
+        self.items = deque()
+        self.senders = 0
+        self.failed = False  # an ordered send failed and isn't recorded yet
+
+
+class ScheduleEngine:
+    def __init__(self, jobs, resync_interval=300, retry_delay=60, max_retry_delay=3600, batch_size=1000,
+                 max_workers=16, lease_seconds=600):
+        self.jobs = {job.kind: job for job in jobs}
+        self.resync_interval = resync_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lease_seconds = lease_seconds
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='schedule-dispatch')
+        self._cond = threading.Condition()
+        self._heap = []  # (scheduled_time, kind, pk)
+        self._queued = {}  # (kind, pk) -> when it is due; the heap may hold stale later entries
+        self._next_resync = None
+        self._lanes = {}  # (kind, lane) -> _Lane being sent from this process
+        self._in_flight = {}  # (kind, pk) -> item queued or being sent; engine thread only
+        self._results = []  # (job, key, lane, item, error, sent_at) reported by the lanes
+        self._thread = None
+        # Threads don't survive fork (e.g. gunicorn --preload); restart in the child.
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name='schedule-engine', daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        was_running = self._thread is not None
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='schedule-dispatch')
+        self._cond = threading.Condition()
+        # The parent's lanes stay leased to it.
+        self._lanes, self._in_flight, self._results = {}, {}, []
+        self._thread = None
+        if was_running:
+            self.start()
+
+    def notify(self, kind, pk, scheduled_time):
+        """Add a newly created item and wake the engine if it is due sooner."""
+        with self._cond:
+            self._push(scheduled_time, kind, pk)
+            self._cond.notify()
+
+    def resync(self):
+        """Re-read the schedule tables now, e.g. after a bulk import."""
+        with self._cond:
+            self._next_resync = timezone.now()
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            try:
+                self.run_pending()
+            except Exception:
+                # e.g. the database being unavailable; the next resync picks
+                # up anything that was due.
+                logger.exception("Error dispatching scheduled items")
+                with self._cond:
+                    self._next_resync = timezone.now() + timedelta(seconds=ERROR_DELAY)
+                    self._cond.wait(ERROR_DELAY)
+                continue
+            with self._cond:
+                timeout = self._seconds_until_wake()
+                if timeout > 0:
+                    self._cond.wait(timeout)
+
+    def run_pending(self):
+        """
+        Record what the lanes have sent and dispatch everything that is due;
+        return seconds until the next wake-up.
+        """
+        close_old_connections()
+        self._record_results()
+        self._renew_leases()
+        now = timezone.now()
+        if self._next_resync is None or now >= self._next_resync:
+            for job in self.jobs.values():
+                self._load(job)
+            self._next_resync = now + timedelta(seconds=self.resync_interval)
+
+        due = {}
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                scheduled_time, kind, pk = heapq.heappop(self._heap)
+                if self._queued.get((kind, pk)) != scheduled_time:
+                    continue  # superseded by an earlier entry
+                del self._queued[kind, pk]
+                due.setdefault(kind, []).append(pk)
+        for kind, pks in due.items():
+            job = self.jobs[kind]
+            self.dispatch(job, pks)
+            with self._cond:
+                exhausted = not any(k == kind for k, _ in self._queued)
+            if exhausted:
+                # The last load may have been cut off at batch_size.
+                self._load(job)
+        close_old_connections()
+
+        with self._cond:
+            return self._seconds_until_wake()
+
+    def dispatch(self, job, pks):
+        """
+        Claim the pending items among ``pks`` and queue them on their lanes'
+        senders. Returns without waiting for them to be sent; ``run_pending``
+        records the results as they come in.
+        """
+        items = self.claim(job, pks)
+        lanes = {}
+        for item in items:
+            try:
+                lanes[item.pk] = job.lane(item)
+            except Exception as e:
+                self._fail(job, item, e if isinstance(e, PermanentFailure) else PermanentFailure(e))
+        items = [item for item in items if item.pk in lanes]
+        if job.ordered and items:
+            items = self._hold_back(job, items, lanes)
+        starts = []
+        with self._cond:
+            for item in items:
+                key = (job.kind, lanes[item.pk])
+                lane = self._lanes.get(key)
+                if lane is None:
+                    lane = self._lanes[key] = _Lane()
+                lane.items.append(item)
+                self._in_flight[job.kind, item.pk] = item
+                # A lane whose ordered send failed starts again once the
+                # failure is recorded; until then new items wait in it.
+                if not lane.failed and lane.senders < min(job.concurrency_per_lane, len(lane.items)):
+                    lane.senders += 1
+                    starts.append((key, lane))
+        for key, lane in starts:
+            self._executor.submit(self._send_lane, job, key, lane)
+
+    def claim(self, job, pks):
+        """Lease the pending items among ``pks`` to this process and return them."""
+        now = timezone.now()
+        token = uuid.uuid4().hex
+        pending = _pending(job).filter(pk__in=pks)
+        # Items already queued here keep their lease (and claim_token).
+        in_flight = [pk for kind, pk in self._in_flight if kind == job.kind]
+        pending.filter(Q(claimed_until__isnull=True) | Q(claimed_until__lte=now)).exclude(pk__in=in_flight).update(
+            claim_token=token, claimed_until=now + timedelta(seconds=self.lease_seconds)
+        )
+        # Users, profiles and media are joined in so senders never query per item.
+        items = list(
+            pending.filter(claim_token=token)
+            .select_related('user__userprofile', 'media')
+            .order_by('scheduled_time', 'pk')
+        )
+        # Come back to items leased elsewhere in case that process dies.
+        claimed = {item.pk for item in items}
+        with self._cond:
+            for claimed_until, pk in pending.exclude(pk__in=claimed).values_list('claimed_until', 'pk'):
+                self._push(claimed_until or now, job.kind, pk)
+        return items
+
+    def _hold_back(self, job, items, lanes):
+        """
+        Return the claimed ``items`` that may be sent now. Items queued behind
+        an earlier item of their lane that is waiting for a retry (or being
+        sent by another process) are deferred until that item's lease ends.
+        Items queued in this process's lanes don't block; the lanes' senders
+        keep them in order.
+        """
+        blockers = {}
+        for item in self._blocked(job, items[0].claim_token):
+            if (job.kind, item.pk) in self._in_flight:
+                continue
+            try:
+                blockers.setdefault(job.lane(item), item)
+            except PermanentFailure:
+                pass  # failed by whichever process holds it
+        if not blockers:
+            return items
+        ready, held = [], {}
+        for item in items:
+            blocker = blockers.get(lanes[item.pk])
+            if blocker is not None and (item.scheduled_time, item.pk) > (blocker.scheduled_time, blocker.pk):
+                held.setdefault(blocker.claimed_until, []).append(item)
+            else:
+                ready.append(item)
+        for claimed_until, lane_items in held.items():
+            self._defer(job, lane_items, claimed_until)
+        return ready
+
+    def _blocked(self, job, token):
+        """Pending items leased under a token other than ``token``, oldest first."""
+        return (
+            _pending(job).filter(claimed_until__gt=timezone.now()).exclude(claim_token=token)
+            .select_related('user__userprofile').order_by('scheduled_time', 'pk')
+        )
+
+    def _send_lane(self, job, key, lane):
+        """
+        Send ``lane``'s items one at a time until it is empty, reporting each
+        result to the engine. An ordered lane stops at its first failure.
+        Runs on the pool; only the engine thread touches the database.
+        """
+        try:
+            while True:
+                with self._cond:
+                    if lane.failed or not lane.items:
+                        return
+                    item = lane.items.popleft()
+                error = None
+                try:
+                    job.send(item)
+                except Exception as e:
+                    logger.warning("Error sending scheduled %s item %s: %s", job.kind, item.pk, e, extra={
+                        'kind': job.kind, 'item': item.pk, 'attempt': item.attempts + 1,
+                    })
+                    error = e
+                with self._cond:
+                    self._results.append((job, key, lane, item, error, timezone.now()))
+                    if error is not None and job.ordered:
+                        lane.failed = True
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                lane.senders -= 1
+                if not lane.senders and not lane.failed and self._lanes.get(key) is lane:
+                    del self._lanes[key]
+                self._cond.notify_all()
+
+    def drain(self, timeout=None):
+        """
+        Wait for this process's lanes to finish and record their results;
+        return seconds until the next wake-up. For tests and benchmarks.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: not any(lane.senders for lane in self._lanes.values()), timeout)
+        self._record_results()
+        with self._cond:
+            return self._seconds_until_wake()
+
+    def _record_results(self):
+        """Mark items done, or failed for a retry, as their lanes report them."""
+        with self._cond:
+            results, self._results = self._results, []
+        if not results:
+            return
+        sent = {}
+        for job, key, lane, item, error, sent_at in results:
+            if error is None:
+                sent.setdefault((job, item.claim_token), []).append(item.pk)
+        try:
+            for (job, token), pks in sent.items():
+                job.model.objects.filter(pk__in=pks, claim_token=token).update(
+                    **{job.done_field: True}, claimed_until=None
+                )
+        except Exception:
+            # Try again rather than let the leases run out on sent items.
+            with self._cond:
+                self._results[:0] = results
+            raise
+        for job, key, lane, item, error, sent_at in results:
+            self._in_flight.pop((job.kind, item.pk), None)
+            if error is None:
+                lag = (sent_at - item.scheduled_time).total_seconds()
+                SCHEDULER_LAG.observe(lag, kind=job.kind)
+                SCHEDULER_SENDS.inc(kind=job.kind, result='sent')
+                logger.info("Sent scheduled %s item %s", job.kind, item.pk, extra={
+                    'kind': job.kind, 'item': item.pk, 'user': item.user_id, 'lag_seconds': round(lag, 3),
+                })
+                continue
+            retry_at = self._fail(job, item, error)
+            if lane.failed:
+                # The rest of an ordered lane goes out after the failed item.
+                with self._cond:
+                    deferred = list(lane.items)
+                    lane.items.clear()
+                    if self._lanes.get(key) is lane:
+                        del self._lanes[key]
+                for other in deferred:
+                    self._in_flight.pop((job.kind, other.pk), None)
+                self._defer(job, deferred, retry_at)
+
+    def _renew_leases(self):
+        """
+        Extend the leases of items still queued or being sent here once half
+        of the lease has gone, so a lane that drains slowly (rate limits,
+        retries) never has its items claimed and sent again by another
+        process. Items whose lease was lost anyway are dropped.
+        """
+        now = timezone.now()
+        expiring = {}
+        for (kind, pk), item in self._in_flight.items():
+            if item.claimed_until <= now + timedelta(seconds=self.lease_seconds / 2):
+                expiring.setdefault((kind, item.claim_token), []).append(item)
+        until = now + timedelta(seconds=self.lease_seconds)
+        for (kind, token), items in expiring.items():
+            job = self.jobs[kind]
+            held = job.model.objects.filter(pk__in=[item.pk for item in items], claim_token=token)
+            lost = set()
+            if held.update(claimed_until=until) < len(items):
+                lost = {item.pk for item in items} - set(held.values_list('pk', flat=True))
+            for item in items:
+                if item.pk not in lost:
+                    item.claimed_until = until
+                    continue
+                logger.warning("Lost the lease on scheduled %s item %s", kind, item.pk, extra={
+                    'kind': kind, 'item': item.pk,
+                })
+                del self._in_flight[kind, item.pk]
+                with self._cond:
+                    for lane in self._lanes.values():
+                        if item in lane.items:
+                            lane.items.remove(item)
+
+    def _fail(self, job, item, error):
+        """Record a failed attempt; return when the item is next due."""
+        now = timezone.now()
+        attempts = item.attempts + 1
+        changes = {'attempts': attempts, 'last_error': str(error)[:500]}
+        if isinstance(error, PermanentFailure) or (job.max_attempts and attempts >= job.max_attempts):
+            retry_at = now
+            changes.update(failed=True, claimed_until=None)
+            SCHEDULER_SENDS.inc(kind=job.kind, result='failed')
+            logger.error("Gave up on scheduled %s item %s after %d attempts", job.kind, item.pk, attempts, extra={
+                'kind': job.kind, 'item': item.pk, 'user': item.user_id, 'error': changes['last_error'],
+            })
+        else:
+            SCHEDULER_SENDS.inc(kind=job.kind, result='retry')
+            delay = (job.retry_delay or self.retry_delay) * 2 ** (attempts - 1)
+            retry_at = now + timedelta(seconds=min(delay, self.max_retry_delay))
+            # Leased until the retry is due, so no process picks it up sooner.
+            changes['claimed_until'] = retry_at
+            self.notify(job.kind, item.pk, retry_at)
+        job.model.objects.filter(pk=item.pk, claim_token=item.claim_token).update(**changes)
+        return retry_at
+
+    def _defer(self, job, items, until):
+        if not items:
+            return
+        # A lane can hold items from several claims.
+        job.model.objects.filter(
+            pk__in=[item.pk for item in items], claim_token__in={item.claim_token for item in items}
+        ).update(claimed_until=until)
+        for item in items:
+            self.notify(job.kind, item.pk, until)
+
+    def _load(self, job):
+        pending = (
+            _pending(job).order_by('scheduled_time')
+            .values_list('scheduled_time', 'claimed_until', 'pk')[:self.batch_size]
+        )
+        with self._cond:
+            for scheduled_time, claimed_until, pk in pending:
+                # Leased items are due again when their lease runs out.
+                self._push(max(scheduled_time, claimed_until or scheduled_time), job.kind, pk)
+
+    def queue_depth(self):
+        """Items due and not yet sent, per kind (read at scrape time)."""
+        now = timezone.now()
+        return {
+            (kind,): _pending(job).filter(scheduled_time__lte=now).count()
+            for kind, job in self.jobs.items()
+        }
+
+    # Callers must hold self._cond.
+    def _seconds_until_wake(self):
+        if self._results:
+            return 0
+        wake_at = self._next_resync
+        if self._heap:
+            wake_at = min(wake_at, self._heap[0][0])
+        if self._in_flight:
+            renew_at = min(item.claimed_until for item in self._in_flight.values())
+            wake_at = min(wake_at, renew_at - timedelta(seconds=self.lease_seconds / 2))
+        return max((wake_at - timezone.now()).total_seconds(), 0)
+
+    def _push(self, scheduled_time, kind, pk):
+        queued = self._queued.get((kind, pk))
+        if queued is None or scheduled_time < queued:
+            self._queued[kind, pk] = scheduled_time
+            heapq.heappush(self._heap, (scheduled_time, kind, pk))
+
+
+schedule_engine = ScheduleEngine(
+    [RedditPostJob(), DiscordMessageJob()],
+    resync_interval=getattr(settings, 'SCHEDULER_RESYNC_INTERVAL', 300),
+    retry_delay=getattr(settings, 'SCHEDULER_RETRY_DELAY', 60),
+    max_retry_delay=getattr(settings, 'SCHEDULER_MAX_RETRY_DELAY', 3600),
+    max_workers=getattr(settings, 'SCHEDULER_MAX_WORKERS', 16),
+    lease_seconds=getattr(settings, 'SCHEDULER_LEASE_SECONDS', 600),
+)
+
+SCHEDULER_QUEUE_DEPTH.set_function(schedule_engine.queue_depth)
@@ -0,0 +1,117 @@
+"""
+Full-text search over the local archive of Discord messages and Reddit posts
+(see archive.py).
+
+On SQLite the archive tables have FTS5 indexes (migrations 0010 and 0015)
+that triggers update on every insert, update and delete, so whatever the
+archive writer stores is searchable as soon as its batch commits, and
+nothing is indexed on the request path. Self posts are indexed in full, not
+as the preview listings show. Matches are ranked with bm25, titles counting
+for more than self text. Without FTS5 (another database, or an SQLite built
+without it) search falls back to case-insensitive substring matching,
+newest first.
+"""
+import functools
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+
+from .models import ArchivedDiscordMessage, ArchivedRedditPost, Source
+
+DISCORD_INDEX = f'{ArchivedDiscordMessage._meta.db_table}_fts'
+REDDIT_INDEX = f'{ArchivedRedditPost._meta.db_table}_fts'
+
+# Longer queries only make the index do more work, as do short prefixes,
+# which match too many words to rank quickly.
+MAX_TERMS = 8
+MIN_PREFIX = 3
+
+_TERM = re.compile(r'\w+')
+
+
+def terms(text):
+    return _TERM.findall(text)[:MAX_TERMS]
+
+
+def match_expression(terms):
+    """
+    An FTS5 query matching items that contain every one of ``terms``, the
+    last as a prefix if it is long enough, so results show up while a word
+    is being typed. Terms are quoted so that nothing the user types is read
+    as FTS5 syntax.
+    """
+    quoted = [f'"{term}"' for term in terms]
+    if len(terms[-1]) >= MIN_PREFIX:
+        quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+@functools.lru_cache(maxsize=None)
+def _has_index(alias):
+    with connections[alias].cursor() as cursor:
+        return DISCORD_INDEX in connections[alias].introspection.table_names(cursor)
+
+
+def search(sources, text, offset=0, limit=20):
+    """
+    Archived items in ``sources`` (``(kind, name)`` pairs) that match
+    ``text``, best match first: up to ``limit`` ``(kind, row)`` pairs after
+    the first ``offset``, and whether there are more.
+    """
+    words = terms(text)
+    channels = [name for kind, name in sources if kind == Source.DISCORD]
+    subreddits = [name for kind, name in sources if kind == Source.REDDIT]
+    if not words or not (channels or subreddits):
+        return [], False
+    if connection.vendor == 'sqlite' and _has_index(connection.alias):
+        hits = _ranked(match_expression(words), channels, subreddits, offset, limit + 1)
+    else:
+        hits = _substring(words, channels, subreddits, offset, limit + 1)
+    return hits[:limit], len(hits) > limit
+
+
+def _ranked(expression, channels, subreddits, offset, limit):
+    selects, params = [], []
+    if channels:
+        selects.append(
+            f"SELECT 'discord', m.id, bm25({DISCORD_INDEX}) AS rank FROM {DISCORD_INDEX}"
+            f" JOIN {ArchivedDiscordMessage._meta.db_table} m ON m.id = {DISCORD_INDEX}.rowid"
+            f" WHERE {DISCORD_INDEX} MATCH %s AND m.channel_id IN ({', '.join(['%s'] * len(channels))})"
+        )
+        params += [expression, *channels]
+    if subreddits:
+        selects.append(
+            f"SELECT 'reddit', p.id, bm25({REDDIT_INDEX}, 2.0, 1.0) AS rank FROM {REDDIT_INDEX}"
+            f" JOIN {ArchivedRedditPost._meta.db_table} p ON p.number = {REDDIT_INDEX}.rowid"
+            f" WHERE {REDDIT_INDEX} MATCH %s AND p.subreddit IN ({', '.join(['%s'] * len(subreddits))})"
+        )
+        params += [expression, *subreddits]
+    with connection.cursor() as cursor:
+        cursor.execute(' UNION ALL '.join(selects) + ' ORDER BY rank LIMIT %s OFFSET %s', [*params, limit, offset])
+        hits = cursor.fetchall()
+    rows = {
+        'discord': ArchivedDiscordMessage.objects.in_bulk([pk for kind, pk, _ in hits if kind == 'discord']),
+        'reddit': ArchivedRedditPost.objects.in_bulk([pk for kind, pk, _ in hits if kind == 'reddit']),
+    }
+    # A row deleted since the query ran is just left out.
+    return [(kind, rows[kind][pk]) for kind, pk, _ in hits if pk in rows[kind]]
+
+
+def _substring(words, channels, subreddits, offset, limit):
+    # Each kind's newest offset + limit matches, merged by time.
+    hits = []
+    if channels:
+        match = Q()
+        for word in words:
+            match &= Q(content__icontains=word)
+        messages = ArchivedDiscordMessage.objects.filter(match, channel_id__in=channels).order_by('-id')
+        hits += [(msg.timestamp.timestamp(), 'discord', msg) for msg in messages[:offset + limit]]
+    if subreddits:
+        match = Q()
+        for word in words:
+            match &= Q(title__icontains=word) | Q(full_selftext__icontains=word)
+        posts = ArchivedRedditPost.objects.filter(match, subreddit__in=subreddits).order_by('-created_utc')
+        hits += [(post.created_utc, 'reddit', post) for post in posts[:offset + limit]]
+    hits.sort(key=lambda hit: hit[0], reverse=True)
+    return [(kind, row) for _, kind, row in hits[offset:offset + limit]]
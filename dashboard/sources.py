@@ -0,0 +1,71 @@
+"""
+Users' subscriptions to Discord channels and subreddits.
+
+Subscriptions point at shared Source rows, one per distinct channel or
+subreddit. The response caches in views.py are keyed by source (and, for
+Discord, the bot reading it), and the prefetcher refreshes each cached key
+once however many users request it, so users subscribed to the same source
+share one upstream call per refresh.
+
+Each user's list of sources is cached in-process like their profile (see
+profiles.py) and invalidated when their subscriptions change.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from .cache import TTLCache
+from .models import Source, Subscription
+
+_local = TTLCache(
+    ttl=getattr(settings, 'PROFILE_CACHE_TTL', 60),
+    max_entries=getattr(settings, 'PROFILE_CACHE_SIZE', 4096),
+)
+
+
+def normalize(kind, name):
+    name = name.strip()
+    if kind == Source.REDDIT:
+        name = name.lower()
+        if name.startswith('/'):
+            name = name[1:]
+        if name.startswith('r/'):
+            name = name[2:]
+    return name
+
+
+def subscribe(user_id, kind, name):
+    source, _ = Source.objects.get_or_create(kind=kind, name=normalize(kind, name))
+    Subscription.objects.get_or_create(user_id=user_id, source=source)
+    invalidate_sources(user_id)
+
+
+def set_subscriptions(user_id, kind, names):
+    """Replace the user's subscriptions of ``kind`` with ``names``."""
+    names = {normalize(kind, name) for name in names if name.strip()}
+    with transaction.atomic():
+        Subscription.objects.filter(user_id=user_id, source__kind=kind).exclude(source__name__in=names).delete()
+        for name in names:
+            subscribe(user_id, kind, name)
+    invalidate_sources(user_id)
+
+
+def get_sources(user_id):
+    """The user's subscriptions as ``(kind, name)`` pairs, oldest first."""
+    return _local.get_or_fetch(user_id, lambda: list(
+        Subscription.objects.filter(user_id=user_id)
+        .order_by('created_at', 'pk')
+        .values_list('source__kind', 'source__name')
+    ))
+
+
+async def aget_sources(user_id):
+    sources = _local.get(user_id)
+    if sources is None:
+        return await sync_to_async(get_sources)(user_id)
+    return sources
+
+
+def invalidate_sources(user_id):
+    _local.invalidate(user_id)
+
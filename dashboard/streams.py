@@ -0,0 +1,214 @@
+"""
+Push delivery of Discord channel messages over Server-Sent Events.
+
+Each channel being watched by at least one browser gets exactly one upstream
+watcher per process, whatever the number of subscribers. Watchers read from a
+message source:
+
+* ``GatewaySource`` -- a discord.py gateway connection per bot token (needs
+  discord.py and the bot's Message Content intent).
+* ``PollingSource`` -- polling of the shared message cache, which asks the
+  REST API for newer messages at most once per cache TTL.
+* ``LocalSource`` -- an in-process stand-in, fed with ``publish()``, used by
+  the tests and for offline development.
+
+All of this runs on the ASGI event loop; see ``social_dashboard/asgi.py``.
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+
+try:
+    import discord
+except ImportError:  # discord.py is optional unless the gateway source is used
+    discord = None
+
+logger = logging.getLogger(__name__)
+
+
+class LocalSource:
+    def __init__(self):
+        self._queues = {}  # channel_id -> set of asyncio.Queue
+
+    def publish(self, channel_id, message):
+        for queue in self._queues.get(str(channel_id), ()):
+            queue.put_nowait(message)
+
+    async def watch(self, channel_id, bot_token):
+        queue = asyncio.Queue()
+        self._queues.setdefault(str(channel_id), set()).add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._queues[str(channel_id)].discard(queue)
+
+
+class PollingSource:
+    """
+    Polls a channel every ``interval`` seconds with ``fetch_window``, a sync
+    callable ``(channel_id, bot_token) -> window`` returning the channel's
+    recent messages, oldest first (or None on errors). It should answer from
+    a cache rather than call Discord each time.
+    """
+
+    def __init__(self, fetch_window, interval=1.0):
+        self.fetch_window = fetch_window
+        self.interval = interval
+
+    async def watch(self, channel_id, bot_token):
+        fetch_window = sync_to_async(self.fetch_window, thread_sensitive=False)
+        window = await fetch_window(channel_id, bot_token)
+        last_id = int(window[-1]["id"]) if window else 0
+        while True:
+            await asyncio.sleep(self.interval)
+            window = await fetch_window(channel_id, bot_token)
+            for msg in window or ():
+                if int(msg["id"]) > last_id:
+                    last_id = int(msg["id"])
+                    yield msg
+
+
+class _GatewayConnection:
+    """One discord.py client for a bot token, fanning messages out by channel."""
+
+    def __init__(self, bot_token):
+        intents = discord.Intents.none()
+        intents.guild_messages = True
+        intents.message_content = True
+        self.client = discord.Client(intents=intents)
+        self.client.event(self.on_message)
+        self.queues = {}  # channel_id -> set of asyncio.Queue
+        self.task = asyncio.get_running_loop().create_task(self.client.start(bot_token))
+
+    async def on_message(self, message):
+        payload = {
+            "id": str(message.id),
+            "content": message.content,
+            "author": {
+                "id": str(message.author.id),
+                "username": message.author.name,
+                "avatar": message.author.avatar.key if message.author.avatar else None,
+            },
+            "timestamp": message.created_at.isoformat(),
+        }
+        for queue in self.queues.get(str(message.channel.id), ()):
+            queue.put_nowait(payload)
+
+    async def close(self):
+        await self.client.close()
+        self.task.cancel()
+
+
+class GatewaySource:
+    def __init__(self):
+        if discord is None:
+            raise RuntimeError("The Discord gateway source requires discord.py.")
+        self._connections = {}  # bot_token -> _GatewayConnection
+
+    async def watch(self, channel_id, bot_token):
+        connection = self._connections.get(bot_token)
+        if connection is None:
+            connection = self._connections[bot_token] = _GatewayConnection(bot_token)
+        queue = asyncio.Queue()
+        connection.queues.setdefault(str(channel_id), set()).add(queue)
+        try:
+            while True:
+                if connection.task.done():
+                    # Surface login/intent errors instead of hanging forever.
+                    self._connections.pop(bot_token, None)
+                    connection.task.result()
+                    return
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=30)
+                except asyncio.TimeoutError:
+                    continue
+        finally:
+            connection.queues[str(channel_id)].discard(queue)
+            if not any(connection.queues.values()):
+                self._connections.pop(bot_token, None)
+                await connection.close()
+
+
+class ChannelWatcher:
+    """Broadcasts one upstream stream of channel messages to its subscribers."""
+
+    def __init__(self, hub, key, source):
+        self.hub = hub
+        self.key = key
+        self.source = source
+        self.subscribers = set()
+        self.task = None
+
+    def subscribe(self, max_queued=100):
+        queue = asyncio.Queue(maxsize=max_queued)
+        self.subscribers.add(queue)
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers:
+            self.hub._remove(self)
+            if self.task is not None:
+                self.task.cancel()
+
+    async def _run(self):
+        channel_id, bot_token = self.key
+        try:
+            async for message in self.source.watch(channel_id, bot_token):
+                for queue in list(self.subscribers):
+                    try:
+                        queue.put_nowait(message)
+                    except asyncio.QueueFull:
+                        # A stalled browser; it reconnects with Last-Event-ID.
+                        self.subscribers.discard(queue)
+                        _close(queue)
+        except Exception:
+            # Subscribers see their stream end and reconnect.
+            logger.exception("Discord stream for channel %s failed", channel_id, extra={'channel': channel_id})
+        finally:
+            self.hub._remove(self)
+            for queue in list(self.subscribers):
+                _close(queue)
+
+
+def _close(queue):
+    """Drop anything queued and tell the subscriber its stream has ended."""
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(None)
+
+
+class ChannelHub:
+    """Registry of watchers keyed by (channel_id, bot_token)."""
+
+    def __init__(self, source):
+        self.source = source
+        self._watchers = {}
+
+    def subscribe(self, channel_id, bot_token):
+        key = (channel_id, bot_token)
+        watcher = self._watchers.get(key)
+        if watcher is None:
+            watcher = self._watchers[key] = ChannelWatcher(self, key, self.source)
+        return watcher, watcher.subscribe()
+
+    def _remove(self, watcher):
+        if self._watchers.get(watcher.key) is watcher:
+            del self._watchers[watcher.key]
+
+    def __len__(self):
+        return len(self._watchers)
+
+
+def create_source(name, fetch_window, poll_interval=1.0):
+    if name == 'gateway':
+        return GatewaySource()
+    if name == 'local':
+        return LocalSource()
+    if name == 'polling':
+        return PollingSource(fetch_window, interval=poll_interval)
+    raise ValueError(f"Unknown Discord stream source {name!r}")
@@ -1,3 +1,1274 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import archive, async_http, async_views, metrics, profiles, search, sources, views
+from .benchmarks.stubs import STUB_SELFTEXT, UpstreamStub
+from .cache import TTLCache
+from .discord_api import DiscordClient, RateLimited, RateLimiter, async_discord_client
+from .media import Thumbnailer, store_upload
+from .media_proxy import MediaProxy, ProxyError, TooLarge, proxy_url
+from .prefetch import Prefetcher
+from .reddit_posts import SELFTEXT_PREVIEW, posts_from_listing
+from .profiles import get_profile
+from .reddit_api import async_reddit_client
+from .reddit_clients import RedditClientPool
+from .models import (
+    ArchivedDiscordMessage, ArchivedRedditPost, DiscordMessageSchedule, DiscordMessageScheduleArchive, MediaFile,
+    RedditPostSchedule, Source, UserProfile,
+)
+from .scheduler import DiscordMessageJob, ScheduleEngine
+from .streams import ChannelHub, LocalSource, PollingSource
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTests(SimpleTestCase):
+    def test_entries_expire_after_ttl(self):
+        clock = FakeClock()
+        cache = TTLCache(ttl=5, clock=clock)
+        cache.set('a', [1])
+        clock.now = 4.9
+        self.assertEqual(cache.get('a'), [1])
+        clock.now = 5
+        self.assertIsNone(cache.get('a'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(ttl=60, max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_failed_fetch_is_not_cached(self):
+        cache = TTLCache(ttl=60)
+        self.assertIsNone(cache.get_or_fetch('a', lambda: None))
+        self.assertEqual(cache.get_or_fetch('a', lambda: 'ok'), 'ok')
+
+    def test_concurrent_misses_share_one_fetch(self):
+        cache = TTLCache(ttl=60)
+        calls = []
+        release = threading.Event()
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return 'messages'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_fetch('chan', fetch)))
+            for _ in range(10)
+        ]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['messages'] * 10)
+
+    async def test_concurrent_async_misses_share_one_refresh(self):
+        cache = TTLCache(ttl=60)
+        calls = []
+
+        async def refresh(stale):
+            calls.append(stale)
+            await asyncio.sleep(0.01)
+            return 'messages'
+
+        results = await asyncio.gather(*(cache.aget_or_refresh('chan', refresh) for _ in range(10)))
+        self.assertEqual(calls, [None])
+        self.assertEqual(results, ['messages'] * 10)
+
+    async def test_cancelled_async_caller_hands_the_refresh_over(self):
+        cache = TTLCache(ttl=60)
+        calls = []
+        started = asyncio.Event()
+
+        async def refresh(stale):
+            calls.append(stale)
+            started.set()
+            await asyncio.sleep(0 if len(calls) > 1 else 60)
+            return 'messages'
+
+        first = asyncio.ensure_future(cache.aget_or_refresh('chan', refresh))
+        await started.wait()
+        second = asyncio.ensure_future(cache.aget_or_refresh('chan', refresh))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual(await second, 'messages')
+        with self.assertRaises(asyncio.CancelledError):
+            await first
+        self.assertEqual(calls, [None, None])
+
+
+class MetricsTests(TestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = metrics.Registry()
+        histogram = metrics.Histogram('t_seconds', 'Test.', ['view'], buckets=(0.1, 1), registry=registry)
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, view='a"b')
+        self.assertEqual(registry.render().splitlines(), [
+            '# HELP t_seconds Test.',
+            '# TYPE t_seconds histogram',
+            't_seconds_bucket{view="a\\"b",le="0.1"} 1',
+            't_seconds_bucket{view="a\\"b",le="1"} 2',
+            't_seconds_bucket{view="a\\"b",le="+Inf"} 3',
+            't_seconds_sum{view="a\\"b"} 5.55',
+            't_seconds_count{view="a\\"b"} 3',
+        ])
+
+    def test_cache_lookups_are_counted(self):
+        cache = TTLCache(ttl=60, name='test_cache')
+        before = {result: metrics.CACHE_REQUESTS.value(cache='test_cache', result=result) or 0
+                  for result in ('hit', 'miss')}
+        cache.get_or_fetch('a', lambda: 1)
+        cache.get_or_fetch('a', lambda: 1)
+        self.assertEqual(metrics.CACHE_REQUESTS.value(cache='test_cache', result='miss'), before['miss'] + 1)
+        self.assertEqual(metrics.CACHE_REQUESTS.value(cache='test_cache', result='hit'), before['hit'] + 1)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_endpoint_requires_token_and_reports_views(self):
+        self.assertEqual(self.client.get(reverse('login')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        body = response.content.decode()
+        self.assertIn('dashboard_request_duration_seconds_count{view="login",method="GET",status="200"}', body)
+        self.assertIn('dashboard_scheduler_queue_depth{kind="discord"} 0', body)
+
+    def test_endpoint_is_staff_only_without_a_token(self):
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ').status_code, 401)
+        self.client.force_login(User.objects.create_user('ivy'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        self.client.force_login(User.objects.create_user('jo', is_staff=True))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+def discord_message(snowflake):
+    return {
+        "id": str(snowflake),
+        "content": f"message {snowflake}",
+        "author": {"id": "1", "username": "bot", "avatar": None},
+        "timestamp": "2025-05-24T13:54:00+00:00",
+    }
+
+
+def discord_response(messages, status_code=200, headers=None):
+    return mock.Mock(status_code=status_code, headers=headers or {}, json=mock.Mock(return_value=messages))
+
+
+def wait_for_refreshes(prefetcher):
+    for _ in range(500):
+        if not prefetcher._refreshing:
+            return
+        time.sleep(0.01)
+
+
+class PrefetcherTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache(ttl=10, clock=self.clock)
+        self.prefetcher = Prefetcher(max_sources=2, idle_timeout=60, refresh_ahead=0.8, interval=3600,
+                                     clock=self.clock)
+        self.prefetcher.start()
+
+    def test_requested_keys_are_refreshed_ahead_of_expiry_until_idle(self):
+        calls = []
+
+        def refresh(stale):
+            calls.append(stale)
+            return (stale or 0) + 1
+
+        self.assertEqual(self.prefetcher.get(self.cache, 'chan', refresh), 1)
+        self.clock.now = 7
+        self.prefetcher.run_pending()
+        wait_for_refreshes(self.prefetcher)
+        self.assertEqual(calls, [None])
+        self.clock.now = 8
+        self.prefetcher.run_pending()
+        wait_for_refreshes(self.prefetcher)
+        self.assertEqual(calls, [None, 1])
+        self.assertEqual(self.cache.get('chan'), 2)
+
+        self.clock.now = 100
+        self.prefetcher.run_pending()
+        self.assertEqual(len(self.prefetcher), 0)
+
+    def test_expired_value_is_served_while_refreshing(self):
+        self.cache.set('chan', 'old')
+        self.clock.now = 15
+        release = threading.Event()
+
+        def refresh(stale):
+            release.wait(5)
+            return 'new'
+
+        self.assertEqual(self.prefetcher.get(self.cache, 'chan', refresh), 'old')
+        release.set()
+        wait_for_refreshes(self.prefetcher)
+        self.assertEqual(self.cache.get('chan'), 'new')
+
+    def test_refresh_errors_do_not_log_credentials(self):
+        self.cache.set(('42', 'bot-token'), 'old')
+        self.clock.now = 15
+
+        def refresh(stale):
+            raise RuntimeError('boom')
+
+        with self.assertLogs('dashboard.prefetch', 'WARNING') as logs:
+            self.prefetcher.get(self.cache, ('42', 'bot-token'), refresh)
+            wait_for_refreshes(self.prefetcher)
+        self.assertIn('42', logs.output[0])
+        self.assertNotIn('bot-token', logs.output[0])
+
+    def test_warm_set_is_bounded(self):
+        for key in ('a', 'b', 'c'):
+            self.prefetcher.get(self.cache, key, lambda stale: 'value')
+        self.assertEqual(len(self.prefetcher), 2)
+        self.assertEqual([key for _, key in self.prefetcher._tracked], ['b', 'c'])
+
+
+class DiscordIncrementalFetchTests(TestCase):
+    def setUp(self):
+        views.discord_message_cache.clear()
+        user = User.objects.create_user('alice', password='secret')
+        UserProfile.objects.create(user=user, discord_bot_token='token', discord_channel_id='42')
+        self.client.force_login(user)
+        self.url = reverse('fetch_discord_messages')
+
+    def test_refresh_only_requests_messages_after_cached_window(self):
+        window = [discord_message(i) for i in (1, 2)]
+        with mock.patch.object(views.discord_client, 'session') as session:
+            session.request.return_value = discord_response([discord_message(3)])
+            refreshed = views._refresh_channel_window('token', '42', window)
+        self.assertEqual(session.request.call_args.kwargs['params'], {'limit': 10, 'after': '2'})
+        self.assertEqual([msg['id'] for msg in refreshed], ['1', '2', '3'])
+
+    def test_client_cursor_returns_delta_or_not_modified(self):
+        upstream = [discord_message(i) for i in (3, 2, 1)]
+        with mock.patch.object(views.discord_client, 'session') as session:
+            session.request.return_value = discord_response(upstream)
+            data = self.client.get(self.url, {'after': '2'}).json()
+            self.assertEqual([msg['id'] for msg in data['messages']], ['3'])
+            self.assertEqual(data['cursor'], '3')
+            self.assertFalse(data['reset'])
+
+            response = self.client.get(self.url, {'after': '3'})
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"3"')
+            self.assertEqual(response.status_code, 304)
+
+
+class DiscordStreamTests(SimpleTestCase):
+    async def test_subscribers_share_one_upstream_watcher(self):
+        source = LocalSource()
+        hub = ChannelHub(source)
+        watcher, first = hub.subscribe('42', 'token')
+        same_watcher, second = hub.subscribe('42', 'token')
+        self.assertIs(watcher, same_watcher)
+        await asyncio.sleep(0)
+
+        self.assertEqual(len(source._queues['42']), 1)
+        source.publish('42', discord_message(7))
+        self.assertEqual((await first.get())['id'], '7')
+        self.assertEqual((await second.get())['id'], '7')
+
+        watcher.unsubscribe(first)
+        watcher.unsubscribe(second)
+        await asyncio.sleep(0)
+        self.assertEqual(len(hub), 0)
+        self.assertEqual(source._queues['42'], set())
+
+    async def test_event_stream_catches_up_then_pushes(self):
+        source = LocalSource()
+        window = [discord_message(i) for i in (1, 2, 3)]
+        with mock.patch.object(views, '_discord_stream_hub', ChannelHub(source)), \
+                mock.patch.object(views, '_poll_channel_window', return_value=window):
+            stream = views._discord_event_stream('42', 'token', '1')
+            self.assertEqual(await anext(stream), 'retry: 2000\n\n')
+            self.assertTrue((await anext(stream)).startswith('id: 2\n'))
+            self.assertTrue((await anext(stream)).startswith('id: 3\n'))
+            pending = asyncio.ensure_future(anext(stream))
+            await asyncio.sleep(0)
+            source.publish('42', discord_message(3))  # already sent, skipped
+            source.publish('42', discord_message(4))
+            self.assertTrue((await pending).startswith('id: 4\n'))
+            await stream.aclose()
+
+    async def test_polling_source_reads_through_the_message_cache(self):
+        window = [discord_message(i) for i in (1, 2)]
+        with mock.patch.object(views, 'discord_message_cache', TTLCache(ttl=60)), \
+                mock.patch.object(views, '_get_channel_messages', return_value=window) as get_messages:
+            stream = PollingSource(views._poll_channel_window, interval=0.01).watch('42', 'token')
+            pending = asyncio.ensure_future(anext(stream))
+            await asyncio.sleep(0.1)
+            pending.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await pending
+            await stream.aclose()
+        get_messages.assert_called_once_with('token', '42')
+
+    async def test_source_errors_are_logged_and_end_the_stream(self):
+        class BrokenSource:
+            async def watch(self, channel_id, bot_token):
+                raise RuntimeError("401: Unauthorized")
+                yield
+
+        hub = ChannelHub(BrokenSource())
+        watcher, queue = hub.subscribe('42', 'token')
+        with self.assertLogs('dashboard.streams', 'ERROR') as logs:
+            self.assertIsNone(await queue.get())
+            await watcher.task  # the error was retrieved, so this doesn't raise
+        self.assertIn('Discord stream for channel 42 failed', logs.output[0])
+        self.assertEqual(len(hub), 0)
+
+
+class RedditClientPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.pool = RedditClientPool(max_clients=2, idle_timeout=60, factory=mock.Mock, clock=self.clock)
+
+    def test_clients_are_reused_per_credentials(self):
+        client = self.pool.get('id', 'secret', 'agent')
+        self.assertIs(self.pool.get('id', 'secret', 'agent'), client)
+        self.assertIsNot(self.pool.get('id', 'other', 'agent'), client)
+
+    def test_least_recently_used_and_idle_clients_are_closed(self):
+        a = self.pool.get('a', 's', 'ua')
+        b = self.pool.get('b', 's', 'ua')
+        self.pool.get('a', 's', 'ua')
+        self.pool.get('c', 's', 'ua')
+        b._core.close.assert_called_once_with()
+        a._core.close.assert_not_called()
+
+        self.clock.now = 61
+        self.pool.get('d', 's', 'ua')
+        a._core.close.assert_called_once_with()
+        self.assertEqual(len(self.pool), 1)
+
+
+def reddit_post(post_id, **fields):
+    data = {
+        'id': post_id, 'name': f't3_{post_id}', 'title': 't', 'author': 'a', 'score': 1,
+        'url': 'https://example.com', 'selftext': '', 'media': None, 'permalink': '/r/x',
+        'num_comments': 0, 'created_utc': 1700000000.0,
+    }
+    data.update(fields)
+    return {'kind': 't3', 'data': data}
+
+
+def reddit_listing(posts):
+    return {'kind': 'Listing', 'data': {'after': None, 'children': posts}}
+
+
+class RedditPostRecordTests(SimpleTestCase):
+    def test_media_is_classified_and_long_selftext_truncated(self):
+        video, image, text = posts_from_listing(reddit_listing([
+            reddit_post('v', media={'reddit_video': {'fallback_url': 'https://v.redd.it/x.mp4'}}),
+            reddit_post('i', url='https://i.redd.it/x.png'),
+            reddit_post('t', selftext='x' * 2000),
+        ])['data'])
+        self.assertEqual((video.media_type, video.media_url), ('video', 'https://v.redd.it/x.mp4'))
+        self.assertEqual((image.media_type, image.media_url), ('image', 'https://i.redd.it/x.png'))
+        self.assertEqual(image.as_dict()['media_url'], proxy_url('https://i.redd.it/x.png', 640))
+        self.assertEqual(text.media_type, 'text')
+        self.assertEqual(len(text.selftext), 500)
+        self.assertTrue(text.selftext_truncated)
+        self.assertFalse(hasattr(text, '__dict__'))
+
+
+class RedditPaginationTests(TestCase):
+    def setUp(self):
+        views.reddit_listing_cache.clear()
+        user = User.objects.create_user('bob', password='secret')
+        UserProfile.objects.create(user=user, reddit_client_id='id', reddit_subreddit='Python')
+        self.client.force_login(user)
+
+    def test_cursor_is_passed_to_reddit_and_pages_are_shared(self):
+        reddit = mock.Mock()
+        reddit.request.return_value = reddit_listing([reddit_post(f'p{i}') for i in range(10)])
+        with mock.patch('dashboard.views.get_reddit', return_value=reddit):
+            first = self.client.get(reverse('fetch_reddit_posts'), {'after': 't3_abc'}).json()
+            second = self.client.get(reverse('fetch_reddit_posts'), {'after': 't3_abc'}).json()
+
+        reddit.request.assert_called_once_with(
+            method='GET', path='/r/python/hot', params={'limit': 10, 'after': 't3_abc'},
+        )
+        self.assertEqual(first, second)
+        self.assertEqual(len(first['posts']), 10)
+        self.assertEqual(first['after'], 't3_p9')
+
+
+class AsyncViewTests(TestCase):
+    """The async views against the benchmark's stub of the Discord/Reddit APIs."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = UpstreamStub(latency=0)
+        cls.stub.start()
+        cls.addClassCleanup(cls.stub.stop)
+
+    def setUp(self):
+        views.discord_message_cache.clear()
+        views.reddit_listing_cache.clear()
+        self.user = User.objects.create_user('carol', password='secret')
+        UserProfile.objects.create(
+            user=self.user, discord_bot_token='token', discord_channel_id='42',
+            reddit_client_id='id', reddit_client_secret='secret', reddit_user_agent='tests',
+            reddit_subreddit='python',
+        )
+        base_url = self.stub.base_url
+        for patcher in (
+            mock.patch.object(async_discord_client, 'base_url', f'{base_url}/api/v10'),
+            mock.patch.object(async_reddit_client, 'oauth_base', base_url),
+            mock.patch.object(async_reddit_client, 'token_url', f'{base_url}/api/v1/access_token'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def call(self, view, path, data=None, method='get', **kwargs):
+        request = getattr(AsyncRequestFactory(), method)(path, data)
+        request.user = self.user
+
+        async def auser():
+            return self.user
+        request.auser = auser
+        try:
+            return await view(request, **kwargs)
+        finally:
+            await async_http.close_sessions()
+
+    async def test_fetch_discord_messages(self):
+        data = json.loads((await self.call(async_views.fetch_discord_messages, '/', {'after': '4205'})).content)
+        self.assertTrue(data['success'])
+        self.assertEqual([msg['id'] for msg in data['messages']], [str(4200 + i) for i in range(6, 11)])
+        self.assertEqual(data['cursor'], '4210')
+
+    async def test_fetch_reddit_posts(self):
+        data = json.loads((await self.call(async_views.fetch_reddit_posts, '/')).content)
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['posts']), 10)
+        self.assertEqual(data['posts'][0]['author'], 'stub')
+        self.assertEqual(data['posts'][0]['media_type'], 'image')
+        self.assertEqual(data['after'], 't3_pyt9')
+
+    async def test_long_selftext_is_fetched_on_demand(self):
+        data = json.loads((await self.call(async_views.fetch_reddit_posts, '/')).content)
+        post = data['posts'][1]
+        self.assertTrue(post['selftext_truncated'])
+        response = await self.call(async_views.fetch_reddit_selftext, '/', post_id=post['id'])
+        self.assertEqual(json.loads(response.content)['selftext'], STUB_SELFTEXT)
+
+    async def test_fetch_feed(self):
+        data = json.loads((await self.call(async_views.fetch_feed, '/')).content)
+        self.assertEqual([source['success'] for source in data['sources']], [True, True])
+        self.assertEqual(len(data['items']), 20)
+        self.assertEqual(data['items'][0]['type'], 'discord')  # 2025-01-01 00:00 beats the first post by a minute
+
+
+class FeedTests(TestCase):
+    def setUp(self):
+        views.discord_message_cache.clear()
+        views.reddit_listing_cache.clear()
+        user = User.objects.create_user('dave', password='secret')
+        UserProfile.objects.create(user=user, discord_bot_token='token', discord_channel_id='42',
+                                   reddit_client_id='id', reddit_subreddit='python')
+        self.client.force_login(user)
+
+    def test_sources_are_fetched_in_parallel_and_merged(self):
+        # Neither fetch returns until both have started, so fetching the
+        # sources one after the other breaks the barrier and fails them.
+        both_started = threading.Barrier(2, timeout=5)
+
+        def get_messages(*args, **kwargs):
+            both_started.wait()
+            message = discord_message(2)
+            message['timestamp'] = '2023-11-14T22:13:30+00:00'  # between the posts
+            return discord_response([message])
+
+        def request(**kwargs):
+            both_started.wait()
+            return reddit_listing([reddit_post(f'p{i}', created_utc=1700000000.0 + i * 20) for i in range(2)])
+
+        reddit = mock.Mock()
+        reddit.request.side_effect = request
+        with mock.patch.object(views.discord_client, 'get_messages', side_effect=get_messages), \
+                mock.patch('dashboard.views.get_reddit', return_value=reddit):
+            data = self.client.get(reverse('fetch_feed')).json()
+        self.assertFalse(both_started.broken)
+
+        self.assertEqual([(item['type'], item['data']['id']) for item in data['items']],
+                         [('reddit', 'p1'), ('discord', '2'), ('reddit', 'p0')])
+        self.assertEqual(data['sources'], [
+            {'type': 'discord', 'source': '42', 'success': True, 'cursor': '2'},
+            {'type': 'reddit', 'source': 'python', 'success': True, 'after': None},
+        ])
+
+    def test_failed_source_does_not_fail_the_feed(self):
+        reddit = mock.Mock()
+        reddit.request.return_value = reddit_listing([])
+        with mock.patch.object(views.discord_client, 'get_messages', return_value=discord_response([], 500)), \
+                mock.patch('dashboard.views.get_reddit', return_value=reddit):
+            data = self.client.get(reverse('fetch_feed')).json()
+        self.assertTrue(data['success'])
+        self.assertEqual([source['success'] for source in data['sources']], [False, True])
+
+
+class ProfileCacheTests(TestCase):
+    def setUp(self):
+        # Rolled-back users' pks are reused, so drop other tests' profiles.
+        profiles._local.clear()
+
+    def test_profiles_are_cached_until_saved(self):
+        user = User.objects.create_user('frank', password='secret')
+        with self.assertRaises(UserProfile.DoesNotExist):
+            get_profile(user)
+        with self.assertNumQueries(0):
+            with self.assertRaises(UserProfile.DoesNotExist):
+                get_profile(user)
+
+        profile = UserProfile.objects.create(user=user, discord_channel_id='1')
+        self.assertEqual(get_profile(user).discord_channel_id, '1')
+        with self.assertNumQueries(0):
+            get_profile(user)
+
+        profile.discord_channel_id = '2'
+        profile.save()
+        self.assertEqual(get_profile(user).discord_channel_id, '2')
+
+
+class SubscriptionTests(TestCase):
+    def setUp(self):
+        views.reddit_listing_cache.clear()
+        self.users = []
+        for name, token in (('erin', 'bot-a'), ('fred', 'bot-a'), ('gina', 'bot-b')):
+            user = User.objects.create_user(name, password='secret')
+            UserProfile.objects.create(user=user, discord_bot_token=token, discord_channel_id='42',
+                                       reddit_client_id='id', reddit_subreddit='Python')
+            self.users.append(user)
+
+    def test_profile_form_subscribes_to_extra_sources(self):
+        self.client.force_login(self.users[0])
+        self.client.post(reverse('dashboard'), {
+            'discord_bot_token': 'bot-a', 'discord_channel_id': '42',
+            'reddit_client_id': 'id', 'reddit_client_secret': 's', 'reddit_user_agent': 'ua',
+            'reddit_subreddit': 'Python', 'extra_discord_channels': '43\n', 'extra_subreddits': 'r/Django\n\n',
+        })
+        self.assertEqual(sources.get_sources(self.users[0].pk), [
+            ('discord', '42'), ('reddit', 'python'), ('discord', '43'), ('reddit', 'django'),
+        ])
+        self.assertEqual(Source.objects.count(), 4)
+
+    def test_channel_ids_must_be_snowflakes(self):
+        self.client.force_login(self.users[0])
+        response = self.client.post(reverse('dashboard'), {
+            'discord_bot_token': 'bot-a', 'discord_channel_id': '42',
+            'reddit_client_id': 'id', 'reddit_client_secret': 's', 'reddit_user_agent': 'ua',
+            'reddit_subreddit': 'Python', 'extra_discord_channels': '43\n../../users/@me\n',
+        })
+        self.assertFormError(response.context['form'], 'extra_discord_channels',
+                             "Not Discord channel IDs: ../../users/@me")
+        self.assertFalse(Source.objects.filter(name='43').exists())
+
+    def test_subreddits_must_be_names(self):
+        self.client.force_login(self.users[0])
+        response = self.client.post(reverse('dashboard'), {
+            'discord_bot_token': 'bot-a', 'discord_channel_id': '42',
+            'reddit_client_id': 'id', 'reddit_client_secret': 's', 'reddit_user_agent': 'ua',
+            'reddit_subreddit': 'python/comments/x', 'extra_subreddits': 'r/Django\n../hot\n',
+        })
+        form = response.context['form']
+        self.assertFormError(form, 'reddit_subreddit', "Enter a subreddit name (letters, digits and underscores).")
+        self.assertFormError(form, 'extra_subreddits', "Not subreddit names: ../hot")
+        self.assertFalse(Source.objects.filter(name='django').exists())
+
+    def test_subscribers_share_fetches_and_only_see_their_sources(self):
+        sources.subscribe(self.users[0].pk, Source.REDDIT, 'django')
+        reddit = mock.Mock()
+        reddit.request.return_value = reddit_listing([])
+        with mock.patch('dashboard.views.get_reddit', return_value=reddit):
+            for user in self.users:
+                self.client.force_login(user)
+                self.client.get(reverse('fetch_reddit_posts'))
+            self.client.force_login(self.users[0])
+            data = self.client.get(reverse('fetch_reddit_posts'), {'subreddit': 'Django'}).json()
+            self.assertTrue(data['success'])
+            self.client.force_login(self.users[1])
+            data = self.client.get(reverse('fetch_reddit_posts'), {'subreddit': 'django'}).json()
+            self.assertFalse(data['success'])
+        self.assertEqual(sorted(call.kwargs['path'] for call in reddit.request.call_args_list),
+                         ['/r/django/hot', '/r/python/hot'])
+
+
+class DiscordRateLimitTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sleeps = []
+
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            self.clock.now += seconds
+
+        self.limiter = RateLimiter(clock=self.clock, sleep=sleep)
+        self.session = mock.Mock()
+        self.client = DiscordClient(session=self.session, rate_limiter=self.limiter, sleep=sleep)
+
+    def test_waits_for_exhausted_bucket_instead_of_sending(self):
+        self.session.request.return_value = discord_response([], headers={
+            'X-RateLimit-Bucket': 'abc', 'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset-After': '2.5',
+        })
+        self.client.create_message('token', '42', 'hi')
+        self.assertEqual(self.sleeps, [])
+        self.client.create_message('token', '42', 'hi')
+        self.assertEqual(self.sleeps, [2.5])
+        # Another channel has its own bucket.
+        self.client.create_message('token', '43', 'hi')
+        self.assertEqual(self.sleeps, [2.5])
+
+    def test_buckets_past_their_reset_are_dropped(self):
+        self.session.request.return_value = discord_response([], headers={
+            'X-RateLimit-Bucket': 'abc', 'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset-After': '2.5',
+        })
+        for channel_id in range(100):
+            self.client.create_message('token', str(channel_id), 'hi')
+        self.assertEqual(len(self.limiter._buckets), 100)
+        self.clock.now += 60
+        self.client.create_message('token', '42', 'hi')
+        self.assertEqual(list(self.limiter._buckets), [('token', 'abc', '42')])
+        self.assertEqual(len(self.limiter._route_buckets), 1)
+        self.client.create_message('token', '42', 'hi')
+        self.assertEqual(self.sleeps, [2.5])  # the new bucket is still honoured
+
+    def test_429_is_retried_after_retry_after(self):
+        self.session.request.side_effect = [
+            discord_response({'retry_after': 1.5, 'global': False}, status_code=429),
+            discord_response([]),
+        ]
+        response = self.client.get_messages('token', '42')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.sleeps, [1.5])
+
+    def test_long_waits_raise_rate_limited(self):
+        self.session.request.return_value = discord_response(
+            {'retry_after': 120}, status_code=429, headers={'X-RateLimit-Scope': 'global'},
+        )
+        with self.assertRaises(RateLimited):
+            self.client.get_messages('token', '42')
+
+
+class ScheduleEngineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('carol', password='secret')
+        UserProfile.objects.create(user=self.user, discord_bot_token='token', discord_channel_id='42')
+        self.job = DiscordMessageJob()
+        self.sent = []
+        self.job.send = lambda msg: self.sent.append(msg.pk)
+        self.engine = ScheduleEngine([self.job], resync_interval=300)
+
+    def run_engine(self, engine=None):
+        engine = engine or self.engine
+        engine.run_pending()
+        return engine.drain(timeout=5)
+
+    def schedule(self, seconds):
+        return DiscordMessageSchedule.objects.create(
+            user=self.user, message='hi', scheduled_time=timezone.now() + timedelta(seconds=seconds)
+        )
+
+    def test_sleeps_until_next_item_is_due(self):
+        due = self.schedule(-1)
+        later = self.schedule(30)
+        timeout = self.run_engine()
+        self.assertEqual(self.sent, [due.pk])
+        self.assertTrue(DiscordMessageSchedule.objects.get(pk=due.pk).sent)
+        self.assertAlmostEqual(timeout, 30, delta=1)
+        self.assertFalse(DiscordMessageSchedule.objects.get(pk=later.pk).sent)
+
+    def test_notify_adds_items_created_after_load(self):
+        self.run_engine()
+        msg = self.schedule(-1)
+        self.engine.notify('discord', msg.pk, msg.scheduled_time)
+        self.run_engine()
+        self.assertEqual(self.sent, [msg.pk])
+
+    def test_failed_items_are_retried_with_backoff(self):
+        msg = self.schedule(-1)
+        self.job.send = mock.Mock(side_effect=RuntimeError('boom'))
+        timeout = self.run_engine()
+        msg.refresh_from_db()
+        self.assertEqual((msg.sent, msg.attempts, msg.last_error, msg.status), (False, 1, 'boom', 'retrying'))
+        self.assertAlmostEqual(timeout, 5, delta=1)
+
+        DiscordMessageSchedule.objects.filter(pk=msg.pk).update(claimed_until=timezone.now())
+        timeout = self.run_engine(ScheduleEngine([self.job]))
+        self.assertAlmostEqual(timeout, 10, delta=1)
+
+    def test_items_are_marked_failed_after_max_attempts(self):
+        msg = self.schedule(-1)
+        DiscordMessageSchedule.objects.filter(pk=msg.pk).update(attempts=self.job.max_attempts - 1)
+        self.job.send = mock.Mock(side_effect=RuntimeError('boom'))
+        self.run_engine()
+        msg.refresh_from_db()
+        self.assertEqual(msg.status, 'failed')
+        self.run_engine()
+        self.assertEqual(self.job.send.call_count, 1)
+
+    def test_items_of_users_without_a_profile_fail(self):
+        orphan = DiscordMessageSchedule.objects.create(
+            user=User.objects.create_user('nobody'), channel_id='42', message='hi', scheduled_time=timezone.now()
+        )
+        msg = self.schedule(-1)
+        self.run_engine()
+        orphan.refresh_from_db()
+        self.assertEqual((orphan.status, orphan.last_error), ('failed', 'User has no profile'))
+        self.assertEqual(self.sent, [msg.pk])
+
+    def test_channels_are_sent_concurrently_and_in_order(self):
+        other = User.objects.create_user('dave', password='secret')
+        UserProfile.objects.create(user=other, discord_bot_token='token', discord_channel_id='43')
+        for user in (self.user, other):
+            for _ in range(6):
+                DiscordMessageSchedule.objects.create(user=user, message='hi', scheduled_time=timezone.now())
+        lock = threading.Lock()
+        in_flight = set()
+        overlapped = []
+        order = {}
+
+        def send(msg):
+            with lock:
+                overlapped.append(bool(in_flight))
+                in_flight.add(msg.pk)
+                order.setdefault(msg.user_id, []).append(msg.pk)
+            time.sleep(0.02)
+            with lock:
+                in_flight.discard(msg.pk)
+
+        self.job.send = send
+        self.run_engine()
+
+        self.assertTrue(any(overlapped))
+        for pks in order.values():
+            self.assertEqual(pks, sorted(pks))
+        self.assertFalse(DiscordMessageSchedule.objects.filter(sent=False).exists())
+
+    def test_slow_lane_does_not_hold_up_others(self):
+        release = threading.Event()
+        self.job.send = lambda msg: release.wait(5) if msg.channel_id == '42' else None
+        slow = DiscordMessageSchedule.objects.create(user=self.user, channel_id='42', message='hi',
+                                                     scheduled_time=timezone.now())
+        self.engine.run_pending()
+        fast = DiscordMessageSchedule.objects.create(user=self.user, channel_id='43', message='hi',
+                                                     scheduled_time=timezone.now())
+        self.engine.notify('discord', fast.pk, fast.scheduled_time)
+        for _ in range(500):
+            self.engine.run_pending()
+            if DiscordMessageSchedule.objects.get(pk=fast.pk).sent:
+                break
+            time.sleep(0.01)
+        self.assertTrue(DiscordMessageSchedule.objects.get(pk=fast.pk).sent)
+        self.assertFalse(DiscordMessageSchedule.objects.get(pk=slow.pk).sent)
+        release.set()
+        self.engine.drain(timeout=5)
+        self.assertTrue(DiscordMessageSchedule.objects.get(pk=slow.pk).sent)
+
+    def test_leases_are_renewed_while_a_lane_drains(self):
+        engine = ScheduleEngine([self.job], lease_seconds=60)
+        release = threading.Event()
+        self.job.send = mock.Mock(side_effect=lambda msg: release.wait(5))
+        first = self.schedule(-2)
+        second = self.schedule(-1)
+        engine.run_pending()
+        # Another process took over the queued item after its lease ran out.
+        DiscordMessageSchedule.objects.filter(pk=second.pk).update(claim_token='theirs')
+        later = timezone.now() + timedelta(seconds=45)
+        with mock.patch('dashboard.scheduler.timezone.now', return_value=later):
+            engine.run_pending()
+        first.refresh_from_db()
+        self.assertEqual(first.claimed_until, later + timedelta(seconds=60))
+        release.set()
+        engine.drain(timeout=5)
+        self.assertEqual([c.args[0].pk for c in self.job.send.call_args_list], [first.pk])
+        self.assertTrue(DiscordMessageSchedule.objects.get(pk=first.pk).sent)
+
+    def test_channel_waits_for_message_being_retried(self):
+        first = self.schedule(-2)
+        second = self.schedule(-1)
+        self.job.send = mock.Mock(side_effect=RuntimeError('boom'))
+        self.run_engine()
+        self.assertEqual(self.job.send.call_count, 1)  # second isn't tried past first
+
+        later = self.schedule(-1)
+        self.job.send = mock.Mock()
+        self.engine.notify('discord', later.pk, later.scheduled_time)
+        self.run_engine()
+        self.job.send.assert_not_called()
+
+        DiscordMessageSchedule.objects.update(claimed_until=timezone.now())
+        self.run_engine(ScheduleEngine([self.job]))
+        self.assertEqual([c.args[0].pk for c in self.job.send.call_args_list], [first.pk, second.pk, later.pk])
+
+    def test_items_claimed_by_another_process_are_not_sent(self):
+        mine = self.schedule(-1)
+        theirs = self.schedule(-1)
+        other_engine = ScheduleEngine([self.job])
+        self.assertEqual([item.pk for item in other_engine.claim(self.job, [theirs.pk])], [theirs.pk])
+
+        self.run_engine()
+        self.assertEqual(self.sent, [mine.pk])
+        self.assertFalse(DiscordMessageSchedule.objects.get(pk=theirs.pk).sent)
+
+    def test_expired_leases_are_reclaimed(self):
+        msg = self.schedule(-1)
+        DiscordMessageSchedule.objects.filter(pk=msg.pk).update(
+            claim_token='dead', claimed_until=timezone.now() - timedelta(seconds=1)
+        )
+        self.run_engine()
+        self.assertEqual(self.sent, [msg.pk])
+        self.assertTrue(DiscordMessageSchedule.objects.get(pk=msg.pk).sent)
+
+
+class SchedulerQueryCountTests(TestCase):
+    def dispatch_queries(self, count):
+        for i in range(count):
+            user = User.objects.create_user(f'user{count}-{i}')
+            UserProfile.objects.create(user=user, discord_bot_token='token', discord_channel_id='42')
+            DiscordMessageSchedule.objects.create(user=user, message='hi', scheduled_time=timezone.now())
+        engine = ScheduleEngine([DiscordMessageJob()])
+
+        with mock.patch.object(views.discord_client, 'create_message', return_value=discord_response([])), \
+                CaptureQueriesContext(connection) as queries:
+            engine.run_pending()
+            engine.drain(timeout=5)
+        # Profiles looked up per item from the pool threads would fail to see
+        # this test's uncommitted rows, so everything being sent also proves
+        # the senders didn't query.
+        self.assertFalse(DiscordMessageSchedule.objects.filter(sent=False).exists())
+        DiscordMessageSchedule.objects.all().delete()
+        return len(queries)
+
+    def test_dispatch_query_count_does_not_grow_with_due_items(self):
+        self.assertEqual(self.dispatch_queries(1), self.dispatch_queries(25))
+
+
+class ArchiveSchedulesTests(TestCase):
+    def test_old_sent_and_failed_rows_move_to_archive(self):
+        user = User.objects.create_user('erin', password='secret')
+        long_ago = timezone.now() - timedelta(days=90)
+        media = MediaFile.objects.create(sha256='0' * 64, kind=MediaFile.IMAGE, content_type='image/png',
+                                         size=8, file='uploads/00/pic.png')
+        old = DiscordMessageSchedule.objects.create(user=user, channel_id='43', message='old', media=media,
+                                                    scheduled_time=long_ago, sent=True)
+        failed = DiscordMessageSchedule.objects.create(user=user, message='failed', scheduled_time=long_ago,
+                                                       failed=True, last_error='Missing Access')
+        unsent = DiscordMessageSchedule.objects.create(user=user, message='unsent', scheduled_time=long_ago)
+        recent = DiscordMessageSchedule.objects.create(user=user, message='recent', scheduled_time=timezone.now(), sent=True)
+
+        call_command('archive_schedules', days=30, batch_size=1, stdout=mock.Mock())
+
+        self.assertEqual(
+            set(DiscordMessageSchedule.objects.values_list('pk', flat=True)), {unsent.pk, recent.pk}
+        )
+        archived = DiscordMessageScheduleArchive.objects.get(failed=False)
+        self.assertEqual((archived.pk, archived.channel_id, archived.media), (old.pk, '43', media))
+        archived = DiscordMessageScheduleArchive.objects.get(failed=True)
+        self.assertEqual((archived.pk, archived.last_error), (failed.pk, 'Missing Access'))
+
+
+class DiscordOutboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('frank', password='secret')
+        UserProfile.objects.create(user=self.user, discord_bot_token='token', discord_channel_id='42')
+        self.client.force_login(self.user)
+
+    def test_send_queues_message_without_calling_discord(self):
+        with mock.patch.object(views.discord_client, 'create_message') as create_message, \
+                mock.patch.object(views.schedule_engine, 'notify') as notify:
+            data = self.client.post(reverse('send_discord_message'), {'content': ' hi '}).json()
+        create_message.assert_not_called()
+        queued = DiscordMessageSchedule.objects.get()
+        self.assertEqual(data, {'success': True, 'id': queued.pk, 'status': 'queued'})
+        self.assertEqual((queued.message, queued.channel_id), ('hi', '42'))
+        notify.assert_called_once_with('discord', queued.pk, queued.scheduled_time)
+
+    def test_status_only_covers_own_messages(self):
+        mine = DiscordMessageSchedule.objects.create(user=self.user, message='a', scheduled_time=timezone.now(),
+                                                     sent=True)
+        other = User.objects.create_user('grace')
+        theirs = DiscordMessageSchedule.objects.create(user=other, message='b', scheduled_time=timezone.now())
+        data = self.client.get(reverse('discord_message_status'), {'ids': f'{mine.pk},{theirs.pk}'}).json()
+        self.assertEqual(data['messages'], [{'id': mine.pk, 'status': 'sent', 'attempts': 0, 'error': ''}])
+
+
+PNG = b'\x89PNG\r\n\x1a\n'
+
+
+class MediaTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('ivan', password='secret')
+        UserProfile.objects.create(user=self.user, discord_bot_token='token', discord_channel_id='42')
+        self.client.force_login(self.user)
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+
+    def schedule(self, content, content_type='image/png'):
+        upload = SimpleUploadedFile('pic.png', content, content_type=content_type)
+        with mock.patch.object(views.schedule_engine, 'notify'), \
+                mock.patch('dashboard.media.thumbnailer.submit') as submit, \
+                self.captureOnCommitCallbacks(execute=True):
+            data = self.client.post(reverse('schedule_discord_message'), {
+                'message': 'look', 'scheduled_time': '2030-01-01T10:00:00', 'media': upload,
+            }).json()
+        return data, submit
+
+    def test_uploads_are_stored_once_per_content(self):
+        content = PNG + os.urandom(200_000)
+        _, submit = self.schedule(content)
+        _, submit_again = self.schedule(content)
+
+        media = MediaFile.objects.get()
+        self.assertEqual(media.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(media.file.name, f'uploads/{media.sha256[:2]}/{media.sha256}.png')
+        with media.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(list(DiscordMessageSchedule.objects.values_list('media', flat=True)), [media.pk] * 2)
+        submit.assert_called_once_with(media.pk)  # thumbnailed once, after commit
+        submit_again.assert_not_called()
+
+    def test_only_images_and_videos_are_accepted(self):
+        data, _ = self.schedule(b'MZ', content_type='application/x-msdownload')
+        self.assertEqual(data, {'success': False, 'error': 'Only images and videos can be attached.'})
+        self.assertFalse(DiscordMessageSchedule.objects.exists())
+
+    def test_type_is_judged_from_the_content(self):
+        data, _ = self.schedule(b'MZ' + os.urandom(100), content_type='image/png')
+        self.assertEqual(data, {'success': False, 'error': 'Only images and videos can be attached.'})
+
+        self.schedule(b'GIF89a' + os.urandom(100), content_type='application/octet-stream')
+        media = MediaFile.objects.get()
+        self.assertEqual((media.kind, media.content_type), (MediaFile.IMAGE, 'image/gif'))
+
+    def test_oversized_uploads_are_cut_off(self):
+        with override_settings(MEDIA_MAX_UPLOAD_SIZE=1024 * 1024), \
+                mock.patch('dashboard.media.HashingUploadHandler.file_complete') as file_complete:
+            data, _ = self.schedule(PNG + os.urandom(1024 * 1024))
+        self.assertEqual(data, {'success': False, 'error': 'Attachments are limited to 1 MB.'})
+        file_complete.assert_not_called()
+        self.assertFalse(DiscordMessageSchedule.objects.exists())
+
+    def test_thumbnail_unavailable_without_ffmpeg(self):
+        content = b'\x00\x00\x00\x18ftypmp42' + b'not really a video'
+        media = store_upload(SimpleUploadedFile('clip.mp4', content, content_type='video/mp4'))
+        Thumbnailer(ffmpeg='/nonexistent/ffmpeg')._run(media.pk)
+        media.refresh_from_db()
+        self.assertEqual((media.thumbnail_status, media.thumbnail.name), (MediaFile.THUMBNAIL_UNAVAILABLE, ''))
+
+    def test_discord_job_sends_attachment_as_multipart(self):
+        data, _ = self.schedule(PNG)
+        msg = DiscordMessageSchedule.objects.select_related('media').get()
+        session = mock.Mock()
+        session.request.return_value = mock.Mock(status_code=200, headers={})
+        client = DiscordClient(session=session)
+        with mock.patch('dashboard.scheduler.discord_client', client):
+            DiscordMessageJob().send(msg)
+        kwargs = session.request.call_args.kwargs
+        filename, f, content_type = kwargs['files']['files[0]']
+        self.assertEqual((filename, content_type), (f'{msg.media.sha256}.png', 'image/png'))
+        self.assertEqual(json.loads(kwargs['data']['payload_json']), {
+            'content': 'look', 'attachments': [{'id': 0, 'filename': filename}],
+        })
+
+
+class FakeMediaResponse:
+    def __init__(self, status_code, body=b'', headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def close(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+
+class MediaProxyTests(SimpleTestCase):
+    url = 'https://cdn.discordapp.com/avatars/1/a.png'
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.clock = FakeClock()
+        self.session = mock.Mock()
+        self.proxy = MediaProxy(root.name, ['cdn.discordapp.com'], max_bytes=250, max_file_size=200, ttl=60,
+                                session=self.session, clock=self.clock)
+
+    def image(self, body=b'x' * 100, **headers):
+        return FakeMediaResponse(200, body, {'Content-Type': 'image/png', **headers})
+
+    def test_cached_file_is_revalidated_once_stale(self):
+        self.session.get.return_value = self.image(ETag='"v1"')
+        entry = self.proxy.get(self.url)
+        self.assertEqual(self.proxy.get(self.url), entry)
+        self.assertEqual(self.session.get.call_count, 1)
+
+        self.clock.now = 61
+        self.session.get.return_value = FakeMediaResponse(304)
+        self.assertEqual(self.proxy.get(self.url), entry)
+        self.assertEqual(self.session.get.call_args.kwargs['headers'], {'If-None-Match': '"v1"'})
+        self.assertEqual(self.proxy.get(self.url), entry)  # renewed
+        self.assertEqual(self.session.get.call_count, 2)
+
+        self.clock.now = 200
+        self.session.get.side_effect = requests.ConnectionError('down')
+        with self.assertLogs('dashboard.media_proxy', 'WARNING'):
+            self.assertEqual(self.proxy.get(self.url), entry)  # stale beats nothing
+
+    def test_least_recently_used_files_are_evicted(self):
+        self.session.get.side_effect = lambda url, **kwargs: self.image()
+        first = self.proxy.get(self.url + '?1')
+        second = self.proxy.get(self.url + '?2')
+        self.proxy.get(self.url + '?1')
+        self.proxy.get(self.url + '?3')
+        self.assertEqual(len(self.proxy), 2)
+        self.assertTrue(os.path.exists(first.path))
+        self.assertFalse(os.path.exists(second.path))
+
+    def test_large_files_and_non_media_are_not_cached(self):
+        self.session.get.return_value = self.image(b'x' * 201)
+        with self.assertRaises(TooLarge):
+            self.proxy.get(self.url)
+        with self.assertRaises(TooLarge):
+            self.proxy.get(self.url)  # remembered, not fetched again
+        self.assertEqual(self.session.get.call_count, 1)
+        self.session.get.return_value = FakeMediaResponse(200, b'<html>', {'Content-Type': 'text/html'})
+        with self.assertRaises(ProxyError):
+            self.proxy.get(self.url + '?page')
+
+    def test_redirects_are_only_followed_to_allowed_hosts(self):
+        self.session.get.side_effect = lambda url, **kwargs: {
+            self.url: FakeMediaResponse(302, headers={'Location': '/avatars/1/b.png'}),
+            'https://cdn.discordapp.com/avatars/1/b.png': self.image(),
+        }[url]
+        with open(self.proxy.get(self.url).path, 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 100)
+        self.assertFalse(self.session.get.call_args.kwargs['allow_redirects'])
+
+        self.session.get.side_effect = lambda url, **kwargs: FakeMediaResponse(
+            302, headers={'Location': 'http://169.254.169.254/latest/meta-data'})
+        with self.assertRaisesMessage(ProxyError, 'cdn.discordapp.com redirected to 169.254.169.254'):
+            self.proxy.get(self.url + '?internal')
+        self.assertEqual(self.session.get.call_count, 3)
+
+    def test_view_only_serves_signed_urls(self):
+        self.session.get.return_value = self.image(ETag='"v1"')
+        with mock.patch.object(views, 'media_proxy', self.proxy), \
+                mock.patch('dashboard.media_proxy.media_proxy', self.proxy):
+            url = proxy_url(self.url)
+            self.assertTrue(url.startswith('/api/media/proxy/?'))
+            self.assertEqual(proxy_url('https://example.com/a.png'), 'https://example.com/a.png')
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), b'x' * 100)
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(again.status_code, 304)
+            forged = self.client.get(url.replace('a.png', 'b.png'))
+            self.assertEqual(forged.status_code, 403)
+
+
+class BulkScheduleTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('heidi', password='secret')
+        UserProfile.objects.create(user=self.user, discord_bot_token='token', discord_channel_id='42')
+
+    def test_command_imports_valid_csv_rows_in_batches(self):
+        rows = (
+            'type,scheduled_time,title,content,url,message,channel_id\n'
+            'reddit,2030-01-01T10:00:00,Hello,Body,,,\n'
+            'discord,2030-01-01T10:00:00+00:00,,,,hi,\n'
+            'discord,2030-01-01T10:00:00,,,,"multi\nline",43\n'
+            'reddit,not a date,Hello,Body,,,\n'
+            'reddit,2030-01-01T10:00:00,No body,,,,\n'
+            'discord,2030-01-01T10:00:00,,,,hi,general\n'
+        )
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(rows)
+        self.addCleanup(os.remove, f.name)
+        stderr = io.StringIO()
+        call_command('import_schedules', f.name, user='heidi', batch_size=2, stdout=io.StringIO(), stderr=stderr)
+
+        self.assertEqual(RedditPostSchedule.objects.get().title, 'Hello')
+        self.assertEqual(
+            list(DiscordMessageSchedule.objects.order_by('pk').values_list('channel_id', 'message')),
+            [('42', 'hi'), ('43', 'multi\nline')],
+        )
+        self.assertEqual(stderr.getvalue().splitlines(), [
+            'Line 6: scheduled_time is not an ISO 8601 date and time',
+            'Line 7: content or url is required',
+            'Line 8: channel_id is required and must be a Discord channel ID',
+        ])
+
+    def test_endpoint_imports_jsonl_upload(self):
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile('campaign.jsonl', b''.join(
+            json.dumps({'scheduled_time': '2030-01-01T10:00:00', 'message': f'm{i}'}).encode() + b'\n'
+            for i in range(5)
+        ) + b'not json\n')
+        with mock.patch.object(views.schedule_engine, 'resync') as resync:
+            data = self.client.post(reverse('bulk_schedule'), {'file': upload, 'type': 'discord'}).json()
+        self.assertEqual(data['created'], {'reddit': 0, 'discord': 5})
+        self.assertEqual(data['errors'], [{'line': 6, 'error': 'Invalid JSON object'}])
+        resync.assert_called_once_with()
+
+
+@mock.patch.object(views, 'HISTORY_PAGE_SIZE', 3)
+class MessageArchiveTests(TestCase):
+    def setUp(self):
+        views.discord_message_cache.clear()
+        self.writer = archive.ArchiveWriter(batch_size=2)
+        patcher = mock.patch.object(archive, 'archive_writer', self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = User.objects.create_user('gina', password='secret')
+        UserProfile.objects.create(user=user, discord_bot_token='token', discord_channel_id='42',
+                                   reddit_client_id='id', reddit_subreddit='Python')
+        self.client.force_login(user)
+
+    def test_writer_upserts_without_losing_links(self):
+        self.writer.add(archive.discord_rows('42', [discord_message(i) for i in (1, 2)], limit=10))
+        self.writer.flush()
+        edited = dict(discord_message(2), content='edited')
+        self.writer.add(archive.discord_rows('42', [edited], limit=1))
+        self.writer.flush()
+        self.assertEqual(
+            list(ArchivedDiscordMessage.objects.order_by('pk').values_list('pk', 'prev_id', 'content')),
+            [(1, 0, 'message 1'), (2, 1, 'edited')],
+        )
+
+    def test_discord_history_fills_gaps_from_upstream(self):
+        self.writer.add(archive.discord_rows('42', [discord_message(i) for i in (3, 4, 5)]))
+        self.writer.flush()
+        views.discord_message_cache.set(('42', 'token'), [discord_message(5)])
+        url = reverse('fetch_discord_history')
+        with mock.patch.object(views.discord_client, 'session') as session:
+            session.request.return_value = discord_response([discord_message(2)])
+            data = self.client.get(url, {'before': '5'}).json()
+            self.assertEqual(session.request.call_args.kwargs['params'], {'limit': 3, 'before': 3})
+            self.writer.flush()
+            session.request.reset_mock()
+            self.assertEqual(self.client.get(url, {'before': '5'}).json(), data)
+            session.request.assert_not_called()
+        self.assertEqual([msg['id'] for msg in data['messages']], ['2', '3', '4'])
+        # A short page from Discord means 2 is the channel's first message.
+        self.assertEqual((data['before'], data['more']), ('2', False))
+
+    def test_reddit_history_follows_new_listing(self):
+        reddit = mock.Mock()
+        reddit.request.side_effect = [
+            reddit_listing([reddit_post('a', created_utc=3.0), reddit_post('b', created_utc=2.0),
+                            reddit_post('c', created_utc=1.0)]),
+            reddit_listing([reddit_post('d', created_utc=0.5)]),
+        ]
+        url = reverse('fetch_reddit_history')
+        with mock.patch('dashboard.views.get_reddit', return_value=reddit):
+            first = self.client.get(url).json()
+            self.writer.flush()
+            second = self.client.get(url, {'before': 'c'}).json()
+            self.writer.flush()
+            again = self.client.get(url, {'before': 'a'}).json()
+        self.assertEqual(reddit.request.call_args.kwargs['params'], {'limit': 3, 'after': 't3_c'})
+        self.assertEqual(([post['id'] for post in first['posts']], first['more']), (['a', 'b', 'c'], True))
+        self.assertEqual(([post['id'] for post in second['posts']], second['more']), (['d'], False))
+        self.assertEqual(([post['id'] for post in again['posts']], again['more']), (['b', 'c', 'd'], False))
+        self.assertEqual(ArchivedRedditPost.objects.get(pk='c').prev_id, 'd')
+
+
+@mock.patch.object(views, 'SEARCH_PAGE_SIZE', 2)
+class SearchTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('hana', password='secret')
+        UserProfile.objects.create(user=user, discord_bot_token='token', discord_channel_id='42',
+                                   reddit_client_id='id', reddit_subreddit='Python')
+        self.client.force_login(user)
+        views.discord_message_cache.set(('42', 'token'), [])
+        writer = archive.ArchiveWriter()
+        messages = [dict(discord_message(i), content=text) for i, text in
+                    enumerate(['deploy failed again', 'lunch?', 'the deploy is done'], start=1)]
+        writer.add(archive.discord_rows('42', messages))
+        writer.add(archive.discord_rows('99', [dict(discord_message(9), content='secret deploy')]))
+        listing = reddit_listing([
+            reddit_post('a', title='Deployment checklist', selftext='before you deploy'),
+            reddit_post('b', title='Packaging', selftext='x' * SELFTEXT_PREVIEW + ' nothing to see'),
+        ])['data']
+        writer.add(archive.reddit_rows('python', posts_from_listing(listing), listing))
+        writer.flush()
+        self.url = reverse('search_archive')
+
+    def ids(self, data):
+        return [result.get('message', result.get('post'))['id'] for result in data['results']]
+
+    def test_ranked_prefix_search_over_own_sources(self):
+        first = self.client.get(self.url, {'q': 'depl'}).json()
+        second = self.client.get(self.url, {'q': 'depl', 'page': 2}).json()
+        self.assertTrue(first['more'])
+        self.assertFalse(second['more'])
+        self.assertEqual(sorted(self.ids(first) + self.ids(second)), ['1', '3', 'a'])
+        self.assertEqual(self.ids(self.client.get(self.url, {'q': 'deploy "checklist'}).json()), ['a'])
+
+    def test_long_self_posts_are_searched_in_full(self):
+        data = self.client.get(self.url, {'q': 'nothing'}).json()
+        self.assertEqual(self.ids(data), ['b'])
+        self.assertTrue(data['results'][0]['post']['selftext_truncated'])
+        with mock.patch.object(search, '_has_index', return_value=False):
+            self.assertEqual(self.ids(self.client.get(self.url, {'q': 'nothing'}).json()), ['b'])
+
+    def test_index_follows_edits(self):
+        writer = archive.ArchiveWriter()
+        writer.add(archive.discord_rows('42', [dict(discord_message(2), content='lunch deploy?')]))
+        writer.flush()
+        data = self.client.get(self.url, {'q': 'lunch'}).json()
+        self.assertEqual(data['results'][0]['message']['content'], 'lunch deploy?')
+        self.assertEqual(self.client.get(self.url, {'q': 'deploy lunch'}).json()['results'], data['results'])
+
+    def test_substring_fallback(self):
+        with mock.patch.object(search, '_has_index', return_value=False):
+            data = self.client.get(self.url, {'q': 'deploy', 'page': 1}).json()
+        self.assertEqual(self.ids(data), ['3', '1'])
+        self.assertTrue(data['more'])
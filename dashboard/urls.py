@@ -1,17 +1,41 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Under ASGI the endpoints that wait on Discord/Reddit are served by async views.
+if settings.DASHBOARD_ASGI:
+    from . import async_views as upstream_views
+else:
+    upstream_views = views
+
 urlpatterns = [
     path('', views.dashboard, name='dashboard'),
     path('register/', views.register_view, name='register'),
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
 
-    path('api/discord/messages/', views.fetch_discord_messages, name='fetch_discord_messages'),
+    path('api/feed/', upstream_views.fetch_feed, name='fetch_feed'),
+
+    path('api/discord/messages/', upstream_views.fetch_discord_messages, name='fetch_discord_messages'),
+    path('api/discord/stream/', views.stream_discord_messages, name='stream_discord_messages'),
+    # Sends only queue the message, so they never wait on Discord.
     path('api/discord/send_message/', views.send_discord_message, name='send_discord_message'),
+    path('api/discord/send_message/status/', views.discord_message_status, name='discord_message_status'),
     path('schedule_discord_message/', views.schedule_discord_message, name='schedule_discord_message'),
+    # History is mostly read from the local archive, so it stays sync.
+    path('api/discord/history/', views.fetch_discord_history, name='fetch_discord_history'),
 
-    path('api/reddit/posts/', views.fetch_reddit_posts, name='fetch_reddit_posts'),
+    path('api/reddit/posts/', upstream_views.fetch_reddit_posts, name='fetch_reddit_posts'),
+    path('api/reddit/posts/<str:post_id>/selftext/', upstream_views.fetch_reddit_selftext,
+         name='fetch_reddit_selftext'),
+    path('api/reddit/history/', views.fetch_reddit_history, name='fetch_reddit_history'),
+    path('api/search/', views.search_archive, name='search_archive'),
     path('api/reddit/post/', views.post_to_reddit, name='post_to_reddit'),
     path('api/reddit/schedule_post/', views.schedule_reddit_post, name='schedule_reddit_post'),
+
+    path('api/schedule/bulk/', views.bulk_schedule, name='bulk_schedule'),
+
+    path('api/media/proxy/', views.proxy_media, name='media_proxy'),
+
+    path('metrics', views.metrics_view, name='metrics'),
 ]
@@ -1,21 +1,44 @@
 from django.shortcuts import render, redirect
-import threading
-import time
+import asyncio
+import codecs
+import hmac
+import json
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
+from urllib.parse import urlsplit
 
-import praw
 import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from django.utils.timezone import make_aware, is_naive, timezone
+from django.http import (
+    FileResponse, HttpResponse, HttpResponseNotModified, HttpResponseRedirect, JsonResponse, StreamingHttpResponse,
+)
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.timezone import make_aware, is_naive
 from django.utils.dateparse import parse_datetime
 from django.utils.timesince import timesince
-from prawcore.exceptions import NotFound
+from praw.exceptions import PRAWException
+from prawcore.exceptions import NotFound, PrawcoreException
 
+from . import archive, bulk, metrics, search
+from .archive import archive_writer
+from .cache import TTLCache
+from .discord_api import RateLimited, discord_client
 from .forms import RegistrationForm, LoginForm, UserProfileForm, RedditPostForm
-from .models import UserProfile, RedditPostSchedule, DiscordMessageSchedule
+from .media import InvalidMedia, hashing_uploads, store_upload, uploaded_media
+from .media_proxy import ProxyError, TooLarge, media_proxy, proxy_url, signature
+from .models import UserProfile, RedditPostSchedule, DiscordMessageSchedule, Source
+from .prefetch import prefetcher
+from .reddit_posts import posts_from_listing
+from .profiles import aget_profile, get_profile
+from .reddit_clients import get_reddit
+from .scheduler import schedule_engine
+from .sources import get_sources, normalize
+from .streams import ChannelHub, create_source
 
 # ----- User Registration -----
 def register_view(request):
@@ -79,6 +102,7 @@ def dashboard(request):
             user_profile = form.save(commit=False)
             user_profile.user = request.user
             user_profile.save()
+            form.save_subscriptions(request.user.pk)
             messages.success(request, "API settings saved successfully.")
             return redirect('dashboard')
     else:
@@ -87,140 +111,544 @@ def dashboard(request):
     context = {
         'form': form,
         'profile_complete': profile_complete,
-        'profile': profile
+        'profile': profile,
+        'discord_streaming': settings.DISCORD_STREAMING,
     }
 
     return render(request, 'dashboard/dashboard.html', context)
 
 # ----- Discord API fetch messages -----
+# Shared by every tab and user polling the same channel, keyed by
+# (channel_id, bot_token) so a bot only ever sees what it can read itself.
+discord_message_cache = TTLCache(
+    ttl=getattr(settings, 'DISCORD_MESSAGE_CACHE_TTL', 5),
+    max_entries=getattr(settings, 'DISCORD_MESSAGE_CACHE_SIZE', 1024),
+    name='discord_messages',
+)
+
+DISCORD_MESSAGE_WINDOW = 10
+
+def _get_channel_messages(bot_token, channel_id, after=None, before=None, limit=DISCORD_MESSAGE_WINDOW):
+    try:
+        response = discord_client.get_messages(
+            bot_token, channel_id, limit=limit, after=after, before=before
+        )
+    except (requests.RequestException, RateLimited):
+        return None
+    if response.status_code != 200:
+        return None
+    # Discord's ordering differs between plain and `after=` queries.
+    messages = sorted(response.json(), key=lambda msg: int(msg["id"]))
+    archive_writer.add(archive.discord_rows(channel_id, messages, after=after, limit=limit))
+    return messages
+
+def _refresh_channel_window(bot_token, channel_id, window):
+    """
+    Return the newest DISCORD_MESSAGE_WINDOW messages of a channel, oldest
+    first. When a previous window is cached only messages after its newest
+    snowflake are requested, which is an empty response for idle channels.
+    """
+    if not window:
+        return _get_channel_messages(bot_token, channel_id)
+    new = _get_channel_messages(bot_token, channel_id, after=window[-1]["id"])
+    if new is None:
+        return None
+    if len(new) >= DISCORD_MESSAGE_WINDOW:
+        # There may be a gap between the old window and this page.
+        return _get_channel_messages(bot_token, channel_id)
+    return (window + new)[-DISCORD_MESSAGE_WINDOW:]
+
+def _channel_refresher(bot_token, channel_id):
+    return lambda stale: _refresh_channel_window(bot_token, channel_id, stale)
+
+# Avatars are shown at 32px; fetched at 64 for high-DPI screens.
+AVATAR_SIZE = 64
+
+def _serialize_discord_message(msg):
+    return {
+        "id": msg["id"],
+        "content": msg["content"],
+        "author": msg["author"]["username"],
+        "avatar_url": proxy_url(f"https://cdn.discordapp.com/avatars/{msg['author']['id']}/{msg['author'].get('avatar', '')}.png" if msg['author'].get('avatar') else "https://cdn.discordapp.com/embed/avatars/0.png", AVATAR_SIZE),
+        "timestamp": msg["timestamp"],
+        "timestamp_pretty": timesince(parse_datetime(msg["timestamp"])) + " ago" if msg.get("timestamp") else "",
+    }
+
 @login_required
 def fetch_discord_messages(request):
+    """
+    Return the channel's recent messages, oldest first.
+
+    With ``?after=<snowflake>`` only newer messages are returned; ``reset`` is
+    set when the cursor fell out of the cached window and the client should
+    replace what it shows. The response ETag is the newest snowflake, and a
+    304 is returned when the client already has it.
+    """
+    after = request.GET.get('after')
+    if after and not after.isdigit():
+        return JsonResponse({"success": False, "error": "Invalid cursor."})
     try:
-        profile = UserProfile.objects.get(user=request.user)
-        headers = {
-            "Authorization": f"Bot {profile.discord_bot_token}"
-        }
-        response = requests.get(
-            f"https://discord.com/api/v10/channels/{profile.discord_channel_id}/messages?limit=10",
-            headers=headers
+        profile = get_profile(request.user)
+        channel_id = _requested_source(request, profile, Source.DISCORD, get_sources(profile.user_id))
+        if channel_id is None:
+            return JsonResponse({"success": False, "error": "Not subscribed to this channel."})
+        window = prefetcher.get(
+            discord_message_cache, (channel_id, profile.discord_bot_token),
+            _channel_refresher(profile.discord_bot_token, channel_id),
         )
-        if response.status_code == 200:
-            data = response.json()
-            messages_list = [
-                {
-                    "content": msg["content"],
-                    "author": msg["author"]["username"],
-                    "avatar_url": f"https://cdn.discordapp.com/avatars/{msg['author']['id']}/{msg['author'].get('avatar', '')}.png" if msg['author'].get('avatar') else "https://cdn.discordapp.com/embed/avatars/0.png",
-                    "timestamp": msg["timestamp"],
-                    "timestamp_pretty": timesince(parse_datetime(msg["timestamp"])) + " ago" if msg.get("timestamp") else "",
-                }
-                for msg in reversed(data)  # oldest first
-            ]
-            return JsonResponse({"success": True, "messages": messages_list})
-        else:
-            return JsonResponse({"success": False, "error": "Failed to fetch messages."})
+        return _discord_messages_response(request, window, after)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({"success": False, "error": "Profile not found."})
+
+def _requested_source(request, profile, kind, sources):
+    """
+    The channel (``?channel=``) or subreddit (``?subreddit=``) asked for,
+    defaulting to the profile's own. None unless it is in the user's
+    ``sources``.
+    """
+    if kind == Source.DISCORD:
+        name = request.GET.get('channel') or profile.discord_channel_id
+    else:
+        name = request.GET.get('subreddit') or profile.reddit_subreddit
+    name = normalize(kind, name)
+    if (kind, name) not in sources:
+        return None
+    return name
+
+def _discord_messages_response(request, window, after):
+    if window is None:
+        return JsonResponse({"success": False, "error": "Failed to fetch messages."})
+
+    cursor = window[-1]["id"] if window else after
+    etag = f'"{cursor or 0}"'
+    if request.headers.get('If-None-Match') == etag or (after and after == cursor):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    reset = False
+    new_messages = window
+    if after:
+        new_messages = [msg for msg in window if int(msg["id"]) > int(after)]
+        reset = len(new_messages) == len(window) == DISCORD_MESSAGE_WINDOW
+    response = JsonResponse({
+        "success": True,
+        "messages": [_serialize_discord_message(msg) for msg in new_messages],
+        "cursor": cursor,
+        "reset": reset,
+    })
+    response['ETag'] = etag
+    return response
+
+# ----- Discord message stream (Server-Sent Events, ASGI only) -----
+_discord_stream_hub = None
+
+def _get_discord_stream_hub():
+    global _discord_stream_hub
+    if _discord_stream_hub is None:
+        source = create_source(
+            getattr(settings, 'DISCORD_STREAM_SOURCE', 'polling'),
+            _poll_channel_window,
+            poll_interval=getattr(settings, 'DISCORD_STREAM_POLL_INTERVAL', 1),
+        )
+        _discord_stream_hub = ChannelHub(source)
+    return _discord_stream_hub
+
+def _poll_channel_window(channel_id, bot_token):
+    # Used by the polling stream source. Reads go through the shared cache,
+    # so Discord is asked at most once per DISCORD_MESSAGE_CACHE_TTL however
+    # many streams and polling browsers watch the channel.
+    return prefetcher.get(discord_message_cache, (channel_id, bot_token), _channel_refresher(bot_token, channel_id))
+
+def _sse_event(msg):
+    return f"id: {msg['id']}\nevent: message\ndata: {json.dumps(_serialize_discord_message(msg))}\n\n"
+
+async def _discord_event_stream(channel_id, bot_token, after):
+    watcher, queue = _get_discord_stream_hub().subscribe(channel_id, bot_token)
+    heartbeat = getattr(settings, 'DISCORD_STREAM_HEARTBEAT', 15)
+    try:
+        yield "retry: 2000\n\n"
+        # Catch up from the shared window, then follow the watcher.
+        last_id = int(after or 0)
+        window = await sync_to_async(_poll_channel_window, thread_sensitive=False)(channel_id, bot_token)
+        for msg in window or ():
+            if int(msg["id"]) > last_id:
+                last_id = int(msg["id"])
+                yield _sse_event(msg)
+        while True:
+            try:
+                msg = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if msg is None:
+                break
+            if int(msg["id"]) > last_id:
+                last_id = int(msg["id"])
+                yield _sse_event(msg)
+    finally:
+        watcher.unsubscribe(queue)
+
+@login_required
+async def stream_discord_messages(request):
+    """
+    Push new channel messages to the browser as Server-Sent Events. A
+    reconnecting EventSource resumes from its Last-Event-ID.
+    """
+    if not settings.DISCORD_STREAMING:
+        return JsonResponse({"success": False, "error": "Streaming is only available under ASGI."})
+    after = request.headers.get('Last-Event-ID') or request.GET.get('after')
+    if after and not after.isdigit():
+        return JsonResponse({"success": False, "error": "Invalid cursor."})
+    user = await request.auser()
+    try:
+        profile = await aget_profile(user)
     except UserProfile.DoesNotExist:
         return JsonResponse({"success": False, "error": "Profile not found."})
+    return StreamingHttpResponse(
+        _discord_event_stream(profile.discord_channel_id, profile.discord_bot_token, after),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
 
 # ----- Discord API send message -----
+# Messages are queued in the outbox (DiscordMessageSchedule, due now) and
+# sent by the scheduler, so the request doesn't wait on Discord and a slow
+# or failing Discord doesn't lose the message. The page polls
+# discord_message_status to show delivery.
 @login_required
+@hashing_uploads
 def send_discord_message(request):
     if request.method == "POST":
         try:
-            profile = UserProfile.objects.get(user=request.user)
+            upload = uploaded_media(request)
+            profile = get_profile(request.user)
             # Accept both 'message' and 'content' keys
             message = request.POST.get('message')
             if message is None:
                 message = request.POST.get('content')
             if message is not None:
                 message = message.strip()
-            if not message:
+            if not (message or upload):
                 return JsonResponse({"success": False, "error": "Empty message"})
+            if not profile.discord_bot_token or not profile.discord_channel_id:
+                return JsonResponse({"success": False, "error": "Discord is not configured."})
 
-            headers = {
-                "Authorization": f"Bot {profile.discord_bot_token}",
-                "Content-Type": "application/json"
-            }
-            payload = {"content": message}
-            response = requests.post(
-                f"https://discord.com/api/v10/channels/{profile.discord_channel_id}/messages",
-                json=payload,
-                headers=headers
+            queued = DiscordMessageSchedule.objects.create(
+                user=request.user,
+                channel_id=profile.discord_channel_id,
+                message=message or '',
+                media=store_upload(upload) if upload else None,
+                scheduled_time=timezone.now(),
             )
-            if response.status_code in [200, 201, 204]:
-                return JsonResponse({"success": True})
-            else:
-                return JsonResponse({"success": False, "error": "Failed to send message."})
+            schedule_engine.notify('discord', queued.pk, queued.scheduled_time)
+            return JsonResponse({"success": True, "id": queued.pk, "status": queued.status})
         except UserProfile.DoesNotExist:
             return JsonResponse({"success": False, "error": "Profile not found."})
+        except InvalidMedia as e:
+            return JsonResponse({"success": False, "error": str(e)})
     return JsonResponse({"success": False, "error": "Invalid request method"})
 
+@login_required
+def discord_message_status(request):
+    ids = [i for i in request.GET.get('ids', '').split(',') if i.isdigit()]
+    if not ids:
+        return JsonResponse({"success": False, "error": "No message ids."})
+    queued = DiscordMessageSchedule.objects.filter(user=request.user, pk__in=ids[:100])
+    return JsonResponse({"success": True, "messages": [
+        {"id": msg.pk, "status": msg.status, "attempts": msg.attempts, "error": msg.last_error}
+        for msg in queued
+    ]})
+
 # ----- Reddit fetch posts -----
+REDDIT_PAGE_SIZE = 10
+
+REDDIT_ERRORS = (PrawcoreException, PRAWException)
+
+# Pages of a subreddit's hot listing keyed by (subreddit, after). Every
+# client is an app-only (read-only) PRAW client, so listings are public and
+# can be shared between users.
+reddit_listing_cache = TTLCache(
+    ttl=getattr(settings, 'REDDIT_LISTING_CACHE_TTL', 30),
+    max_entries=getattr(settings, 'REDDIT_LISTING_CACHE_SIZE', 1024),
+    name='reddit_listings',
+)
+
+def _get_hot_page(reddit, subreddit_name, after):
+    """Fetch one page of a hot listing, passing the cursor through to Reddit."""
+    params = {'limit': REDDIT_PAGE_SIZE}
+    if after:
+        params['after'] = after
+    # Raw JSON rather than PRAW Submissions; see reddit_posts.py.
+    listing = reddit.request(method='GET', path=f'/r/{subreddit_name}/hot', params=params)
+    page = _hot_page_from_listing(listing['data'])
+    archive_writer.add(archive.reddit_rows(subreddit_name, page['posts'], listing['data']))
+    return page
+
+def _hot_page_refresher(profile, subreddit_name):
+    # The client is looked up on each refresh; the pool closes idle ones.
+    return lambda stale: _get_hot_page(get_reddit(profile), subreddit_name, None)
+
+def _hot_page_from_listing(listing):
+    """Build a page of RedditPost records from a raw listing's ``data``."""
+    posts = posts_from_listing(listing)
+    # If less than a full page, there is nothing after it
+    next_after = posts[-1].name if len(posts) == REDDIT_PAGE_SIZE else None
+    return {'posts': posts, 'after': next_after}
+
 @login_required
 def fetch_reddit_posts(request):
     try:
-        profile = UserProfile.objects.get(user=request.user)
+        profile = get_profile(request.user)
     except UserProfile.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Reddit profile not found'})
 
-    reddit = praw.Reddit(
-        client_id=profile.reddit_client_id,
-        client_secret=profile.reddit_client_secret,
-        user_agent=profile.reddit_user_agent,
+    subreddit = _requested_source(request, profile, Source.REDDIT, get_sources(profile.user_id))
+    if subreddit is None:
+        return JsonResponse({'success': False, 'error': 'Not subscribed to this subreddit'})
+    after = request.GET.get('after') or None
+    try:
+        if after is None:
+            # First pages are what users poll, so they are kept warm.
+            page = prefetcher.get(reddit_listing_cache, (subreddit, None), _hot_page_refresher(profile, subreddit))
+        else:
+            reddit = get_reddit(profile)
+            page = reddit_listing_cache.get_or_fetch(
+                (subreddit, after), lambda: _get_hot_page(reddit, subreddit, after),
+            )
+    except REDDIT_ERRORS:
+        return JsonResponse({'success': False, 'error': 'Failed to fetch Reddit posts'})
+
+    return JsonResponse({'success': True, 'posts': [post.as_dict() for post in page['posts']], 'after': page['after']})
+
+# ----- History (served from the local archive, see archive.py) -----
+HISTORY_PAGE_SIZE = getattr(settings, 'HISTORY_PAGE_SIZE', 50)
+
+@login_required
+def fetch_discord_history(request):
+    """
+    The channel's messages older than ``?before=<snowflake>``, oldest first.
+    ``before`` is the oldest message in the response and ``more`` is false
+    once the start of the channel is reached.
+    """
+    before = request.GET.get('before', '')
+    if not before.isdigit():
+        return JsonResponse({"success": False, "error": "Invalid cursor."})
+    try:
+        profile = get_profile(request.user)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({"success": False, "error": "Profile not found."})
+    channel_id = _requested_source(request, profile, Source.DISCORD, get_sources(profile.user_id))
+    if channel_id is None:
+        return JsonResponse({"success": False, "error": "Not subscribed to this channel."})
+    token = profile.discord_bot_token
+    # Only bots that can read the channel now get to see its history; this
+    # is usually answered from the cache.
+    window = prefetcher.get(discord_message_cache, (channel_id, token), _channel_refresher(token, channel_id))
+    if window is None:
+        return JsonResponse({"success": False, "error": "Failed to fetch messages."})
+    history = archive.discord_history(
+        channel_id, before, HISTORY_PAGE_SIZE,
+        lambda cursor, limit: _get_channel_messages(token, channel_id, before=cursor, limit=limit),
     )
+    if history is None:
+        return JsonResponse({"success": False, "error": "Failed to fetch messages."})
+    messages, more = history
+    return JsonResponse({
+        "success": True,
+        "messages": [_serialize_discord_message(msg) for msg in messages],
+        "before": messages[0]["id"] if messages else before,
+        "more": more,
+    })
+
+def _get_new_page(reddit, subreddit_name, after, limit):
+    params = {'limit': limit}
+    if after:
+        params['after'] = f't3_{after}'
+    try:
+        listing = reddit.request(method='GET', path=f'/r/{subreddit_name}/new', params=params)
+    except REDDIT_ERRORS:
+        return None
+    return listing['data']
 
-    after = request.GET.get('after')
-    subreddit = reddit.subreddit(profile.reddit_subreddit)
-    posts = []
-    limit = 10
+@login_required
+def fetch_reddit_history(request):
+    """
+    The subreddit's posts, newest first, older than ``?before=<post id>`` if
+    given. ``before`` is the oldest post in the response and ``more`` is
+    false once there are no older posts.
+    """
+    before = request.GET.get('before') or None
+    if before is not None and not before.isalnum():
+        return JsonResponse({'success': False, 'error': 'Invalid cursor'})
+    try:
+        profile = get_profile(request.user)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Reddit profile not found'})
+    subreddit = _requested_source(request, profile, Source.REDDIT, get_sources(profile.user_id))
+    if subreddit is None:
+        return JsonResponse({'success': False, 'error': 'Not subscribed to this subreddit'})
+    reddit = get_reddit(profile)
+    history = archive.reddit_history(
+        subreddit, before, HISTORY_PAGE_SIZE,
+        lambda cursor, limit: _get_new_page(reddit, subreddit, cursor, limit),
+    )
+    if history is None:
+        return JsonResponse({'success': False, 'error': 'Failed to fetch Reddit posts'})
+    posts, more = history
+    return JsonResponse({
+        'success': True,
+        'posts': [post.as_dict() for post in posts],
+        'before': posts[-1].id if posts else before,
+        'more': more,
+    })
+
+# ----- Search (over the local archive, see search.py) -----
+SEARCH_PAGE_SIZE = getattr(settings, 'SEARCH_PAGE_SIZE', 20)
 
-    hot_posts = subreddit.hot(limit=100)  # Fetch more to allow skipping
+@login_required
+def search_archive(request):
+    """
+    Archived messages and posts from the user's channels and subreddits
+    matching ``?q=``, best match first, ``SEARCH_PAGE_SIZE`` per ``?page=``.
+    """
+    text = request.GET.get('q', '').strip()
+    page = request.GET.get('page', '1')
+    if not search.terms(text):
+        return JsonResponse({"success": False, "error": "Enter something to search for."})
+    if not page.isdigit() or int(page) < 1:
+        return JsonResponse({"success": False, "error": "Invalid page."})
+    page = int(page)
+    try:
+        profile = get_profile(request.user)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({"success": False, "error": "Profile not found."})
+    sources = [
+        (kind, name) for kind, name in get_sources(profile.user_id)
+        # As for history, only channels the user's bot can read now.
+        if kind != Source.DISCORD or prefetcher.get(
+            discord_message_cache, (name, profile.discord_bot_token),
+            _channel_refresher(profile.discord_bot_token, name),
+        ) is not None
+    ]
+    hits, more = search.search(sources, text, offset=(page - 1) * SEARCH_PAGE_SIZE, limit=SEARCH_PAGE_SIZE)
+    results = []
+    for kind, row in hits:
+        if kind == Source.DISCORD:
+            item = _serialize_discord_message(archive.message_from_row(row))
+            results.append({"kind": kind, "source": row.channel_id, "message": item})
+        else:
+            results.append({"kind": kind, "source": row.subreddit, "post": archive.post_from_row(row).as_dict()})
+    return JsonResponse({"success": True, "results": results, "page": page, "more": more})
 
-    found_after = after is None
-    count = 0
-    last_post_name = None
+# Full text of self posts, which listings only carry a preview of.
+reddit_selftext_cache = TTLCache(
+    ttl=getattr(settings, 'REDDIT_SELFTEXT_CACHE_TTL', 300),
+    max_entries=getattr(settings, 'REDDIT_LISTING_CACHE_SIZE', 1024),
+    name='reddit_selftext',
+)
 
-    for post in hot_posts:
-        if not found_after:
-            if post.name == after:
-                found_after = True
+def _selftext_from_listing(listing):
+    children = listing['children']
+    return children[0]['data'].get('selftext', '') if children else None
+
+@login_required
+def fetch_reddit_selftext(request, post_id):
+    if not post_id.isalnum():
+        return JsonResponse({'success': False, 'error': 'Invalid post ID'})
+    try:
+        profile = get_profile(request.user)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Reddit profile not found'})
+
+    reddit = get_reddit(profile)
+    try:
+        selftext = reddit_selftext_cache.get_or_fetch(post_id, lambda: _selftext_from_listing(
+            reddit.request(method='GET', path=f'/by_id/t3_{post_id}')['data']
+        ))
+    except REDDIT_ERRORS:
+        return JsonResponse({'success': False, 'error': 'Failed to fetch Reddit post'})
+    if selftext is None:
+        return JsonResponse({'success': False, 'error': 'Post not found'})
+    return JsonResponse({'success': True, 'selftext': selftext})
+
+# ----- Aggregated feed -----
+# Sources are fetched in parallel, so the feed takes as long as the slowest
+# one rather than the sum of them; one that takes longer than FEED_TIMEOUT
+# is reported as failed instead of holding up the rest.
+FEED_TIMEOUT = getattr(settings, 'FEED_TIMEOUT', 10)
+
+feed_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'FEED_MAX_WORKERS', 32), thread_name_prefix='feed',
+)
+
+def _feed_sources(profile, sources):
+    """
+    The user's ``sources`` that the profile has credentials to fetch, the
+    profile's own channel and subreddit first.
+    """
+    own = {(Source.DISCORD, normalize(Source.DISCORD, profile.discord_channel_id)),
+           (Source.REDDIT, normalize(Source.REDDIT, profile.reddit_subreddit))}
+    sources = [(kind, name) for kind, name in sources if kind == Source.REDDIT or profile.discord_bot_token]
+    return sorted(sources, key=lambda source: source not in own)
+
+def _fetch_feed_source(profile, kind, name):
+    """Return a channel's message window or a subreddit's first hot page, or None."""
+    if kind == 'discord':
+        token = profile.discord_bot_token
+        return prefetcher.get(discord_message_cache, (name, token), _channel_refresher(token, name))
+    try:
+        return prefetcher.get(reddit_listing_cache, (name, None), _hot_page_refresher(profile, name))
+    except REDDIT_ERRORS:
+        return None
+
+def _feed_response(results):
+    """
+    Merge ``(kind, name, window or page)`` results into one timeline, newest
+    first. Reddit items keep their ``rank`` in the hot listing. ``sources``
+    carries each source's cursor for follow-up requests to
+    fetch_discord_messages and fetch_reddit_posts.
+    """
+    items = []
+    sources = []
+    for kind, name, result in results:
+        source = {'type': kind, 'source': name, 'success': result is not None}
+        sources.append(source)
+        if result is None:
             continue
-        if count >= limit:
-            break
-        media_type = "text"
-        media_url = ""
-        # --- Check for Reddit-hosted video
-        if hasattr(post, 'media') and post.media and 'reddit_video' in post.media:
-            media_type = "video"
-            media_url = post.media['reddit_video']['fallback_url']
-        # --- Check for image
-        elif hasattr(post, 'preview') and 'images' in post.preview:
-            media_type = "image"
-            media_url = post.preview['images'][0]['source']['url'].replace("&amp;", "&")
-        # --- Check if it's just a direct image link (like imgur or i.redd.it)
-        elif post.url.endswith(('.jpg', '.jpeg', '.png', '.gif')):
-            media_type = "image"
-            media_url = post.url
-
-        posts.append({
-            'id': post.id,
-            'title': post.title,
-            'author': str(post.author),
-            'score': post.score,
-            'url': post.url,
-            'selftext': post.selftext,
-            'media_type': media_type,
-            'media_url': media_url,
-            'permalink': post.permalink,
-            'num_comments': post.num_comments
-        })
-        last_post_name = post.name  # fullname, e.g., t3_xxxxx
-        count += 1
-
-    # If less than limit posts, no more after
-    next_after = last_post_name if count == limit else None
-
-    return JsonResponse({'success': True, 'posts': posts, 'after': next_after})
+        if kind == 'discord':
+            source['cursor'] = result[-1]["id"] if result else None
+            items.extend(
+                {'type': kind, 'source': name, 'timestamp': parse_datetime(msg["timestamp"]).timestamp(),
+                 'data': _serialize_discord_message(msg)}
+                for msg in result
+            )
+        else:
+            source['after'] = result['after']
+            items.extend(
+                {'type': kind, 'source': name, 'timestamp': post.created_utc, 'rank': rank, 'data': post.as_dict()}
+                for rank, post in enumerate(result['posts'])
+            )
+    items.sort(key=lambda item: item['timestamp'], reverse=True)
+    return JsonResponse({'success': True, 'items': items, 'sources': sources})
+
+@login_required
+def fetch_feed(request):
+    try:
+        profile = get_profile(request.user)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Profile not found.'})
+
+    sources = _feed_sources(profile, get_sources(profile.user_id))
+    futures = [feed_executor.submit(_fetch_feed_source, profile, kind, name) for kind, name in sources]
+    wait(futures, timeout=FEED_TIMEOUT)
+    results = []
+    for (kind, name), future in zip(sources, futures):
+        result = None
+        if future.done() and future.exception() is None:
+            result = future.result()
+        results.append((kind, name, result))
+    return _feed_response(results)
 
 # ----- Reddit post a new submission -----
 @login_required
@@ -232,12 +660,8 @@ def comment_on_reddit_post(request):
             return JsonResponse({'success': False, 'error': 'Missing post ID or comment'})
 
         try:
-            profile = UserProfile.objects.get(user=request.user)
-            reddit = praw.Reddit(
-                client_id=profile.reddit_client_id,
-                client_secret=profile.reddit_client_secret,
-                user_agent=profile.reddit_user_agent,
-            )
+            profile = get_profile(request.user)
+            reddit = get_reddit(profile)
 
             submission = reddit.submission(id=post_id)
             submission.reply(comment_text)
@@ -254,7 +678,7 @@ def comment_on_reddit_post(request):
 def post_to_reddit(request):
     if request.method == "POST":
         try:
-            profile = UserProfile.objects.get(user=request.user)
+            profile = get_profile(request.user)
         except UserProfile.DoesNotExist:
             return JsonResponse({'success': False, 'error': 'Reddit profile not found'})
 
@@ -265,11 +689,7 @@ def post_to_reddit(request):
         if not title:
             return JsonResponse({'success': False, 'error': 'Title is required'})
 
-        reddit = praw.Reddit(
-            client_id=profile.reddit_client_id,
-            client_secret=profile.reddit_client_secret,
-            user_agent=profile.reddit_user_agent,
-        )
+        reddit = get_reddit(profile)
 
         subreddit = reddit.subreddit(profile.reddit_subreddit)
         try:
@@ -284,18 +704,28 @@ def post_to_reddit(request):
 
 # ----- Schedule a Reddit post -----
 @login_required
+@hashing_uploads
 def schedule_reddit_post(request):
     if request.method == "POST":
+        try:
+            upload = uploaded_media(request)
+        except InvalidMedia as e:
+            messages.error(request, str(e))
+            return redirect('dashboard')
         form = RedditPostForm(request.POST, request.FILES)
         if form.is_valid():
             scheduled_post = form.save(commit=False)
             scheduled_post.user = request.user
             if is_naive(scheduled_post.scheduled_time):
                 scheduled_post.scheduled_time = make_aware(scheduled_post.scheduled_time)
-            # Save uploaded media if present
-            if 'media' in request.FILES:
-                scheduled_post.media = request.FILES['media']
+            if upload:
+                try:
+                    scheduled_post.media = store_upload(upload)
+                except InvalidMedia as e:
+                    messages.error(request, str(e))
+                    return redirect('dashboard')
             scheduled_post.save()
+            schedule_engine.notify('reddit', scheduled_post.pk, scheduled_post.scheduled_time)
             messages.success(request, "Post scheduled successfully.")
             return redirect('dashboard')
         else:
@@ -304,100 +734,103 @@ def schedule_reddit_post(request):
     else:
         return redirect('dashboard')
 
-# ----- Background function to post scheduled Reddit posts -----
-def reddit_scheduler():
-    import django
-    import os
-
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_dashboard.settings')
-    django.setup()
-
-    from django.utils import timezone
-    from dashboard.models import RedditPostSchedule
-
-    while True:
-        now = timezone.now()
-        pending_posts = RedditPostSchedule.objects.filter(posted=False, scheduled_time__lte=now)
-        for post in pending_posts:
-            try:
-                profile = UserProfile.objects.get(user=post.user)
-                reddit = praw.Reddit(
-                    client_id=profile.reddit_client_id,
-                    client_secret=profile.reddit_client_secret,
-                    user_agent=profile.reddit_user_agent,
-                )
-                subreddit = reddit.subreddit(profile.reddit_subreddit)
-
-                if post.url:
-                    subreddit.submit(title=post.title, url=post.url)
-                else:
-                    subreddit.submit(title=post.title, selftext=post.content)
-
-                post.posted = True
-                post.save()
-                print(f"Posted scheduled post {post.id} by {post.user.username}")
-            except Exception as e:
-                print(f"Error posting scheduled post {post.id}: {e}")
-
-        time.sleep(60)  # Check every 1 minute
-
-# Uncomment below to start scheduler thread automatically when app starts (optional)
-scheduler_thread = threading.Thread(target=reddit_scheduler, daemon=True)
-scheduler_thread.start()
-
 @login_required
+@hashing_uploads
 def schedule_discord_message(request):
     if request.method == "POST":
+        try:
+            upload = uploaded_media(request)
+        except InvalidMedia as e:
+            return JsonResponse({'success': False, 'error': str(e)})
         message = request.POST.get('message', '').strip()
         scheduled_time = request.POST.get('scheduled_time')
-        if not message or not scheduled_time:
+        if not (message or upload) or not scheduled_time:
             return JsonResponse({'success': False, 'error': 'Message and time required'})
         try:
             scheduled_dt = datetime.fromisoformat(scheduled_time)
             if is_naive(scheduled_dt):
                 scheduled_dt = make_aware(scheduled_dt)
-            DiscordMessageSchedule.objects.create(
+            scheduled = DiscordMessageSchedule.objects.create(
                 user=request.user,
+                channel_id=get_profile(request.user).discord_channel_id,
                 message=message,
+                media=store_upload(upload) if upload else None,
                 scheduled_time=scheduled_dt
             )
+            schedule_engine.notify('discord', scheduled.pk, scheduled.scheduled_time)
             return JsonResponse({'success': True})
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)})
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
-def discord_scheduler():
-    import django
-    import os
-
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_dashboard.settings')
-    django.setup()
-
-    from dashboard.models import DiscordMessageSchedule, UserProfile
-
-    while True:
-        now = timezone.now()
-        pending = DiscordMessageSchedule.objects.filter(sent=False, scheduled_time__lte=now)
-        for msg in pending:
-            try:
-                profile = UserProfile.objects.get(user=msg.user)
-                headers = {
-                    "Authorization": f"Bot {profile.discord_bot_token}",
-                    "Content-Type": "application/json"
-                }
-                payload = {"content": msg.message}
-                response = requests.post(
-                    f"https://discord.com/api/v10/channels/{profile.discord_channel_id}/messages",
-                    json=payload,
-                    headers=headers
-                )
-                if response.status_code in [200, 201, 204]:
-                    msg.sent = True
-                    msg.save()
-            except Exception as e:
-                print(f"Error sending scheduled Discord message {msg.id}: {e}")
-        time.sleep(30)  # Check every 30 seconds
-
-# Uncomment below to start scheduler thread automatically when app starts (optional)
-scheduler_thread = threading.Thread(target=discord_scheduler, daemon=True)
-scheduler_thread.start()
+# ----- Bulk scheduling -----
+@login_required
+def bulk_schedule(request):
+    """Schedule posts and messages from an uploaded CSV or JSONL file (see bulk.py)."""
+    if request.method != "POST":
+        return JsonResponse({'success': False, 'error': 'Invalid request method'})
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'success': False, 'error': 'No file uploaded'})
+    format = request.POST.get('format') or bulk.guess_format(upload.name)
+    if format not in bulk.FORMATS:
+        return JsonResponse({'success': False, 'error': 'format must be csv or jsonl'})
+    default_kind = request.POST.get('type') or None
+    if default_kind is not None and default_kind not in bulk.KINDS:
+        return JsonResponse({'success': False, 'error': "type must be 'reddit' or 'discord'"})
+
+    # Iterating an upload reads it a chunk at a time, from disk if it's large.
+    lines = codecs.iterdecode(upload, 'utf-8-sig', errors='replace')
+    result = bulk.import_schedules(request.user, lines, format, default_kind)
+    schedule_engine.resync()
+    return JsonResponse({
+        'success': True,
+        'created': result.created,
+        'error_count': result.error_count,
+        'errors': [{'line': line, 'error': error} for line, error in result.errors],
+    })
+
+# ----- Media proxy -----
+def proxy_media(request):
+    """
+    Serve a Discord/Reddit image or video from the media proxy's cache (see
+    media_proxy.py). URLs come signed from ``proxy_url``, so no login is
+    needed and images load without a session lookup.
+    """
+    url = request.GET.get('url', '')
+    size = request.GET.get('size') or None
+    if not constant_time_compare(request.GET.get('sig', ''), signature(url, size)):
+        return HttpResponse(status=403)
+    if urlsplit(url).hostname not in media_proxy.hosts:
+        return HttpResponse(status=403)
+    if size is not None:
+        if not size.isdigit() or int(size) not in media_proxy.sizes:
+            return HttpResponse(status=400)
+        size = int(size)
+    try:
+        entry = media_proxy.get(url, size)
+    except TooLarge:
+        return HttpResponseRedirect(url)
+    except ProxyError as e:
+        return HttpResponse(str(e), status=502, content_type='text/plain')
+
+    etag = f'"{entry.digest}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(open(entry.path, 'rb'), content_type=entry.content_type)
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={media_proxy.ttl}'
+    return response
+
+# ----- Metrics -----
+def metrics_view(request):
+    """
+    This process's metrics in the Prometheus text format (see metrics.py),
+    for staff or requests with the METRICS_TOKEN bearer token.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    has_token = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not (has_token or request.user.is_staff):
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
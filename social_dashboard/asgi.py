@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_dashboard.settings')
+# Lets settings enable the async-only endpoints (e.g. the Discord stream).
+os.environ.setdefault('DASHBOARD_ASGI', '1')
 
 application = get_asgi_application()
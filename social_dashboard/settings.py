@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'dashboard.middleware.metrics_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -122,7 +125,166 @@ LOGIN_URL = '/login/'
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 
+# Uploaded attachments and their thumbnails (dashboard/media.py).
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+# Attachments are streamed to a temporary file on disk and hashed as they
+# arrive (see dashboard/media.py); larger ones are cut off.
+MEDIA_MAX_UPLOAD_SIZE = 512 * 1024 * 1024
+# Thumbnails are generated in the background on this many threads; videos
+# need ffmpeg on the PATH (or MEDIA_FFMPEG) and images need Pillow.
+MEDIA_THUMBNAIL_WORKERS = 2
+MEDIA_THUMBNAIL_SIZE = 320
+MEDIA_FFMPEG = 'ffmpeg'
+
+# Discord avatars and Reddit images/videos in API responses point at
+# /api/media/proxy/, which serves them from an on-disk LRU cache of at most
+# MEDIA_PROXY_CACHE_BYTES (dashboard/media_proxy.py). Files are revalidated
+# after the upstream's max-age or MEDIA_PROXY_TTL seconds; larger files than
+# MEDIA_PROXY_MAX_FILE_SIZE are linked to directly. Images are resized to one
+# of MEDIA_PROXY_SIZES when Pillow is installed.
+MEDIA_PROXY_ENABLED = True
+MEDIA_PROXY_ROOT = MEDIA_ROOT / 'proxy'
+MEDIA_PROXY_CACHE_BYTES = 512 * 1024 * 1024
+MEDIA_PROXY_MAX_FILE_SIZE = 20 * 1024 * 1024
+MEDIA_PROXY_TTL = 86400
+MEDIA_PROXY_SIZES = (64, 320, 640)
+MEDIA_PROXY_HOSTS = [
+    'cdn.discordapp.com', 'media.discordapp.net',
+    'i.redd.it', 'preview.redd.it', 'external-preview.redd.it', 'v.redd.it', 'i.imgur.com',
+]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Discord channel messages are cached per channel for this many seconds and
+# shared by every dashboard polling that channel.
+DISCORD_MESSAGE_CACHE_TTL = 5
+DISCORD_MESSAGE_CACHE_SIZE = 1024
+
+# Set by social_dashboard/asgi.py. Streaming responses hold a connection open,
+# so they are only enabled when served by an ASGI server such as uvicorn.
+DASHBOARD_ASGI = os.environ.get('DASHBOARD_ASGI') == '1'
+DISCORD_STREAMING = DASHBOARD_ASGI
+# Where the stream gets new messages from: 'gateway' (discord.py, needs the
+# bot's Message Content intent), 'polling' (REST, one poller per channel) or
+# 'local' (in-process stand-in for tests). The poller reads the message
+# cache every DISCORD_STREAM_POLL_INTERVAL seconds; Discord itself is asked
+# once per DISCORD_MESSAGE_CACHE_TTL.
+DISCORD_STREAM_SOURCE = 'polling'
+DISCORD_STREAM_POLL_INTERVAL = 1
+DISCORD_STREAM_HEARTBEAT = 15
+
+# PRAW clients are shared per Reddit app credentials; idle ones are closed.
+REDDIT_CLIENT_POOL_SIZE = 64
+REDDIT_CLIENT_IDLE_TIMEOUT = 900
+
+# Pages of subreddit listings are shared between users for this many seconds.
+REDDIT_LISTING_CACHE_TTL = 30
+REDDIT_LISTING_CACHE_SIZE = 1024
+# Listings carry this many characters of a self post's text; the rest is
+# fetched when the user expands the post.
+REDDIT_SELFTEXT_PREVIEW = 500
+REDDIT_SELFTEXT_CACHE_TTL = 300
+
+# Channels and first subreddit pages requested in the last
+# PREFETCH_IDLE_TIMEOUT seconds are refreshed in the background once
+# PREFETCH_REFRESH_AHEAD of their TTL has passed, for at most
+# PREFETCH_MAX_SOURCES sources per process (dashboard/prefetch.py).
+PREFETCH_MAX_SOURCES = 256
+PREFETCH_IDLE_TIMEOUT = 300
+PREFETCH_REFRESH_AHEAD = 0.8
+PREFETCH_WORKERS = 8
+
+# /api/feed/ fetches a user's sources in parallel on this many threads (sync
+# views only) and gives up on any source slower than FEED_TIMEOUT seconds.
+FEED_MAX_WORKERS = 32
+FEED_TIMEOUT = 10
+
+# Fetched messages and posts are archived locally (dashboard/archive.py),
+# written in batches of ARCHIVE_BATCH_SIZE every ARCHIVE_FLUSH_INTERVAL
+# seconds by a background thread. History pages of HISTORY_PAGE_SIZE items
+# are read from the archive and only fetched upstream to fill gaps.
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_FLUSH_INTERVAL = 1
+ARCHIVE_MAX_PENDING = 50000
+HISTORY_PAGE_SIZE = 50
+
+# /api/search/ searches the archive (dashboard/search.py), SEARCH_PAGE_SIZE
+# results per page.
+SEARCH_PAGE_SIZE = 20
+
+# Discord REST client (dashboard/discord_api.py).
+DISCORD_API_BASE = 'https://discord.com/api/v10'
+DISCORD_API_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+DISCORD_API_MAX_RETRIES = 3
+DISCORD_MAX_RATE_LIMIT_WAIT = 30
+DISCORD_HTTP_POOL_SIZE = 32
+
+# Under ASGI the Discord/Reddit endpoints are async views sharing one aiohttp
+# connection pool per process (dashboard/async_http.py).
+ASYNC_HTTP_POOL_SIZE = 1000
+ASYNC_HTTP_TIMEOUT = 10  # seconds per request
+REDDIT_OAUTH_BASE = 'https://oauth.reddit.com'
+REDDIT_TOKEN_URL = 'https://www.reddit.com/api/v1/access_token'
+
+# The scheduler sleeps until the next item is due; it also re-reads the
+# schedule tables this often (seconds) to pick up rows created elsewhere.
+SCHEDULER_RESYNC_INTERVAL = 300
+# Failed items are retried after SCHEDULER_RETRY_DELAY seconds, doubling on
+# each attempt up to SCHEDULER_MAX_RETRY_DELAY, and marked failed after
+# SCHEDULER_MAX_ATTEMPTS attempts.
+SCHEDULER_RETRY_DELAY = 60
+SCHEDULER_MAX_RETRY_DELAY = 3600
+SCHEDULER_MAX_ATTEMPTS = 10
+# Due items are sent from a pool of this many threads, with at most this
+# many Reddit posts in flight per user. Discord messages are sent one at a
+# time per channel, in order.
+SCHEDULER_MAX_WORKERS = 16
+SCHEDULER_REDDIT_CONCURRENCY_PER_ACCOUNT = 1
+# Messages sent from the dashboard go through the scheduler as an outbox;
+# they are retried sooner, starting after this many seconds.
+DISCORD_OUTBOX_RETRY_DELAY = 5
+DISCORD_OUTBOX_MAX_ATTEMPTS = 8
+# How long a process owns the items it claimed before others may retry them.
+SCHEDULER_LEASE_SECONDS = 600
+
+# Profiles (API credentials) are cached in-process for PROFILE_CACHE_TTL
+# seconds and invalidated on save. Set PROFILE_CACHE_ALIAS to a shared entry
+# of CACHES (e.g. Redis) to share them between processes as well.
+PROFILE_CACHE_TTL = 60
+PROFILE_CACHE_SIZE = 4096
+PROFILE_CACHE_ALIAS = None
+PROFILE_SHARED_CACHE_TTL = 3600
+
+# Metrics are served in the Prometheus text format at /metrics, to staff and
+# to scrapers sending "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Requests slower than this (seconds) are logged as warnings.
+SLOW_REQUEST_SECONDS = 1
+
+# The dashboard logs one JSON object per line; DASHBOARD_LOG_LEVEL=DEBUG also
+# logs every request and upstream call with its timing.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'dashboard.log.JsonFormatter'},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler', 'formatter': 'json',
+            # Kept out of `manage.py test` output; tests check logs with assertLogs.
+            'level': 'CRITICAL' if sys.argv[1:2] == ['test'] else 'NOTSET',
+        },
+    },
+    'loggers': {
+        'dashboard': {
+            'handlers': ['console'],
+            'level': os.environ.get('DASHBOARD_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
@@ -14,6 +14,8 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView
@@ -23,3 +25,6 @@ urlpatterns = [
     path('accounts/login/', RedirectView.as_view(url='/login/', permanent=False)),
     path('', include('dashboard.urls')),  # Include your app URLs
 ]
+
+# Uploaded media is served by the web server in production.
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)